@@ -2,10 +2,29 @@ import os
 import json
 import sys
 import asyncio
+import time
+import uuid
+from contextlib import AsyncExitStack, aclosing, nullcontext
 from typing import List, Dict, Optional, AsyncGenerator
 from pydantic import BaseModel
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from llm_client import client_registry, circuit_breakers, slot_limiters, single_flight, usage_stats, usage_to_dict, CircuitOpenError, QueueFullError, LLMEvent, LLMStream, RetryPolicy, LLM_SINGLE_FLIGHT
+from llm_cache import response_cache
+from llm_router import backend_pool, LLM_STICKY_ROUTING
+from context_builder import WorkspaceContext, build_workspace_context, context_budget, estimate_tokens, is_artifact
+from symbol_index import symbol_index
+from prompt_builder import PromptBuilder, WORKSPACE, PLAN, REQUEST
+from pipeline import Pipeline, Stage
+from patching import PatchError, apply_patches, parse_unified_diff
+from workspaces import InvalidPathError, Workspace, workspace_manager
+from processes import ProcessRun
+from pytest_runner import PytestRun, collect_test_ids, estimate_test_count, plan_shards, shard_count, TEST_SHARD_MIN_TESTS
+from dep_cache import DependencyBuildError, dependency_cache
+from warm_runner import warm_runner
+from sandboxes import sandbox_pool
+from impact_analysis import TestImpact, is_test_file, TEST_IMPACT, TEST_IMPACT_COVERAGE
+from checkpoints import CheckpointStore, checkpoint_store, portable_config
+from failures import FailureTracker, fingerprint_failure, implicated_files, log_excerpt, AUTO_FIX_REPEAT_LIMIT
 
 load_dotenv()
 
@@ -24,8 +43,26 @@ else:
     BASE_URL = os.getenv("OPENAI_BASE_URL")
     API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL)
-client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL)
+LLM_STREAM = os.getenv("LLM_STREAM", "true").lower() == "true"
+# "full", "signatures" or "auto" (signatures only once the full dump exceeds the context budget)
+CONTEXT_VIEW = os.getenv("CONTEXT_VIEW", "auto")
+# Ask for token usage on streamed responses: "auto" (OpenAI only), "true" or "false".
+LLM_STREAM_INCLUDE_USAGE = os.getenv("LLM_STREAM_INCLUDE_USAGE", "auto").lower()
+# Speculative auto-fix: Generator + Tester candidates raced per iteration (1 disables it).
+AUTO_FIX_CANDIDATES = int(os.getenv("AUTO_FIX_CANDIDATES", "1"))
+# Total prompt + completion tokens the candidates of one iteration may spend (0 = no cap).
+AUTO_FIX_CANDIDATE_TOKEN_CAP = int(os.getenv("AUTO_FIX_CANDIDATE_TOKEN_CAP", "0"))
+# Send only the files implicated by failing tests and accept diffs from the Generator.
+AUTO_FIX_INCREMENTAL = os.getenv("AUTO_FIX_INCREMENTAL", "true").lower() == "true"
+# Temperature offsets from the base temperature, cycled over candidates.
+CANDIDATE_TEMPERATURE_OFFSETS = [0.0, 0.2, -0.2, 0.4, -0.4]
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.25"))
+# Seconds before a pytest run / dependency install is killed.
+TEST_TIMEOUT = float(os.getenv("TEST_TIMEOUT", "300"))
+PIP_INSTALL_TIMEOUT = float(os.getenv("PIP_INSTALL_TIMEOUT", "600"))
+# Test output is streamed as appended chunks, flushed every interval or once this many bytes are pending.
+LOG_STREAM_INTERVAL = float(os.getenv("LOG_STREAM_INTERVAL", "0.05"))
+LOG_STREAM_BYTES = int(os.getenv("LOG_STREAM_BYTES", "4096"))
 
 class AgentResponse(BaseModel):
     agent_name: str
@@ -34,63 +71,294 @@ class AgentResponse(BaseModel):
     files: Optional[Dict[str, str]] = None
     is_error: bool = False
     clear_history: bool = False
+    is_partial: bool = False
+    partial_output: Optional[str] = None
+    stream_reset: bool = False
+    usage: Optional[Dict] = None
+    fingerprint: Optional[Dict] = None
+    # Append-only log streaming: `log_chunk` goes at `log_offset` of `log_file`.
+    log_file: Optional[str] = None
+    log_chunk: Optional[str] = None
+    log_offset: Optional[int] = None
 
 class Agent:
-    def __init__(self, name: str, role: str):
+    def __init__(self, name: str, role: str, retry_policy: Optional[RetryPolicy] = None):
         self.name = name
         self.role = role
+        self.retry_policy = retry_policy or RetryPolicy()
 
-    async def call_llm(self, system_prompt: str, user_prompt: str, config: Optional[Dict] = None) -> str:
+    def get_retry_policy(self, config: Optional[Dict] = None) -> RetryPolicy:
+        config = config or {}
+        overrides = {
+            **(config.get("retry_policy") or {}),
+            **((config.get("agent_retry_policies") or {}).get(self.name) or {}),
+        }
+        if not overrides:
+            return self.retry_policy
+        return self.retry_policy.model_copy(update=overrides)
+
+    def resolve_endpoint(self, config: Optional[Dict] = None) -> Dict:
+        local_mode = USE_LOCAL_LLM
+        if config and "use_local_llm" in config:
+            local_mode = config["use_local_llm"]
+
+        if local_mode:
+            effective_api_key = "lm-studio"
+            effective_model = LLM_MODEL if local_mode == USE_LOCAL_LLM else "local-model"
+            
+            if os.getenv("RUNNING_IN_DOCKER") == "true":
+                 fallback_url = "http://host.docker.internal:1234/v1"
+            else:
+                 fallback_url = "http://localhost:1234/v1"
+            effective_base_url = os.getenv("OPENAI_BASE_URL", fallback_url)
+            timeout_val = 240.0
+        else:
+            effective_api_key = os.getenv("OPENAI_API_KEY")
+            effective_model = LLM_MODEL if local_mode == USE_LOCAL_LLM else "gpt-4o-mini"
+            effective_base_url = os.getenv("OPENAI_BASE_URL")
+
+            if config and config.get("api_key"):
+                effective_api_key = config["api_key"]
+            
+            timeout_val = 60.0
+
+        return {
+            "local": bool(local_mode),
+            "api_key": effective_api_key,
+            "model": effective_model,
+            "base_url": effective_base_url,
+            "timeout": timeout_val,
+        }
+
+    async def call_llm(self, system_prompt: str, user_prompt: str, config: Optional[Dict] = None, stream: bool = False):
+        if stream:
+            return self.stream_llm(system_prompt, user_prompt, config)
+        return await LLMStream(self._llm_source(system_prompt, user_prompt, config, stream=False)).read()
+
+    def stream_llm(self, system_prompt: str, user_prompt: str, config: Optional[Dict] = None) -> LLMStream:
+        use_stream = LLM_STREAM
+        if config and "stream" in config:
+            use_stream = bool(config["stream"])
+        return LLMStream(self._llm_source(system_prompt, user_prompt, config, stream=use_stream))
+
+    def _llm_source(self, system_prompt: str, user_prompt: str, config: Optional[Dict], stream: bool) -> AsyncGenerator[LLMEvent, None]:
+        factory = lambda: self._llm_events(system_prompt, user_prompt, config, stream)
+        if not (config or {}).get("single_flight", LLM_SINGLE_FLIGHT):
+            return factory()
         try:
-            local_mode = USE_LOCAL_LLM
-            if config and "use_local_llm" in config:
-                local_mode = config["use_local_llm"]
+            endpoint = self.resolve_endpoint(config)
+        except Exception:
+            return factory()
+        # mock_fallback differs per agent, so the agent is part of the identity.
+        key = single_flight.make_key(
+            self.name,
+            endpoint["base_url"],
+            endpoint["model"],
+            client_registry.make_key(None, endpoint["api_key"], 0)[1],
+            (config or {}).get("temperature", 0.7),
+            (config or {}).get("seed"),
+            (config or {}).get("use_cache", True),
+            system_prompt,
+            user_prompt,
+        )
+        return single_flight.subscribe(key, factory)
 
-            if local_mode:
-                effective_api_key = "lm-studio"
-                effective_model = LLM_MODEL if local_mode == USE_LOCAL_LLM else "local-model"
-                
-                if os.getenv("RUNNING_IN_DOCKER") == "true":
-                     fallback_url = "http://host.docker.internal:1234/v1"
-                else:
-                     fallback_url = "http://localhost:1234/v1"
-                effective_base_url = os.getenv("OPENAI_BASE_URL", fallback_url)
-                timeout_val = 240.0
-            else:
-                effective_api_key = os.getenv("OPENAI_API_KEY")
-                effective_model = LLM_MODEL if local_mode == USE_LOCAL_LLM else "gpt-4o-mini"
-                effective_base_url = os.getenv("OPENAI_BASE_URL")
+    async def _llm_events(self, system_prompt: str, user_prompt: str, config: Optional[Dict], stream: bool) -> AsyncGenerator[LLMEvent, None]:
+        try:
+            endpoint = self.resolve_endpoint(config)
+        except Exception:
+            yield LLMEvent(kind="delta", text=self.mock_fallback(user_prompt))
+            return
 
-                if config and config.get("api_key"):
-                    effective_api_key = config["api_key"]
-                
-                timeout_val = 60.0
-                
-                if not effective_api_key:
-                     return "Error: OpenAI API Key is missing on backend."
+        if not endpoint["api_key"]:
+            yield LLMEvent(kind="delta", text="Error: OpenAI API Key is missing on backend.")
+            return
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        temperature = (config or {}).get("temperature", 0.7)
+
+        cache_key = None
+        if response_cache and (config or {}).get("use_cache", True):
+            cache_key = response_cache.make_key(endpoint["model"], system_prompt, user_prompt, temperature)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                yield LLMEvent(kind="delta", text=cached)
+                return
+
+        policy = self.get_retry_policy(config)
+        routed = endpoint["local"] and backend_pool.enabled
+        sticky_key = None
+        if routed and (config or {}).get("sticky_routing", LLM_STICKY_ROUTING):
+            sticky_key = (config or {}).get("workflow_id")
+
+        for attempt in range(1, policy.max_attempts + 1):
+            received = False
+            chunks = []
+            delay = 0.0
+            node = backend_pool.select(sticky_key) if routed else None
+            base_url = node.url if node else endpoint["base_url"]
+            if node:
+                backend_pool.acquire(node)
+            try:
+                breaker = circuit_breakers.get(base_url)
+                limiter = slot_limiters.get(base_url)
+
+                try:
+                    breaker.before_call()
+                except CircuitOpenError as e:
+                    print(f"{self.name}: {e}")
+                    if node and attempt < policy.max_attempts:
+                        backend_pool.mark_failure(node)
+                        continue
+                    yield LLMEvent(kind="notice", text=f"{e}. Failing fast.")
+                    break
 
-            temp_client = AsyncOpenAI(api_key=effective_api_key, base_url=effective_base_url)
+                try:
+                    async with aclosing(limiter.acquire()) as positions:
+                        async for position in positions:
+                            yield LLMEvent(kind="notice", text=f"Waiting for model slot {position}/{limiter.queued} (max {limiter.max_in_flight} in flight)...")
+                except QueueFullError as e:
+                    breaker.release()
+                    print(f"{self.name}: {e}")
+                    yield LLMEvent(kind="notice", text=f"{e}. Try again later.")
+                    break
+                except (asyncio.CancelledError, GeneratorExit):
+                    breaker.release()
+                    raise
 
-            for attempt in range(3):
                 try:
-                    response = await temp_client.chat.completions.create(
-                        model=effective_model,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        temperature=0.7,
-                        timeout=timeout_val 
-                    )
-                    return response.choices[0].message.content
+                    async with client_registry.lease(base_url, endpoint["api_key"], endpoint["timeout"]) as llm_client:
+                        started = time.monotonic()
+                        first_token_ms = None
+                        async for event in self._request_completion(llm_client, endpoint, messages, temperature, stream, (config or {}).get("seed")):
+                            if event.kind == "usage":
+                                event.usage["ttft_ms"] = first_token_ms
+                                event.usage["latency_ms"] = round((time.monotonic() - started) * 1000)
+                                usage_stats.record(endpoint["model"], event.usage)
+                                print(f"{self.name}: prompt {event.usage['prompt_tokens']} tokens ({event.usage['cached_tokens']} cached), TTFT {first_token_ms}ms")
+                                yield event
+                                continue
+                            if first_token_ms is None:
+                                first_token_ms = round((time.monotonic() - started) * 1000)
+                            received = True
+                            chunks.append(event.text)
+                            yield event
+                    breaker.record_success()
+                    if node:
+                        backend_pool.mark_success(node)
+                    if cache_key and chunks:
+                        await response_cache.put(cache_key, "".join(chunks), {"agent": self.name, "model": endpoint["model"]})
+                    return
+                except (asyncio.CancelledError, GeneratorExit):
+                    breaker.release()
+                    raise
                 except Exception as e:
-                    import traceback
-                    if attempt == 2:
-                        return self.mock_fallback(user_prompt)
-                    await asyncio.sleep(2)
-            return self.mock_fallback(user_prompt)
-        except Exception as e:
-            return self.mock_fallback(user_prompt)
+                    if policy.is_retryable(e):
+                        breaker.record_failure()
+                        if node:
+                            backend_pool.mark_failure(node)
+                    else:
+                        breaker.release()
+                    print(f"{self.name}: LLM call to {base_url} failed (attempt {attempt}/{policy.max_attempts}): {e}")
+                    if received:
+                        yield LLMEvent(kind="reset")
+                    if attempt >= policy.max_attempts or not policy.is_retryable(e):
+                        break
+                    delay = policy.compute_delay(attempt, e)
+                    yield LLMEvent(kind="notice", text=f"LLM request failed ({e.__class__.__name__}), retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.max_attempts})...")
+                finally:
+                    limiter.release()
+            finally:
+                if node:
+                    backend_pool.release(node)
+            # Back off without holding a model slot.
+            await asyncio.sleep(delay)
+        yield LLMEvent(kind="delta", text=self.mock_fallback(user_prompt))
+
+    async def _request_completion(self, llm_client, endpoint: Dict, messages: List[Dict], temperature: float, stream: bool, seed: Optional[int] = None) -> AsyncGenerator[LLMEvent, None]:
+        extra = {}
+        if seed is not None:
+            extra["seed"] = seed
+        if stream:
+            if LLM_STREAM_INCLUDE_USAGE == "true" or (LLM_STREAM_INCLUDE_USAGE == "auto" and not endpoint["local"]):
+                extra["stream_options"] = {"include_usage": True}
+            response = await llm_client.chat.completions.create(
+                model=endpoint["model"],
+                messages=messages,
+                temperature=temperature,
+                timeout=endpoint["timeout"],
+                stream=True,
+                **extra
+            )
+            try:
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        yield LLMEvent(kind="usage", usage=usage_to_dict(chunk.usage))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield LLMEvent(kind="delta", text=delta)
+            finally:
+                # Drop the connection right away so a cancelled workflow
+                # stops the server from generating the rest.
+                await response.close()
+        else:
+            response = await llm_client.chat.completions.create(
+                model=endpoint["model"],
+                messages=messages,
+                temperature=temperature,
+                timeout=endpoint["timeout"],
+                **extra
+            )
+            yield LLMEvent(kind="delta", text=response.choices[0].message.content or "")
+            if getattr(response, "usage", None):
+                yield LLMEvent(kind="usage", usage=usage_to_dict(response.usage))
+
+    async def relay_stream(self, llm_stream: LLMStream, status: str) -> AsyncGenerator[AgentResponse, None]:
+        loop = asyncio.get_running_loop()
+        pending = []
+        last_flush = loop.time()
+        async for event in llm_stream:
+            if event.kind == "reset":
+                pending = []
+                yield AgentResponse(agent_name=self.name, content=status, is_partial=True, stream_reset=True)
+                continue
+            if event.kind == "notice":
+                yield AgentResponse(agent_name=self.name, content=event.text)
+                continue
+            if event.kind == "usage":
+                yield AgentResponse(agent_name=self.name, content=status, is_partial=True, usage=event.usage)
+                continue
+            pending.append(event.text)
+            if loop.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+                yield AgentResponse(agent_name=self.name, content=status, is_partial=True, partial_output="".join(pending))
+                pending = []
+                last_flush = loop.time()
+        if pending:
+            yield AgentResponse(agent_name=self.name, content=status, is_partial=True, partial_output="".join(pending))
+
+    def build_context(self, files: Dict[str, str], query: str, config: Optional[Dict] = None, reserved_text: str = "") -> WorkspaceContext:
+        model = self.resolve_endpoint(config)["model"]
+        budget = context_budget(model, config)
+        return build_workspace_context(files, query, model, budget, estimate_tokens(reserved_text, model))
+
+    def code_view(self, files: Dict[str, str], config: Optional[Dict], render_full) -> str:
+        view = (config or {}).get("context_view", CONTEXT_VIEW)
+        if view == "full":
+            return render_full(files)
+        if view == "auto":
+            full = render_full(files)
+            model = self.resolve_endpoint(config)["model"]
+            if estimate_tokens(full, model) <= context_budget(model, config):
+                return full
+        sources = {k: v for k, v in files.items() if not is_artifact(k)}
+        if not sources:
+            return ""
+        return "Workspace symbol index (signatures only):\n" + symbol_index.render(sources)
 
     def mock_fallback(self, user_prompt: str) -> str:
         return "Error: LLM Failed to generate code."
@@ -99,8 +367,8 @@ class Agent:
         raise NotImplementedError
 
 class SystemArchitect(Agent):
-    def __init__(self):
-        super().__init__("System Architect", "Design technical architecture")
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        super().__init__("System Architect", "Design technical architecture", retry_policy)
     
     def mock_fallback(self, user_prompt: str) -> str:
         return "Architecture Plan: \n- Backend: Python (FastAPI)\n- Frontend: React (Vite)\n- Database: SQLite (if needed)"
@@ -111,9 +379,9 @@ class SystemArchitect(Agent):
         config = previous_context.get("config")
         language = config.get("language", "Python")
         
-        system_prompt = f"""You are a System Architect. 
+        system_prompt = """You are a System Architect. 
         Analyze the user's request and propose a technical stack and file structure.
-        Target Programming Language: {language}
+        Use the Target Programming Language given alongside the User Request.
         
         CRITICAL: Base your design STRICTLY on the User Request. Do not add unnecessary features.
 
@@ -133,12 +401,20 @@ class SystemArchitect(Agent):
         
 
         
-        existing_files_str = ""
+        prompt = PromptBuilder()
         files = previous_context.get("files", {})
         if files:
-            existing_files_str = "\n\nExisting Files:\n" + "\n".join([f"--- {k} ---\n{v}\n" for k, v in files.items()])
-
-        response_text = await self.call_llm(system_prompt, f"User Request: {input_data}{existing_files_str}", config)
+            workspace_context = self.build_context(files, input_data, config, reserved_text=system_prompt + input_data)
+            prompt.add_files("Existing Files", workspace_context.full_files)
+            prompt.add(workspace_context.LISTING_TITLE, workspace_context.render_listing(), WORKSPACE)
+            yield AgentResponse(agent_name=self.name, content=workspace_context.summary())
+        prompt.add("Target Programming Language", language, REQUEST)
+        prompt.add("User Request", input_data, REQUEST)
+
+        llm_stream = self.stream_llm(system_prompt, prompt.build(), config)
+        async for frame in self.relay_stream(llm_stream, "Analyzing request and designing architecture..."):
+            yield frame
+        response_text = llm_stream.text
         
         import re
         response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL).strip()
@@ -153,20 +429,30 @@ class SystemArchitect(Agent):
         )
 
 class CodeGenerator(Agent):
-    def __init__(self):
-        super().__init__("Code Generator", "Generate code")
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        super().__init__("Code Generator", "Generate code", retry_policy)
 
     def mock_fallback(self, user_prompt: str) -> str:
         return "Error: LLM Failed to generate code."
 
     async def process(self, input_data: str, previous_context: Dict) -> AsyncGenerator[AgentResponse, None]:
-        yield AgentResponse(agent_name=self.name, content="Generating application code (this may take a moment)...")
-
         config = previous_context.get("config")
         language = config.get("language", "Python")
 
-        system_prompt = f"""You are an expert Programmer.
-        Generate the actual code for the requested application in {language}.
+        fix_scope = previous_context.get("fix_scope")
+        if fix_scope:
+            patched = None
+            async for frame in self.generate_patch(input_data, previous_context, fix_scope):
+                if frame.files and not frame.is_partial:
+                    patched = frame
+                yield frame
+            if patched:
+                return
+
+        yield AgentResponse(agent_name=self.name, content="Generating application code (this may take a moment)...")
+
+        system_prompt = """You are an expert Programmer.
+        Generate the actual code for the requested application in the Target Programming Language given with the request.
         
         CRITICAL INSTRUCTIONS:
         1. **Follow the Architect's Plan**: You MUST generate code for EVERY file listed in the "Architect's Plan" below. Do not skip any files.
@@ -203,14 +489,25 @@ class CodeGenerator(Agent):
         
 
         
-        existing_files_str = ""
+        prompt = PromptBuilder()
         files = previous_context.get("files", {})
+        plan = previous_context.get('architect_plan', '')
         if files:
-            existing_files_str = "\n\nExisting Files:\n" + "\n".join([f"--- {k} ---\n{v}\n" for k, v in files.items()])
+            # The plan names the files to touch, so it is part of the relevance query.
+            workspace_context = self.build_context(files, f"{input_data}\n{plan}", config, reserved_text=system_prompt + input_data + plan)
+            prompt.add_files("Existing Files", workspace_context.full_files)
+            prompt.add(workspace_context.LISTING_TITLE, workspace_context.render_listing(), WORKSPACE)
+            yield AgentResponse(agent_name=self.name, content=workspace_context.summary())
+        prompt.add("Architect's Plan", plan, PLAN)
+        prompt.add("Target Programming Language", language, REQUEST)
+        prompt.add("User Request", input_data, REQUEST)
         
-        full_prompt = f"User Request: {input_data}\\n\\nArchitect's Plan: {previous_context.get('architect_plan', '')}{existing_files_str}"
+        full_prompt = prompt.build()
         
-        response_text = await self.call_llm(system_prompt, full_prompt, config)
+        llm_stream = self.stream_llm(system_prompt, full_prompt, config)
+        async for frame in self.relay_stream(llm_stream, "Generating application code (this may take a moment)..."):
+            yield frame
+        response_text = llm_stream.text
         
         import re
         response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL).strip()
@@ -306,9 +603,59 @@ class CodeGenerator(Agent):
                 files=files
             )
 
+    async def generate_patch(self, input_data: str, previous_context: Dict, fix_scope: List[str]) -> AsyncGenerator[AgentResponse, None]:
+        """Failure-scoped fix: asks for unified diffs against the implicated files only.
+
+        Yields a final frame with the patched files on success, or a notice
+        (no files) when the caller should fall back to full regeneration.
+        """
+        yield AgentResponse(agent_name=self.name, content=f"Generating patch for {', '.join(fix_scope)}...")
+        config = previous_context.get("config")
+        files = previous_context.get("files", {})
+
+        system_prompt = """You are an expert Programmer fixing failing tests.
+        Return ONLY the changes, as unified diffs inside ```diff code blocks.
+        
+        RULES:
+        1. Every file starts with `--- a/<path>` and `+++ b/<path>` headers, using the exact paths shown.
+        2. Every change is a hunk `@@ -<old_start>,<old_len> +<new_start>,<new_len> @@` with 3 lines of unchanged context.
+        3. Context and removed lines MUST match the current file exactly, including indentation.
+        4. To create a new file use `--- /dev/null` and `+++ b/<path>`.
+        5. Do not output whole files and do not touch files that do not need to change.
+        """
+
+        prompt = PromptBuilder()
+        prompt.add_files("Files Implicated by the Failing Tests", {k: files[k] for k in fix_scope if k in files})
+        prompt.add("Other Existing Files", "\n".join(f"- {k}" for k in sorted(files) if k not in fix_scope), WORKSPACE)
+        prompt.add("Architect's Plan", previous_context.get("architect_plan", ""), PLAN)
+        prompt.add("User Request", input_data, REQUEST)
+
+        llm_stream = self.stream_llm(system_prompt, prompt.build(), config)
+        async for frame in self.relay_stream(llm_stream, "Generating patch..."):
+            yield frame
+
+        import re
+        response_text = re.sub(r'<think>.*?</think>', '', llm_stream.text, flags=re.DOTALL).strip()
+        blocks = re.findall(r'```(?:diff|patch|udiff)?\s*\n(.*?)```', response_text, re.DOTALL)
+        diff_text = "\n".join(blocks) if blocks else response_text
+        try:
+            patches = parse_unified_diff(diff_text)
+            if not patches:
+                raise PatchError("no unified diff in response")
+            changed = apply_patches(files, patches)
+        except PatchError as e:
+            print(f"{self.name}: patch failed: {e}")
+            yield AgentResponse(agent_name=self.name, content=f"Patch could not be applied ({e}). Falling back to full-file regeneration...")
+            return
+        yield AgentResponse(
+            agent_name=self.name,
+            content=f"Done! Patched {len(changed)} file(s): {', '.join(sorted(changed))}.",
+            files=changed
+        )
+
 class Tester(Agent):
-    def __init__(self):
-        super().__init__("Tester", "Create tests")
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        super().__init__("Tester", "Create tests", retry_policy)
 
     async def process(self, input_data: str, previous_context: Dict) -> AsyncGenerator[AgentResponse, None]:
         config = previous_context.get("config")
@@ -374,13 +721,16 @@ class Tester(Agent):
         """
         
         files = previous_context.get("files", {})
-        code_context = "\n".join([f"Process File ({k}):\n{v}" for k, v in files.items()])
+        code_context = self.code_view(files, config, lambda fs: "\n".join([f"Process File ({k}):\n{v}" for k, v in fs.items()]))
         
         if not code_context:
             yield AgentResponse(agent_name=self.name, content="Done! (No Python files to test)", files={}, is_error=True)
             return
 
-        response_text = await self.call_llm(system_prompt, f"Code to test:\n{code_context}", config)
+        llm_stream = self.stream_llm(system_prompt, f"Code to test:\n{code_context}", config)
+        async for frame in self.relay_stream(llm_stream, "Generating test suite..."):
+            yield frame
+        response_text = llm_stream.text
         
         import re
         response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL).strip()
@@ -432,92 +782,170 @@ class Tester(Agent):
         
         if test_files:
             import tempfile
-            import subprocess
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                for fname, fcontent in {**files, **test_files}.items():
-                    if fname.endswith('/') or fname.endswith('\\'):
-                        continue
-                        
-                    fpath = os.path.join(temp_dir, fname)
-                    try:
-                        os.makedirs(os.path.dirname(fpath), exist_ok=True)
-                        with open(fpath, "w") as f:
-                            f.write(fcontent)
-                    except IsADirectoryError:
-                         pass
-                    except Exception as e:
-                         print(f"Warning: Failed to write temporary file {fname}: {e}")
-
-                if "requirements.txt" in files:
-                    yield AgentResponse(agent_name=self.name, content="Installing dependencies from requirements.txt...")
+            async with AsyncExitStack() as stack:
+                sandbox = None
+                if sandbox_pool and config.get("sandbox", True):
                     try:
-                        install_proc = subprocess.run(
-                            [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-                            cwd=temp_dir,
-                            capture_output=True,
-                            text=True
-                        )
-                        if install_proc.returncode != 0:
-                             yield AgentResponse(agent_name=self.name, content=f"Dependency Installation Warning:\n{install_proc.stderr}", is_error=True)
-                        else:
-                             yield AgentResponse(agent_name=self.name, content="Dependencies installed successfully.")
-                    except Exception as e:
-                         yield AgentResponse(agent_name=self.name, content=f"Warning: Failed to attempt dependency installation: {e}", is_error=True)
-                
-                yield AgentResponse(agent_name=self.name, content="Running pytest (Streaming)...", files=final_files)
+                        sandbox = await stack.enter_async_context(sandbox_pool.lease(previous_context.get("session_id")))
+                        sync = await asyncio.to_thread(sandbox.sync, {**files, **test_files})
+                        yield AgentResponse(agent_name=self.name, content=f"Sandbox synced: {sync.describe()}.")
+                    except OSError as e:
+                        yield AgentResponse(agent_name=self.name, content=f"Warning: Sandbox unavailable, using a temporary directory: {e}", is_error=True)
+                        sandbox = None
+
+                with (nullcontext(sandbox.root) if sandbox else tempfile.TemporaryDirectory()) as temp_dir:
+                    for fname, fcontent in ({} if sandbox else {**files, **test_files}).items():
+                        if fname.endswith('/') or fname.endswith('\\'):
+                            continue
+                        
+                        fpath = os.path.join(temp_dir, fname)
+                        try:
+                            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+                            with open(fpath, "w") as f:
+                                f.write(fcontent)
+                        except IsADirectoryError:
+                             pass
+                        except Exception as e:
+                             print(f"Warning: Failed to write temporary file {fname}: {e}")
+
+                    cancel_token = config.get("cancel_token")
+                    dep_env = None
+
+                    if "requirements.txt" in files and dependency_cache and config.get("dep_cache", True):
+                        try:
+                            if dependency_cache.is_ready(files["requirements.txt"]):
+                                yield AgentResponse(agent_name=self.name, content="Using cached dependency environment...")
+                            else:
+                                yield AgentResponse(agent_name=self.name, content="Building dependency environment from requirements.txt (cached for later runs)...")
+                            dep_env = await stack.enter_async_context(dependency_cache.lease(files["requirements.txt"]))
+                            if not dep_env.reused:
+                                yield AgentResponse(agent_name=self.name, content="Dependencies installed successfully.")
+                        except DependencyBuildError as e:
+                            yield AgentResponse(agent_name=self.name, content=f"Dependency Installation Warning: {e}\n{e.log}", is_error=True)
+                        except Exception as e:
+                            yield AgentResponse(agent_name=self.name, content=f"Warning: Failed to attempt dependency installation: {e}", is_error=True)
+                    elif "requirements.txt" in files:
+                        yield AgentResponse(agent_name=self.name, content="Installing dependencies from requirements.txt...")
+                        try:
+                            install = await ProcessRun(
+                                [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
+                                cwd=temp_dir,
+                                timeout=PIP_INSTALL_TIMEOUT,
+                                cancel_token=cancel_token
+                            ).run()
+                            if install.timed_out:
+                                 yield AgentResponse(agent_name=self.name, content=f"Dependency Installation Warning: pip timed out after {PIP_INSTALL_TIMEOUT:g}s.", is_error=True)
+                            elif install.returncode != 0:
+                                 yield AgentResponse(agent_name=self.name, content=f"Dependency Installation Warning:\n{install.stderr}", is_error=True)
+                            else:
+                                 yield AgentResponse(agent_name=self.name, content="Dependencies installed successfully.")
+                        except Exception as e:
+                             yield AgentResponse(agent_name=self.name, content=f"Warning: Failed to attempt dependency installation: {e}", is_error=True)
                 
-                env = os.environ.copy()
-                env["PYTHONPATH"] = temp_dir
+                    yield AgentResponse(agent_name=self.name, content="Running pytest (Streaming)...", files=final_files)
                 
-                process = subprocess.Popen(
-                    ["pytest", "."],
-                    cwd=temp_dir,
-                    env=env,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1
-                )
+                    env = os.environ.copy()
+                    env["PYTHONPATH"] = temp_dir
+                    command = [sys.executable, "-m", "pytest", "."]
+                    if dep_env:
+                        env = dep_env.apply(env)
+                        command = [dep_env.python, "-m", "pytest", "."]
+                    warm = warm_runner if config.get("warm_runner", True) else None
                 
-                while True:
-                    line = process.stdout.readline()
-                    if not line and process.poll() is not None:
-                        break
-                    if line:
-                        test_results += line
-                        final_files["TEST_RESULTS.log"] = test_results
-                        yield AgentResponse(agent_name=self.name, content="Running pytest...", files=final_files)
-                        await asyncio.sleep(0.01)
+                    timeout = float(config.get("test_timeout", TEST_TIMEOUT))
+                    suite_files = {**files, **test_files}
+                    impact = None
+                    selection = None
+                    if config.get("test_impact", TEST_IMPACT):
+                        impact = TestImpact()
+                        impact.restore(previous_context.get("test_impact"))
+                        selection = impact.select(suite_files)
+                        if selection:
+                            yield AgentResponse(agent_name=self.name, content=f"Running {selection.describe()} first; the full suite runs once they pass.")
+                    coverage = bool(impact) and config.get("test_coverage", TEST_IMPACT_COVERAGE)
+
+                    # A focused pass over the affected tests, then (only if it passes) the full suite.
+                    for focus in ([selection, None] if selection else [None]):
+                        if selection:
+                            title = "affected tests" if focus else "full suite (confirmation)"
+                            separator = "" if focus else "\n"
+                            header = f"{separator}==================== {title} ====================\n"
+                            yield AgentResponse(
+                                agent_name=self.name, content="Running pytest...", is_partial=True,
+                                log_file="TEST_RESULTS.log", log_chunk=header, log_offset=len(test_results)
+                            )
+                            test_results += header
+                        shards = [None]
+                        shard_total = shard_count(config.get("test_shards"))
+                        if shard_total > 1:
+                            # Collecting costs a pytest start of its own; only pay it when the suite may be big enough.
+                            suite_tests = {p: c for p, c in suite_files.items() if is_test_file(p) and (not focus or focus.covers_file(p))}
+                            estimate = estimate_test_count(suite_tests)
+                            if estimate is not None and estimate < TEST_SHARD_MIN_TESTS:
+                                shard_total = 1
+                        if shard_total > 1:
+                            test_ids = await collect_test_ids(command, temp_dir, env, timeout, cancel_token, warm)
+                            if test_ids and focus:
+                                test_ids = focus.order(test_ids)
+                            if test_ids and len(test_ids) >= TEST_SHARD_MIN_TESTS:
+                                shards = plan_shards(test_ids, shard_total)
+                                yield AgentResponse(agent_name=self.name, content=f"Running {len(test_ids)} tests across {len(shards)} shards...")
+                        run = PytestRun(
+                            command, shards, cwd=temp_dir, env=env, timeout=timeout, cancel_token=cancel_token,
+                            batch_interval=LOG_STREAM_INTERVAL, batch_bytes=LOG_STREAM_BYTES, warm=warm,
+                            selection=focus, coverage=coverage
+                        )
+                        async for stream, text in run.stream():
+                            if stream != "stdout":
+                                continue
+                            yield AgentResponse(
+                                agent_name=self.name, content="Running pytest...", is_partial=True,
+                                log_file="TEST_RESULTS.log", log_chunk=text, log_offset=len(test_results)
+                            )
+                            test_results += text
                 
-                stderr_output = process.stderr.read()
-                if stderr_output:
-                    test_results += f"\nSTDERR:\n{stderr_output}"
+                        if run.stderr:
+                            test_results += f"\nSTDERR:\n{run.stderr}"
+                        if run.timed_out:
+                            test_results += f"\n[TIMEOUT] pytest was killed after {timeout:g}s."
+                        if impact:
+                            impact.record(suite_files, fingerprint_failure(run.stdout).failing_tests, run.coverage)
+                        # Exit code 5: the selection matched nothing, which is no verdict.
+                        if focus and (run.returncode not in (0, 5) or run.timed_out):
+                            break
+                        if focus:
+                            yield AgentResponse(agent_name=self.name, content="Affected tests passed. Running the full suite to confirm...")
+                    if impact:
+                        previous_context["test_impact"] = impact.state()
                 
-                final_files["TEST_RESULTS.log"] = test_results
+                    final_files["TEST_RESULTS.log"] = test_results
                 
-                if process.returncode == 0:
-                    test_results += "\n\n[SUCCESS] All tests passed."
-                    yield AgentResponse(agent_name=self.name, content="Done! Tests executed and passed.", files=final_files)
-                else:
-                    test_results += "\n\n[FAILURE] Some tests failed."
-                    yield AgentResponse(agent_name=self.name, content="Done! Tests executed with failures.", files=final_files, is_error=True)
+                    if run.returncode == 0 and not run.timed_out:
+                        test_results += "\n\n[SUCCESS] All tests passed."
+                        yield AgentResponse(agent_name=self.name, content="Done! Tests executed and passed.", files=final_files)
+                    else:
+                        test_results += "\n\n[FAILURE] Some tests failed."
+                        content = f"Done! Tests timed out after {timeout:g}s." if run.timed_out else "Done! Tests executed with failures."
+                        yield AgentResponse(agent_name=self.name, content=content, files=final_files, is_error=True)
         else:
              yield AgentResponse(agent_name=self.name, content="Done! (No tests executed)")
 
 class CodeReviewer(Agent):
-    def __init__(self):
-        super().__init__("Code Reviewer", "Review code")
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        super().__init__("Code Reviewer", "Review code", retry_policy)
 
     async def process(self, input_data: str, previous_context: Dict) -> AsyncGenerator[AgentResponse, None]:
          yield AgentResponse(agent_name=self.name, content="Reviewing code...")
          
          system_prompt = "You are a Senior Code Reviewer. Review for bugs/style. Summary only."
          files = previous_context.get("files", {})
-         code_context = "\n".join([f"File: {k}\nContent:\n{v}" for k, v in files.items()])
-         
          config = previous_context.get("config")
-         response_text = await self.call_llm(system_prompt, f"Review:\n{code_context}", config)
+         code_context = self.code_view(files, config, lambda fs: "\n".join([f"File: {k}\nContent:\n{v}" for k, v in fs.items()]))
+         llm_stream = self.stream_llm(system_prompt, f"Review:\n{code_context}", config)
+         async for frame in self.relay_stream(llm_stream, "Reviewing code..."):
+             yield frame
+         response_text = llm_stream.text
          
          import re
          response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL).strip()
@@ -529,8 +957,8 @@ class CodeReviewer(Agent):
         )
 
 class TechnicalWriter(Agent):
-    def __init__(self):
-        super().__init__("Technical Writer", "Write docs")
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        super().__init__("Technical Writer", "Write docs", retry_policy)
 
     async def process(self, input_data: str, previous_context: Dict) -> AsyncGenerator[AgentResponse, None]:
         yield AgentResponse(agent_name=self.name, content="Writing documentation...")
@@ -552,10 +980,16 @@ class TechnicalWriter(Agent):
         
         files = previous_context.get("files", {})
         plan = files.get("implementation_plan.md", "")
-        context_str = f"Plan: {plan}\nFiles: {list(files.keys())}"
+        prompt = PromptBuilder()
+        prompt.add("Files", "\n".join(sorted(files.keys())), WORKSPACE)
+        prompt.add("Plan", plan, PLAN)
+        prompt.add("Request", input_data, REQUEST)
         
         config = previous_context.get("config")
-        response_text = await self.call_llm(system_prompt, f"Context:\n{context_str}\n\nRequest: {input_data}", config)
+        llm_stream = self.stream_llm(system_prompt, prompt.build(), config)
+        async for frame in self.relay_stream(llm_stream, "Writing documentation..."):
+            yield frame
+        response_text = llm_stream.text
         
         import re
         response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL).strip()
@@ -570,31 +1004,37 @@ class TechnicalWriter(Agent):
         )
 
 class Orchestrator:
-    def __init__(self):
-        self.architect = SystemArchitect()
-        self.generator = CodeGenerator()
-        self.tester = Tester()
-        self.reviewer = CodeReviewer()
-        self.writer = TechnicalWriter()
+    def __init__(self, retry_policies: Optional[Dict[str, RetryPolicy]] = None, workspace: Optional[Workspace] = None, checkpoints: Optional[CheckpointStore] = None):
+        retry_policies = retry_policies or {}
+        self.workspace = workspace or workspace_manager.get()
+        self.checkpoints = checkpoints or checkpoint_store
+        self.architect = SystemArchitect(retry_policies.get("System Architect"))
+        self.generator = CodeGenerator(retry_policies.get("Code Generator"))
+        self.tester = Tester(retry_policies.get("Tester"))
+        self.reviewer = CodeReviewer(retry_policies.get("Code Reviewer"))
+        self.writer = TechnicalWriter(retry_policies.get("Technical Writer"))
+        self.pipeline = self.build_pipeline()
+        self.review_pipeline = Pipeline(self.review_stages())
 
     async def save_to_disk(self, files: Dict[str, str]) -> AsyncGenerator[AgentResponse, None]:
         try:
+            to_save = {}
             for filename, content in files.items():
-                if not filename.endswith('.log'):
-                    if os.path.isabs(filename): 
-                        pass
-                    base_dir = "/app/workspace"
-                    filepath = os.path.join(base_dir, filename) 
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                    with open(filepath, "w") as f:
-                        f.write(content)
+                if filename.endswith('.log'):
+                    continue
+                try:
+                    self.workspace.path(filename)
+                    to_save[filename] = content
+                except InvalidPathError:
+                    yield AgentResponse(agent_name="System", content=f"Warning: Skipping file outside the workspace: {filename}", is_error=True)
+            self.workspace.write_files(to_save)
             yield AgentResponse(agent_name="System", content="Files saved to temporary workspace (ready for run).")
         except Exception as e:
             yield AgentResponse(agent_name="System", content=f"Warning: Failed to save files to workspace: {e}", is_error=True)
 
     async def cleanup_workspace(self) -> AsyncGenerator[AgentResponse, None]:
         try:
-            base_dir = "/app/workspace"
+            base_dir = self.workspace.root
             if os.path.exists(base_dir):
                 import shutil
                 for item in os.listdir(base_dir):
@@ -612,83 +1052,289 @@ class Orchestrator:
             yield AgentResponse(agent_name="System", content=f"Warning: Failed to clean workspace: {e}", is_error=True)
 
     async def load_workspace_files(self) -> Dict[str, str]:
-        files = {}
-        workspace_dir = "/app/workspace"
-        if os.path.exists(workspace_dir):
-            for root, dirs, filenames in os.walk(workspace_dir):
-                for filename in filenames:
-                    filepath = os.path.join(root, filename)
-                    rel_path = os.path.relpath(filepath, workspace_dir).replace("\\", "/")
-                    try:
-                        with open(filepath, "r", encoding="utf-8") as f:
-                            files[rel_path] = f.read()
-                    except:
-                        pass
-        return files
+        return await asyncio.to_thread(self.workspace.read_files, False)
+
+    async def run_agent(self, agent: Agent, prompt: str, state: Dict) -> AsyncGenerator[AgentResponse, None]:
+        cancel_token = state["config"].get("cancel_token")
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        last_response = None
+        async for response in agent.process(prompt, state):
+            last_response = response
+            if response.files and not response.is_partial:
+                state["files"].update(response.files)
+            yield response
+        state["results"][agent.name] = last_response
+
+    def tests_passed(self, state: Dict) -> bool:
+        last_gen = state["results"].get(self.generator.name)
+        last_tester = state["results"].get(self.tester.name)
+        if not last_gen or last_gen.is_error:
+            return False
+        return not (last_tester and last_tester.is_error)
+
+    async def _plan_stage(self, state: Dict):
+        async for res in self.run_agent(self.architect, state["prompt"], state): yield res
+        last_arch = state["results"].get(self.architect.name)
+        if last_arch and last_arch.internal_output:
+            state["architect_plan"] = last_arch.internal_output
+
+    async def _generate_stage(self, state: Dict):
+        async for res in self.run_agent(self.generator, state["prompt"], state): yield res
+        async for res in self.save_to_disk(state["files"]): yield res
+
+    async def _test_stage(self, state: Dict):
+        last_gen = state["results"].get(self.generator.name)
+        if not last_gen or last_gen.is_error:
+            yield AgentResponse(agent_name="System", content="Skipping Tests due to Generator failure.")
+            return
+        async for res in self.run_agent(self.tester, state["prompt"], state): yield res
+        async for res in self.save_to_disk(state["files"]): yield res
+
+    async def _save_stage(self, state: Dict):
+        async for res in self.save_to_disk(state["files"]): yield res
+
+    def review_stages(self, depends_on: List[str] = ()) -> List[Stage]:
+        # Reviewer and Writer only read the tested code, so they run side by side.
+        return [
+            Stage("reviewer", lambda state: self.run_agent(self.reviewer, state["user_prompt"], state), depends_on, when=self.tests_passed),
+            Stage("writer", lambda state: self.run_agent(self.writer, state["user_prompt"], state), depends_on, when=self.tests_passed),
+            Stage("save", self._save_stage, ["reviewer", "writer"], when=self.tests_passed),
+        ]
+
+    def build_pipeline(self) -> Pipeline:
+        return Pipeline([
+            Stage("architect", self._plan_stage),
+            Stage("generator", self._generate_stage, ["architect"]),
+            Stage("tester", self._test_stage, ["generator"]),
+            *self.review_stages(["tester"]),
+        ])
+
+    def save_checkpoint(self, context: Dict, loop: Optional[Dict] = None):
+        config = context["config"]
+        if not config.get("checkpoints", True):
+            return
+        try:
+            self.checkpoints.save(config["workflow_id"], {
+                "session_id": self.workspace.session_id,
+                "prompt": context["user_prompt"],
+                "config": portable_config(config),
+                "architect_plan": context["architect_plan"],
+                "files": context["files"],
+                "results": {name: r.model_dump() for name, r in context["results"].items() if r is not None},
+                "completed": sorted(context["completed"]),
+                "fix_scope": context.get("fix_scope"),
+                "test_impact": context.get("test_impact"),
+                "loop": loop,
+            })
+        except Exception as e:
+            print(f"Orchestrator: failed to save checkpoint: {e}")
+
+    def restore_checkpoint(self, context: Dict, checkpoint: Dict):
+        context["files"].update(checkpoint.get("files", {}))
+        context["architect_plan"] = checkpoint.get("architect_plan", "")
+        context["results"].update({name: AgentResponse(**r) for name, r in checkpoint.get("results", {}).items()})
+        context["completed"].update(checkpoint.get("completed", []))
+        if checkpoint.get("fix_scope"):
+            context["fix_scope"] = checkpoint["fix_scope"]
+        if checkpoint.get("test_impact"):
+            context["test_impact"] = checkpoint["test_impact"]
+
+    async def run_candidates(self, prompt: str, context: Dict, attempt: int, count: int) -> AsyncGenerator[AgentResponse, None]:
+        """Race `count` Generator + Tester candidates for one auto-fix iteration.
+
+        Each candidate gets its own temperature/seed and a private copy of the
+        workspace (the Tester already runs in its own temp dir). The first one
+        whose tests pass wins and the rest are cancelled; without a winner the
+        first candidate to finish is kept so the next iteration has a log to
+        work from.
+
+        Streamed tokens and test log chunks are forwarded for one candidate at
+        a time (the first still running), since the client has a single
+        terminal and log to append them to.
+        """
+        config = context["config"]
+        token_cap = int(config.get("speculative_token_cap", AUTO_FIX_CANDIDATE_TOKEN_CAP))
+        base_temperature = config.get("temperature", 0.7)
+        queue = asyncio.Queue()
+        states = []
+        for index in range(count):
+            offset = CANDIDATE_TEMPERATURE_OFFSETS[index % len(CANDIDATE_TEMPERATURE_OFFSETS)]
+            candidate_config = {
+                **config,
+                "temperature": round(min(1.5, max(0.0, base_temperature + offset)), 2),
+                "seed": attempt * 1000 + index,
+                "use_cache": False,
+            }
+            states.append({**context, "files": dict(context["files"]), "config": candidate_config, "results": {}})
+
+        async def run_candidate(index: int):
+            state = states[index]
+            try:
+                async for res in self.run_agent(self.generator, prompt, state):
+                    await queue.put((index, res))
+                last_gen = state["results"].get(self.generator.name)
+                if last_gen and not last_gen.is_error:
+                    async for res in self.run_agent(self.tester, prompt, state):
+                        await queue.put((index, res))
+            except Exception as e:
+                print(f"Orchestrator: candidate {index + 1} failed: {e}")
+            finally:
+                await queue.put((index, None))
+
+        yield AgentResponse(agent_name="System", content=f"Racing {count} fix candidates (temperatures {', '.join(str(st['config']['temperature']) for st in states)})...")
+        tasks = [asyncio.create_task(run_candidate(i)) for i in range(count)]
+        winner = None
+        fallback = None
+        spent = 0
+        # Tokens estimated from streamed text per candidate, until a usage frame
+        # replaces them (local backends usually send none).
+        estimated = [0] * count
+        model = self.generator.resolve_endpoint(config)["model"]
+        lead = None
+        lead_log_synced = False
+        running = count
+        try:
+            while running:
+                index, res = await queue.get()
+                if res is None:
+                    running -= 1
+                    if index == lead:
+                        lead = None
+                    if states[index]["results"].get(self.tester.name) and self.tests_passed(states[index]):
+                        winner = index
+                        break
+                    if fallback is None and states[index]["results"].get(self.tester.name):
+                        fallback = index
+                    continue
+                if res.usage:
+                    spent += res.usage.get("prompt_tokens", 0) + res.usage.get("completion_tokens", 0) - estimated[index]
+                    estimated[index] = 0
+                elif res.partial_output:
+                    tokens = estimate_tokens(res.partial_output, model)
+                    spent += tokens
+                    estimated[index] += tokens
+                if token_cap and spent > token_cap:
+                    yield AgentResponse(agent_name="System", content=f"Candidate token cap reached ({spent}/{token_cap}). Cancelling remaining candidates.")
+                    break
+                if res.is_partial:
+                    if lead is None:
+                        lead, lead_log_synced = index, False
+                        yield AgentResponse(agent_name="System", content=f"Streaming candidate {index + 1}", is_partial=True, partial_output=f"\n[Candidate {index + 1}]\n")
+                    if index != lead or res.usage:
+                        continue
+                    if res.log_chunk is not None:
+                        # A log picked up mid-run would not line up with the client's copy.
+                        lead_log_synced = lead_log_synced or res.log_offset == 0
+                        if not lead_log_synced:
+                            continue
+                    yield res
+                    continue
+                # Candidate frames are informational; only the chosen one's files reach the workspace.
+                yield res.model_copy(update={"content": f"[Candidate {index + 1}] {res.content}", "files": None})
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        chosen = winner if winner is not None else fallback
+        if chosen is None:
+            chosen = next((i for i, st in enumerate(states) if st["results"].get(self.generator.name)), 0)
+        state = states[chosen]
+        context["files"].update(state["files"])
+        context["results"].update(state["results"])
+        if "test_impact" in state:
+            context["test_impact"] = state["test_impact"]
+        if winner is None and self.tester.name not in state["results"]:
+            context["results"][self.tester.name] = AgentResponse(agent_name=self.tester.name, content="Candidate cancelled before testing.", is_error=True)
+        if winner is not None:
+            message = f"Candidate {chosen + 1} passed (temperature {state['config']['temperature']}). Cancelled the others."
+        else:
+            message = f"No candidate passed. Continuing with candidate {chosen + 1}."
+        yield AgentResponse(agent_name="System", content=message, files=state["files"])
 
-    async def run_workflow(self, user_prompt: str, config: Optional[Dict] = None):
-        config = config or {}
+    async def run_workflow(self, user_prompt: str, config: Optional[Dict] = None, pipeline: Optional[Pipeline] = None):
+        config = config if config is not None else {}
+        try:
+            async for response in self._run_workflow(user_prompt, config, pipeline):
+                yield response
+        finally:
+            # Finished, failed or cancelled: the workflow's backend pin is no longer needed.
+            if config.get("workflow_id"):
+                backend_pool.release_sticky(config["workflow_id"])
+
+    async def _run_workflow(self, user_prompt: str, config: Dict, pipeline: Optional[Pipeline]):
+        checkpoint = None
+        if config.get("resume"):
+            checkpoint = self.checkpoints.load(config["resume"])
+            if checkpoint is None:
+                yield AgentResponse(agent_name="System", content=f"Error: No checkpoint found for workflow {config['resume']}.", is_error=True)
+                return
+            config["workflow_id"] = checkpoint["workflow_id"]
+            user_prompt = checkpoint.get("prompt") or user_prompt
+        config.setdefault("workflow_id", uuid.uuid4().hex)
         auto_fix = config.get("auto_fix", False)
         
         existing_files = await self.load_workspace_files()
-        context = {"files": existing_files, "architect_plan": "", "config": config}
-        results = {}
-
-        async def run_agent(agent, prompt=None):
-            p = prompt or user_prompt
-            last_response = None
-            async for response in agent.process(p, context):
-                last_response = response
-                yield response
-            results[agent.name] = last_response
-
-        if not auto_fix:
+        context = {
+            "files": existing_files,
+            "architect_plan": "",
+            "config": config,
+            "user_prompt": user_prompt,
+            "prompt": user_prompt,
+            "results": {},
+            "completed": set(),
+            "session_id": self.workspace.session_id,
+        }
+        results = context["results"]
+        if checkpoint:
+            self.restore_checkpoint(context, checkpoint)
+            done = ", ".join(checkpoint.get("completed") or []) or "none"
+            loop = checkpoint.get("loop") or {}
+            if loop:
+                done = f"auto-fix iteration {loop.get('attempt')} ({', '.join(loop.get('steps') or []) or 'not started'})"
+            yield AgentResponse(agent_name="System", content=f"Resuming workflow {config['workflow_id'][:8]} from checkpoint (completed: {done}).", files=context["files"])
+
+        def run_agent(agent, prompt=None):
+            return self.run_agent(agent, prompt or user_prompt, context)
+
+        def stage_done(name: str):
+            context["completed"].add(name)
+            self.save_checkpoint(context)
+
+        if pipeline is not None or not auto_fix:
             yield AgentResponse(agent_name="System", content="Starting Workflow...")
-            
-            async for res in run_agent(self.architect): yield res
-            last_arch = results.get(self.architect.name)
-            if last_arch and last_arch.internal_output:
-                context["architect_plan"] = last_arch.internal_output
-
-            async for res in run_agent(self.generator): 
-                yield res
-                if res.files: 
-                    context["files"].update(res.files)
-            
-            async for res in self.save_to_disk(context["files"]): yield res
-            
-            last_gen = results.get(self.generator.name)
-            if last_gen and not last_gen.is_error:
-                async for res in run_agent(self.tester): 
-                    yield res
-                    if res.files: 
-                        context["files"].update(res.files)
-                async for res in self.save_to_disk(context["files"]): yield res
-            else:
-                 yield AgentResponse(agent_name="System", content="Skipping Tests due to Generator failure.")
-
-            last_tester = results.get(self.tester.name)
-            is_failure = last_gen.is_error if last_gen else True
-            if last_tester:
-                 is_failure = is_failure or last_tester.is_error
-
-            if not is_failure:
-                async for res in run_agent(self.reviewer): yield res
-                async for res in run_agent(self.writer): yield res
-                
-                async for res in self.save_to_disk(context["files"]): yield res
 
-                yield AgentResponse(agent_name="System", content="Workflow Completed Successfully.")
+            async for res in (pipeline or self.pipeline).run(context, skip=context["completed"], on_stage_done=stage_done): yield res
 
+            self.checkpoints.delete(config["workflow_id"])
+            if self.tests_passed(context):
                 yield AgentResponse(agent_name="System", content="Workflow Completed Successfully.")
             else:
                 yield AgentResponse(agent_name="System", content="Workflow Completed (Tests Failed).")
-            
             return
 
         MAX_RETRIES = 15
-        attempt = 1
-        current_prompt = user_prompt
+        candidates = max(1, int(config.get("speculative_candidates", AUTO_FIX_CANDIDATES)))
+        tracker = FailureTracker(int(config.get("fingerprint_repeat_limit", AUTO_FIX_REPEAT_LIMIT)))
+        loop = (checkpoint or {}).get("loop") or {}
+        # The context settings the run started with; escalating one fingerprint
+        # widens them only while that fingerprint is the one being fixed.
+        base_strategy = loop.get("base_strategy") or {key: config.get(key) for key in ("context_view", "context_budget")}
+        attempt = loop.get("attempt", 1)
+        current_prompt = loop.get("current_prompt", user_prompt)
+        steps = set(loop.get("steps", []))
+        if loop.get("tracker"):
+            tracker.restore(loop["tracker"])
+
+        def checkpoint_loop():
+            self.save_checkpoint(context, {
+                "attempt": attempt,
+                "current_prompt": current_prompt,
+                "steps": sorted(steps),
+                "tracker": tracker.state(),
+                "base_strategy": base_strategy,
+            })
         
         while attempt <= MAX_RETRIES:
             yield AgentResponse(
@@ -697,26 +1343,38 @@ class Orchestrator:
                 clear_history=True
             )
             
-            async for res in run_agent(self.architect, prompt=current_prompt): yield res
-            
-            last_arch = results.get(self.architect.name)
-            if last_arch and last_arch.internal_output:
-                context["architect_plan"] = last_arch.internal_output
-
-            async for res in run_agent(self.generator, prompt=current_prompt): 
-                yield res
-                if res.files: context["files"].update(res.files)
+            if "architect" not in steps:
+                async for res in run_agent(self.architect, prompt=current_prompt): yield res
+                
+                last_arch = results.get(self.architect.name)
+                if last_arch and last_arch.internal_output:
+                    context["architect_plan"] = last_arch.internal_output
+                steps.add("architect")
+                checkpoint_loop()
+
+            if "generator" not in steps:
+                if candidates > 1:
+                    async for res in self.run_candidates(current_prompt, context, attempt, candidates): yield res
+                    steps.add("tester")
+                else:
+                    async for res in run_agent(self.generator, prompt=current_prompt): yield res
+                steps.add("generator")
+                checkpoint_loop()
             
             last_gen = results.get(self.generator.name)
             if last_gen and last_gen.is_error:
                  yield AgentResponse(agent_name="System", content=f"Code Generation Failed (Iteration {attempt}). Retrying...")
+                 context.pop("fix_scope", None)
                  current_prompt = f"CRITICAL: Generation Failed.\nError Log:\n{context['files'].get('error_log.txt', 'Unknown Error')}\nOriginal Request: {user_prompt}\nTry again."
                  attempt += 1
+                 steps = set()
+                 checkpoint_loop()
                  continue
 
-            async for res in run_agent(self.tester, prompt=current_prompt): 
-                yield res
-                if res.files: context["files"].update(res.files)
+            if "tester" not in steps:
+                async for res in run_agent(self.tester, prompt=current_prompt): yield res
+                steps.add("tester")
+                checkpoint_loop()
 
             async for res in self.save_to_disk(context["files"]): yield res
 
@@ -724,21 +1382,77 @@ class Orchestrator:
             is_failure = last_tester.is_error if last_tester else False
 
             if not is_failure:
-                async for res in run_agent(self.reviewer): yield res
-                async for res in run_agent(self.writer): yield res
-
-                async for res in self.save_to_disk(context["files"]): yield res
+                async for res in self.review_pipeline.run(context, skip=context["completed"], on_stage_done=lambda name: (stage_done(name), checkpoint_loop())): yield res
 
+                self.checkpoints.delete(config["workflow_id"])
                 yield AgentResponse(agent_name="System", content=f"Workflow Fixed & Completed in {attempt} iterations.")
                 return
 
-            yield AgentResponse(agent_name="System", content=f"Tests Failed (Iteration {attempt}). Analyzing errors for retry...")
-            
             test_log = context["files"].get("TEST_RESULTS.log", "No log")
-            all_files_snapshot = {k: v for k, v in context["files"].items() if not k.endswith('.log')}
-            code_snapshot = "\n".join([f"--- FILE: {k} ---\n{v}\n" for k, v in all_files_snapshot.items()])
+            verdict = tracker.record(fingerprint_failure(test_log))
+            fingerprint = verdict.fingerprint
+            note = "" if verdict.kind == "new" else f", {verdict.kind}, seen {verdict.occurrences}x"
+            yield AgentResponse(
+                agent_name="System",
+                content=f"Tests Failed (Iteration {attempt}). Failure {fingerprint.digest}{note}. Analyzing errors for retry...",
+                fingerprint=verdict.model_dump()
+            )
+            if verdict.action == "stop":
+                yield AgentResponse(
+                    agent_name="System",
+                    content=f"Auto-fix stopped: failure {fingerprint.digest} keeps coming back even after escalating the strategy.\n{tracker.report()}",
+                    is_error=True,
+                    fingerprint=verdict.model_dump()
+                )
+                self.checkpoints.delete(config["workflow_id"])
+                return
+            if verdict.action == "escalate":
+                yield AgentResponse(agent_name="System", content="Same failure again. Escalating to a full re-plan with the whole codebase in context.")
+            escalated = fingerprint.digest in tracker.escalated
+            for key, value in base_strategy.items():
+                if value is None:
+                    config.pop(key, None)
+                else:
+                    config[key] = value
+            if escalated:
+                config["context_view"] = "full"
+                try:
+                    model = self.generator.resolve_endpoint(config)["model"]
+                    config["context_budget"] = context_budget(model, config) * 2
+                except Exception:
+                    pass
+
+            context.pop("fix_scope", None)
+            if not escalated and config.get("incremental_fix", AUTO_FIX_INCREMENTAL):
+                scope = implicated_files(test_log, context["files"])
+                if scope:
+                    yield AgentResponse(agent_name="System", content=f"Scoping the fix to {', '.join(scope)}.")
+                    context["fix_scope"] = scope
+                    test_log = log_excerpt(test_log)
+
+            if context.get("fix_scope"):
+                # The patch prompt carries the implicated files itself; don't send them twice.
+                current_prompt = f"""
+            CRITICAL: PREVIOUS ITERATION FAILED VALIDATION.
+            
+            ### OBJECTIVE
+            Fix the errors in the implicated files ({', '.join(context['fix_scope'])}) to satisfy the User Request.
+            
+            ### ORIGINAL REQUEST
+            {user_prompt}
+            
+            ### TEST EXECUTION LOGS
+            {test_log}
             
-            current_prompt = f"""
+            ### YOUR TASK
+            1. Analyze the 'TEST EXECUTION LOGS' to understand why it failed.
+            2. Change only what is needed to fix these errors.
+            3. Be extremely careful to not repeat the same mistake.
+            """
+            else:
+                all_files_snapshot = {k: v for k, v in context["files"].items() if not k.endswith('.log')}
+                code_snapshot = "\n".join([f"--- FILE: {k} ---\n{v}\n" for k, v in all_files_snapshot.items()])
+                current_prompt = f"""
             CRITICAL: PREVIOUS ITERATION FAILED VALIDATION.
             
             ### OBJECTIVE
@@ -763,5 +1477,8 @@ class Orchestrator:
             """
             
             attempt += 1
+            steps = set()
+            checkpoint_loop()
             
+        self.checkpoints.delete(config["workflow_id"])
         yield AgentResponse(agent_name="System", content="max auto-fix retries reached. Stopping.")
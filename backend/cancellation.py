@@ -0,0 +1,59 @@
+import os
+import signal
+import asyncio
+from typing import Callable, List, Optional
+
+
+class CancelToken:
+    """Set once when a workflow is cancelled (stop button, client gone...).
+
+    Whoever owns something the event loop can't interrupt on its own (a job
+    task, a subprocess) registers a callback; code that wants to bail out
+    early between steps calls `raise_if_cancelled()`.
+    """
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "Cancelled"):
+        if self.cancelled:
+            return
+        self.reason = reason
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancellation: callback failed: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registers `callback` and returns a function that unregisters it."""
+        if self.cancelled:
+            callback()
+            return lambda: None
+        self._callbacks.append(callback)
+
+        def remove():
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+        return remove
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise asyncio.CancelledError(self.reason)
+
+
+def kill_process_group(pid: int):
+    # Processes are started in a new session, so the group id is the pid
+    # and this also takes down whatever pytest/pip spawned.
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    except OSError as e:
+        print(f"Cancellation: failed to kill process group {pid}: {e}")
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+from typing import Dict, List, Optional
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/app/checkpoints")
+# Checkpoints of workflows nobody resumed are dropped after this many seconds.
+CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", str(7 * 24 * 3600)))
+
+# Never written to disk.
+PRIVATE_CONFIG_KEYS = ("api_key",)
+
+
+def portable_config(config: Dict) -> Dict:
+    # Runtime-only values (tokens, callbacks...) are dropped along with secrets.
+    portable = {}
+    for key, value in config.items():
+        if key in PRIVATE_CONFIG_KEYS:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        portable[key] = value
+    return portable
+
+
+class CheckpointStore:
+    """One JSON file per workflow, rewritten atomically after every stage."""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR, max_age: float = CHECKPOINT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, workflow_id: str) -> str:
+        if not workflow_id or not workflow_id.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Invalid workflow id: {workflow_id}")
+        return os.path.join(self.directory, f"{workflow_id}.json")
+
+    def save(self, workflow_id: str, data: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(workflow_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**data, "workflow_id": workflow_id, "updated_at": time.time()}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, workflow_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(workflow_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def delete(self, workflow_id: str):
+        try:
+            os.unlink(self._path(workflow_id))
+        except (OSError, ValueError):
+            pass
+
+    def list(self, session_id: Optional[str] = None) -> List[Dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            if now - os.path.getmtime(path) > self.max_age:
+                os.unlink(path)
+                continue
+            data = self.load(name[:-len(".json")])
+            if data and (not session_id or data.get("session_id") == session_id):
+                entries.append({
+                    "workflow_id": data["workflow_id"],
+                    "session_id": data.get("session_id"),
+                    "prompt": data.get("prompt", "")[:200],
+                    "completed": data.get("completed", []),
+                    "iteration": (data.get("loop") or {}).get("attempt"),
+                    "updated_at": data.get("updated_at"),
+                })
+        entries.sort(key=lambda e: e["updated_at"] or 0, reverse=True)
+        return entries
+
+    def latest(self, session_id: str) -> Optional[Dict]:
+        entries = self.list(session_id)
+        return self.load(entries[0]["workflow_id"]) if entries else None
+
+
+checkpoint_store = CheckpointStore()
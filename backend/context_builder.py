@@ -0,0 +1,167 @@
+import os
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Approximate context windows; local models default to a conservative 8k.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "local-model": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+# Share of the window the workspace dump may use; the rest is left for instructions and output.
+CONTEXT_FILES_SHARE = float(os.getenv("CONTEXT_FILES_SHARE", "0.5"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+# Generated artifacts that are never worth sending as full bodies.
+ARTIFACT_FILES = {"TEST_RESULTS.log", "REVIEW.md", "implementation_plan.md", "error_log.txt"}
+ARTIFACT_SUFFIXES = (".log",)
+
+_encoders = {}
+
+
+def _encoder(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encoders:
+        try:
+            _encoders[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encoders[model] = tiktoken.get_encoding("cl100k_base")
+    return _encoders[model]
+
+
+def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    if not text:
+        return 0
+    encoder = _encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # ~4 characters per token for English text and code.
+    return len(text) // 4 + 1
+
+
+def context_budget(model: str, config: Optional[Dict] = None) -> int:
+    if config and config.get("context_budget"):
+        return int(config["context_budget"])
+    if CONTEXT_TOKEN_BUDGET:
+        return CONTEXT_TOKEN_BUDGET
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return int(window * CONTEXT_FILES_SHARE)
+
+
+def is_artifact(path: str) -> bool:
+    return os.path.basename(path) in ARTIFACT_FILES or path.endswith(ARTIFACT_SUFFIXES)
+
+
+def tokenize(text: str) -> List[str]:
+    words = re.findall(r"[A-Za-z][A-Za-z0-9]*|\d+", text)
+    tokens = []
+    for word in words:
+        # Split camelCase / PascalCase into parts but keep the whole word too.
+        parts = re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", word)
+        tokens.append(word.lower())
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts)
+    return [t for t in tokens if len(t) > 1]
+
+
+def bm25_rank(query: str, documents: Dict[str, str], k1: float = 1.5, b: float = 0.75) -> List[tuple]:
+    query_terms = set(tokenize(query))
+    doc_terms = {}
+    for path, text in documents.items():
+        # Path tokens are weighted up: "sorting" in the request should find sorting.py.
+        doc_terms[path] = Counter(tokenize(text) + tokenize(path.replace("/", " ").replace(".", " ")) * 3)
+
+    if not doc_terms:
+        return []
+    avg_len = sum(sum(c.values()) for c in doc_terms.values()) / len(doc_terms) or 1.0
+    n_docs = len(doc_terms)
+    doc_freq = Counter()
+    for counts in doc_terms.values():
+        doc_freq.update(term for term in counts if term in query_terms)
+
+    scores = []
+    for path, counts in doc_terms.items():
+        length = sum(counts.values())
+        score = 0.0
+        for term in query_terms:
+            tf = counts.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        scores.append((path, score))
+    scores.sort(key=lambda item: (-item[1], item[0]))
+    return scores
+
+
+class WorkspaceContext:
+    LISTING_TITLE = "Other Existing Files (content omitted, ask for them by name if needed)"
+
+    def __init__(self, full_files: Dict[str, str], listed_files: List[str], tokens_used: int, tokens_full: int, budget: int):
+        self.full_files = full_files
+        self.listed_files = listed_files
+        self.tokens_used = tokens_used
+        self.tokens_full = tokens_full
+        self.budget = budget
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_full - self.tokens_used)
+
+    def render_listing(self) -> str:
+        return "\n".join(f"- {k}" for k in self.listed_files)
+
+    def render(self) -> str:
+        text = ""
+        if self.full_files:
+            text += "\n\nExisting Files:\n" + "\n".join([f"--- {k} ---\n{v}\n" for k, v in self.full_files.items()])
+        if self.listed_files:
+            text += f"\n\n{self.LISTING_TITLE}:\n" + self.render_listing()
+        return text
+
+    def summary(self) -> str:
+        total = len(self.full_files) + len(self.listed_files)
+        return (
+            f"Context: {len(self.full_files)}/{total} files in full (~{self.tokens_used} tokens, "
+            f"budget {self.budget}), saved ~{self.tokens_saved} tokens."
+        )
+
+
+def build_workspace_context(files: Dict[str, str], query: str, model: str, budget: int, reserved_tokens: int = 0) -> WorkspaceContext:
+    budget = max(0, budget - reserved_tokens)
+    tokens_full = sum(estimate_tokens(f"--- {k} ---\n{v}\n", model) for k, v in files.items())
+
+    sources = {k: v for k, v in files.items() if not is_artifact(k)}
+    ranked = bm25_rank(query, sources)
+    listing_cost = sum(estimate_tokens(f"- {k}\n", model) for k in files)
+
+    full_files = {}
+    listed = []
+    used = 0
+    for path, score in ranked:
+        cost = estimate_tokens(f"--- {path} ---\n{sources[path]}\n", model)
+        if used + cost + listing_cost <= budget:
+            full_files[path] = sources[path]
+            used += cost
+            listing_cost -= estimate_tokens(f"- {path}\n", model)
+        else:
+            listed.append(path)
+
+    listed.extend(k for k in files if is_artifact(k))
+    # Deterministic order keeps the prompt stable between calls.
+    full_files = dict(sorted(full_files.items()))
+    listed.sort()
+    used += sum(estimate_tokens(f"- {k}\n", model) for k in listed)
+    return WorkspaceContext(full_files, listed, used, tokens_full, budget)
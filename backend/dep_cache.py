@@ -0,0 +1,257 @@
+import os
+import re
+import sys
+import site
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import platform
+import sysconfig
+import importlib.metadata
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from processes import ProcessRun
+from workspaces import disk_usage
+
+# Virtualenvs with the generated project's requirements, reused across runs
+# (empty: install into the server's interpreter like before).
+DEP_CACHE_DIR = os.getenv("DEP_CACHE_DIR", "/app/.dep_cache")
+DEP_CACHE_MAX_MB = float(os.getenv("DEP_CACHE_MAX_MB", "2048"))
+DEP_CACHE_BUILD_TIMEOUT = float(os.getenv("DEP_CACHE_BUILD_TIMEOUT", "600"))
+
+READY_MARKER = ".ready"
+SIZE_FILE = ".size"
+SERVER_PATHS = "_agentforge_server.pth"
+# First pip that can install into another interpreter with --python.
+PIP_PYTHON_OPTION = (22, 3)
+
+
+class DependencyBuildError(Exception):
+    def __init__(self, message: str, log: str = ""):
+        super().__init__(message)
+        self.log = log
+
+
+def server_site_packages():
+    # What the server itself imports from: its venv's site-packages when it
+    # runs in one, the system ones otherwise.
+    paths = list(site.getsitepackages())
+    if site.ENABLE_USER_SITE and os.path.isdir(site.getusersitepackages()):
+        paths.append(site.getusersitepackages())
+    return paths
+
+
+def pip_command(python: str):
+    try:
+        version = importlib.metadata.version("pip")
+    except importlib.metadata.PackageNotFoundError:
+        raise DependencyBuildError(f"pip is not installed for {sys.executable}; install it or unset DEP_CACHE_DIR")
+    if tuple(int(p) for p in re.findall(r"\d+", version)[:2]) >= PIP_PYTHON_OPTION:
+        return [sys.executable, "-m", "pip", "--python", python]
+    # Older pips can't target another interpreter, but the env reaches this
+    # pip through its .pth, and run there it installs into the env.
+    return [python, "-m", "pip"]
+
+
+def normalize_requirements(text: str) -> str:
+    # Comments, blank lines, ordering, duplicates and name spelling
+    # (Foo_Bar == foo-bar) don't change what gets installed.
+    lines = set()
+    for line in text.splitlines():
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$", line)
+        if match and not line.startswith("-"):
+            name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+            line = name + re.sub(r"\s+", "", match.group(2))
+        lines.add(line)
+    return "\n".join(sorted(lines)) + "\n"
+
+
+class DependencyEnv:
+    def __init__(self, key: str, path: str, reused: bool):
+        self.key = key
+        self.path = path
+        self.reused = reused
+
+    @property
+    def python(self) -> str:
+        return os.path.join(self.path, "bin", "python")
+
+    def apply(self, env: Dict[str, str]) -> Dict[str, str]:
+        env = dict(env)
+        env["VIRTUAL_ENV"] = self.path
+        env["PATH"] = os.path.join(self.path, "bin") + os.pathsep + env.get("PATH", "")
+        return env
+
+
+class DependencyCache:
+    """Virtualenvs keyed by the hash of the normalized requirements.
+
+    Envs see the site-packages the server imports from (for pytest), through
+    a .pth file, with the requirements installed on top, and are built at
+    most once per key: concurrent runs with the same requirements wait on
+    the same build. The mtime of the
+    `.ready` marker is the LRU clock; once the cache outgrows `max_bytes`
+    the least recently used envs nobody is using are removed.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, build_timeout: float = DEP_CACHE_BUILD_TIMEOUT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.build_timeout = build_timeout
+        self._builds: Dict[str, asyncio.Task] = {}
+        self._in_use: Dict[str, int] = {}
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(requirements: str) -> str:
+        # The prefix too: envs point back at this server's site-packages.
+        interpreter = f"{platform.python_implementation()}-{sys.version_info[0]}.{sys.version_info[1]}-{platform.machine()}-{sys.prefix}"
+        payload = interpreter + "\n" + normalize_requirements(requirements)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _ready(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self._path(key), READY_MARKER))
+
+    def is_ready(self, requirements: str) -> bool:
+        return self._ready(self.make_key(requirements))
+
+    async def _discard(self, path: str):
+        # Moved aside first so a new build of the same key never races the delete.
+        trash = f"{path}.trash-{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return
+        await asyncio.to_thread(shutil.rmtree, trash, True)
+
+    async def _build(self, key: str, requirements: str):
+        path = self._path(key)
+        # Leftovers of a build that died halfway.
+        await self._discard(path)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            # No pip of its own: the server's pip installs into it, which saves ~20 MB per env.
+            venv = await ProcessRun([sys.executable, "-m", "venv", "--without-pip", path], timeout=120).run()
+            if venv.returncode != 0:
+                raise DependencyBuildError("Failed to create virtualenv", venv.stderr)
+            # Not --system-site-packages: with the server in a virtualenv that
+            # would expose the base interpreter's packages instead of its own.
+            env_site = sysconfig.get_path("purelib", vars={"base": path, "platbase": path})
+            os.makedirs(env_site, exist_ok=True)
+            with open(os.path.join(env_site, SERVER_PATHS), "w", encoding="utf-8") as f:
+                f.write("\n".join(server_site_packages()) + "\n")
+            with open(os.path.join(path, "requirements.txt"), "w", encoding="utf-8") as f:
+                f.write(normalize_requirements(requirements))
+            install = await ProcessRun(
+                pip_command(os.path.join(path, "bin", "python")) + ["install", "--disable-pip-version-check", "-r", "requirements.txt"],
+                cwd=path,
+                timeout=self.build_timeout,
+            ).run()
+            if install.timed_out:
+                raise DependencyBuildError(f"pip timed out after {self.build_timeout:g}s", install.stderr)
+            if install.returncode != 0:
+                raise DependencyBuildError("pip install failed", install.stderr or install.stdout)
+            size = (await asyncio.to_thread(disk_usage, path))["bytes"]
+            with open(os.path.join(path, SIZE_FILE), "w") as f:
+                f.write(str(size))
+            open(os.path.join(path, READY_MARKER), "w").close()
+            self.builds += 1
+        except BaseException:
+            await self._discard(path)
+            raise
+        finally:
+            self._builds.pop(key, None)
+        await self.evict(keep=key)
+
+    async def get(self, requirements: str) -> DependencyEnv:
+        key = self.make_key(requirements)
+        reused = self._ready(key)
+        if reused:
+            self.hits += 1
+        else:
+            task = self._builds.get(key)
+            if task is None:
+                task = asyncio.create_task(self._build(key, requirements))
+                self._builds[key] = task
+            # A waiter being cancelled must not kill a build others are waiting on.
+            await asyncio.shield(task)
+        try:
+            os.utime(os.path.join(self._path(key), READY_MARKER), None)
+        except OSError:
+            pass
+        return DependencyEnv(key, self._path(key), reused)
+
+    @asynccontextmanager
+    async def lease(self, requirements: str) -> AsyncIterator[DependencyEnv]:
+        env = await self.get(requirements)
+        self._in_use[env.key] = self._in_use.get(env.key, 0) + 1
+        try:
+            yield env
+        finally:
+            self._in_use[env.key] -= 1
+            if not self._in_use[env.key]:
+                del self._in_use[env.key]
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            try:
+                last_used = os.path.getmtime(os.path.join(path, READY_MARKER))
+                with open(os.path.join(path, SIZE_FILE)) as f:
+                    size = int(f.read() or 0)
+            except (OSError, ValueError):
+                continue
+            entries.append((last_used, size, key))
+        return entries
+
+    async def evict(self, keep: Optional[str] = None):
+        entries = await asyncio.to_thread(self._entries)
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for last_used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in self._in_use or key in self._builds:
+                continue
+            print(f"DependencyCache: evicting env {key} ({size / (1024 * 1024):.1f} MiB, unused for {time.time() - last_used:.0f}s)")
+            # Drop the marker first so nobody picks up a half-deleted env.
+            try:
+                os.unlink(os.path.join(self._path(key), READY_MARKER))
+            except OSError:
+                pass
+            await self._discard(self._path(key))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        entries = self._entries()
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "envs": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "builds": self.builds,
+            "building": len(self._builds),
+            "in_use": sum(self._in_use.values()),
+            "evictions": self.evictions,
+        }
+
+
+dependency_cache: Optional[DependencyCache] = None
+if DEP_CACHE_DIR:
+    dependency_cache = DependencyCache(DEP_CACHE_DIR, int(DEP_CACHE_MAX_MB * 1024 * 1024))
@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import hashlib
+from typing import Dict, List
+from pydantic import BaseModel
+
+from context_builder import is_artifact
+from symbol_index import symbol_index
+
+LOG_EXCERPT_CHARS = int(os.getenv("LOG_EXCERPT_CHARS", "6000"))
+# How often one failure fingerprint may show up before auto-fix escalates, then stops.
+AUTO_FIX_REPEAT_LIMIT = int(os.getenv("AUTO_FIX_REPEAT_LIMIT", "2"))
+
+_TRACEBACK_FILE = re.compile(r'File "([^"]+)", line \d+')
+_PYTEST_LOCATION = re.compile(r"^(\S+?\.py):\d+:", re.MULTILINE)
+_PYTEST_NODE = re.compile(r"^(?:FAILED|ERROR)\s+(\S+?\.py)(?:::|\s|$)", re.MULTILINE)
+_IMPORT_MODULE = re.compile(r"importing test module '([^']+)'")
+_MISSING_MODULE = re.compile(r"No module named '([\w.]+)'")
+_SECTION = re.compile(r"^=+ (?:FAILURES|ERRORS) =+$", re.MULTILINE)
+_FAILED_TEST = re.compile(r"^(?:FAILED|ERROR)\s+(\S+)", re.MULTILINE)
+_LOCATION_EXCEPTION = re.compile(r"^(\S+?\.py):\d+: (\w+(?:\.\w+)*)$", re.MULTILINE)
+_ERROR_LINE = re.compile(r"^E\s+(.*)$", re.MULTILINE)
+_EXCEPTION_NAME = re.compile(r"^((?:\w+\.)*\w*(?:Error|Exception|Exit|Interrupt|Warning))\b")
+_TEMP_PREFIX = re.compile(r"(?:/private)?/tmp/[^/\s'\"]+/")
+_VOLATILE = re.compile(r"0x[0-9a-fA-F]+|\d+(?:\.\d+)?")
+
+
+def _match_workspace(candidate: str, sources: List[str]) -> List[str]:
+    candidate = candidate.replace("\\", "/")
+    if "site-packages" in candidate or "/lib/python" in candidate:
+        return []
+    return [p for p in sources if candidate == p or candidate.endswith("/" + p)]
+
+
+def _module_file(module: str, sources: List[str]) -> List[str]:
+    parts = module.lstrip(".").split(".")
+    # "pkg.mod.func" -> pkg/mod.py, pkg/mod/__init__.py, pkg.py, ...
+    for n in range(len(parts), 0, -1):
+        base = "/".join(parts[:n])
+        for path in (f"{base}.py", f"{base}/__init__.py"):
+            if path in sources:
+                return [path]
+    return []
+
+
+def implicated_files(test_log: str, files: Dict[str, str]) -> List[str]:
+    """Workspace files named in the tracebacks / pytest report of a failed run.
+
+    Tests that failed also pull in the workspace modules they import, since
+    the bug is usually in the code under test rather than in the test.
+    """
+    sources = [p for p in files if not is_artifact(p)]
+    found = []
+    candidates = (
+        _TRACEBACK_FILE.findall(test_log)
+        + _PYTEST_LOCATION.findall(test_log)
+        + _PYTEST_NODE.findall(test_log)
+        + _IMPORT_MODULE.findall(test_log)
+    )
+    for candidate in candidates:
+        found.extend(_match_workspace(candidate, sources))
+    for module in _MISSING_MODULE.findall(test_log):
+        found.extend(_module_file(module, sources))
+
+    for path in list(found):
+        if path.endswith(".py") and os.path.basename(path).startswith("test"):
+            entry = symbol_index.get(path, files[path])
+            for module in (entry.imports if entry else []):
+                found.extend(_module_file(module, sources))
+    return sorted(set(found))
+
+
+def log_excerpt(test_log: str, max_chars: int = LOG_EXCERPT_CHARS) -> str:
+    match = _SECTION.search(test_log)
+    excerpt = test_log[match.start():] if match else test_log
+    if len(excerpt) > max_chars:
+        half = max_chars // 2
+        excerpt = f"{excerpt[:half]}\n... [truncated] ...\n{excerpt[-half:]}"
+    return excerpt.strip()
+
+
+class FailureFingerprint(BaseModel):
+    digest: str
+    exception_types: List[str] = []
+    failing_tests: List[str] = []
+    traceback: List[str] = []
+
+    def describe(self) -> str:
+        exceptions = ", ".join(self.exception_types) or "no exception"
+        tests = ", ".join(self.failing_tests[:3]) or "no test ids"
+        if len(self.failing_tests) > 3:
+            tests += f" (+{len(self.failing_tests) - 3} more)"
+        return f"{self.digest} [{exceptions}] {tests}"
+
+
+def _normalize(line: str) -> str:
+    line = _TEMP_PREFIX.sub("", line)
+    return _VOLATILE.sub("N", line).strip()
+
+
+def fingerprint_failure(test_log: str) -> FailureFingerprint:
+    """Identity of a failed run, stable across temp dirs, timings and line shifts.
+
+    Built from the exception types, the failing test ids and the traceback
+    reduced to `file: Exception` locations plus the `E` lines with numbers
+    and addresses masked.
+    """
+    failing_tests = sorted(set(_FAILED_TEST.findall(test_log)))
+    exceptions = set()
+    trace = []
+    for path, name in _LOCATION_EXCEPTION.findall(test_log):
+        exceptions.add(name)
+        trace.append(f"{_normalize(path)}: {name}")
+    for line in _ERROR_LINE.findall(test_log):
+        match = _EXCEPTION_NAME.match(line.strip())
+        if match:
+            exceptions.add(match.group(1))
+        trace.append(_normalize(line))
+    if "ImportError while importing test module" in test_log:
+        exceptions.add("ImportError")
+    if not (failing_tests or trace):
+        # No pytest structure (crash, missing pytest...): fall back to the log tail.
+        trace = [_normalize(line) for line in test_log.strip().splitlines()[-5:]]
+
+    # Order-free: sharded runs may print the same failures in a different order.
+    trace = sorted(set(t for t in trace if t))
+    payload = json.dumps([sorted(exceptions), failing_tests, trace])
+    return FailureFingerprint(
+        digest=hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12],
+        exception_types=sorted(exceptions),
+        failing_tests=failing_tests,
+        traceback=trace[:20],
+    )
+
+
+class FailureVerdict(BaseModel):
+    kind: str  # "new", "repeat" or "oscillation"
+    action: str  # "continue", "escalate" or "stop"
+    occurrences: int
+    fingerprint: FailureFingerprint
+
+
+class FailureTracker:
+    """Spots auto-fix loops that keep producing the same failure.
+
+    A fingerprint seen `repeat_limit` times (back to back or alternating
+    with others) first escalates the fix strategy; if that same fingerprint
+    comes back after its escalation the loop should stop. Every fingerprint
+    gets its own escalation.
+    """
+
+    def __init__(self, repeat_limit: int = AUTO_FIX_REPEAT_LIMIT):
+        self.repeat_limit = max(2, repeat_limit)
+        self.history: List[FailureFingerprint] = []
+        # digest -> history index of the attempt that escalated it
+        self.escalated: Dict[str, int] = {}
+
+    def record(self, fingerprint: FailureFingerprint) -> FailureVerdict:
+        seen = [i for i, f in enumerate(self.history) if f.digest == fingerprint.digest]
+        self.history.append(fingerprint)
+        current = len(self.history) - 1
+        if not seen:
+            kind = "new"
+        elif seen[-1] == current - 1:
+            kind = "repeat"
+        else:
+            kind = "oscillation"
+
+        action = "continue"
+        if len(seen) + 1 >= self.repeat_limit:
+            if fingerprint.digest not in self.escalated:
+                self.escalated[fingerprint.digest] = current
+                action = "escalate"
+            else:
+                action = "stop"
+        return FailureVerdict(kind=kind, action=action, occurrences=len(seen) + 1, fingerprint=fingerprint)
+
+    def state(self) -> Dict:
+        return {"history": [f.model_dump() for f in self.history], "escalated": dict(self.escalated)}
+
+    def restore(self, state: Dict):
+        self.history = [FailureFingerprint(**f) for f in state.get("history", [])]
+        self.escalated = dict(state.get("escalated", {}))
+
+    def report(self) -> str:
+        lines = ["Auto-fix history:"]
+        for i, fingerprint in enumerate(self.history, 1):
+            lines.append(f"  Iteration {i}: {fingerprint.describe()}")
+        last = self.history[-1] if self.history else None
+        if last and last.traceback:
+            lines.append("Last failure:")
+            lines.extend(f"  {line}" for line in last.traceback[:8])
+        return "\n".join(lines)
@@ -0,0 +1,196 @@
+import os
+import re
+import ast
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+from context_builder import is_artifact
+
+# Auto-fix iterations rerun only the tests affected by the files that changed
+# (plus the ones that failed last time); the full suite runs once they pass.
+TEST_IMPACT = os.getenv("TEST_IMPACT", "true").lower() == "true"
+# Also record which workspace files each test file executes (needs coverage.py
+# in the test environment; silently skipped otherwise).
+TEST_IMPACT_COVERAGE = os.getenv("TEST_IMPACT_COVERAGE", "false").lower() == "true"
+
+# Changing one of these can change how every test runs.
+GLOBAL_FILES = {"conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini", "setup.py", "requirements.txt"}
+MAX_CACHED_IMPORTS = 5000
+
+_import_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+
+
+def is_test_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+def source_files(files: Dict[str, str]) -> Dict[str, str]:
+    return {p: c for p, c in files.items() if p and not p.endswith(("/", "\\")) and not is_artifact(p)}
+
+
+def file_digests(files: Dict[str, str]) -> Dict[str, str]:
+    return {p: hashlib.sha1(c.encode("utf-8")).hexdigest() for p, c in source_files(files).items()}
+
+
+def _imports(path: str, content: str) -> List[str]:
+    # Every import in the file, function-level ones included (tests often import late).
+    key = hashlib.sha1(f"{path}\n{content}".encode("utf-8")).hexdigest()
+    if key in _import_cache:
+        _import_cache.move_to_end(key)
+        return _import_cache[key]
+    package = os.path.dirname(path).replace("/", ".")
+    names = []
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        tree = None
+    for node in ast.walk(tree) if tree else []:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".") if package else []
+                parts = parts[:len(parts) - (node.level - 1)] if node.level > 1 else parts
+                base = ".".join(p for p in parts + [base] if p)
+            names.append(base)
+            names.extend(f"{base}.{alias.name}" if base else alias.name for alias in node.names if alias.name != "*")
+    _import_cache[key] = names
+    while len(_import_cache) > MAX_CACHED_IMPORTS:
+        _import_cache.popitem(last=False)
+    return names
+
+
+def _resolve(module: str, roots: Iterable[str], sources: Set[str]) -> List[str]:
+    found = []
+    parts = [p for p in module.split(".") if p]
+    for root in roots:
+        prefix = f"{root}/" if root else ""
+        # Packages run their __init__ on the way down.
+        for n in range(1, len(parts) + 1):
+            base = prefix + "/".join(parts[:n])
+            for path in (f"{base}.py", f"{base}/__init__.py"):
+                if path in sources:
+                    found.append(path)
+    return found
+
+
+def static_dependencies(files: Dict[str, str]) -> Dict[str, Set[str]]:
+    """Workspace files each test file depends on, transitively.
+
+    Follows imports (resolved against the workspace root and the test's own
+    directory, like pytest's rootdir-relative imports) and counts a
+    workspace file whose name a test mentions, e.g. a script it runs with
+    subprocess, as a dependency too.
+    """
+    sources = {p: c for p, c in source_files(files).items()}
+    python = {p for p in sources if p.endswith(".py")}
+    direct: Dict[str, Set[str]] = {}
+    for path in python:
+        roots = {"", os.path.dirname(path)}
+        deps = set()
+        for module in _imports(path, sources[path]):
+            deps.update(_resolve(module, roots, python))
+        deps.discard(path)
+        direct[path] = deps
+
+    names = {}
+    for path in sources:
+        names.setdefault(os.path.basename(path), []).append(path)
+    dependencies = {}
+    for test in (p for p in python if is_test_file(p)):
+        seen = set(direct[test])
+        for name, paths in names.items():
+            if name != os.path.basename(test) and re.search(rf"(?<![\w.]){re.escape(name)}\b", sources[test]):
+                seen.update(paths)
+        stack = list(seen)
+        while stack:
+            for dep in direct.get(stack.pop(), ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        seen.discard(test)
+        dependencies[test] = seen
+    return dependencies
+
+
+class TestSelection:
+    """The tests a focused run keeps: whole test files plus single node ids.
+
+    Previously failing tests come first.
+    """
+
+    def __init__(self, files: List[str], tests: List[str], changed: List[str]):
+        self.files = files
+        self.tests = tests
+        self.changed = changed
+
+    def matches(self, node_id: str) -> bool:
+        return node_id in self.tests or node_id.split("::", 1)[0] in self.files
+
+    def covers_file(self, path: str) -> bool:
+        return path in self.files or any(t.split("::", 1)[0] == path for t in self.tests)
+
+    def order(self, node_ids: List[str]) -> List[str]:
+        failed = set(self.tests)
+        return [t for t in node_ids if t in failed] + [t for t in node_ids if t not in failed and self.matches(t)]
+
+    def to_dict(self) -> Dict:
+        return {"files": self.files, "tests": self.tests}
+
+    def describe(self) -> str:
+        changed = ", ".join(self.changed[:3]) + (f" (+{len(self.changed) - 3} more)" if len(self.changed) > 3 else "")
+        return f"{len(self.files)} affected test files and {len(self.tests)} previously failing tests (changed: {changed or 'nothing'})"
+
+
+class TestImpact:
+    """What the last test run of a workflow saw, to pick the next run's tests.
+
+    Keeps the digest of every source file, the tests that failed and, when
+    coverage was recorded, which workspace files each test file executed.
+    """
+
+    def __init__(self):
+        self.digests: Dict[str, str] = {}
+        self.failed: List[str] = []
+        self.coverage: Dict[str, List[str]] = {}
+
+    def select(self, files: Dict[str, str]) -> Optional[TestSelection]:
+        """Tests to run first, or None when the whole suite should run."""
+        if not self.digests:
+            return None
+        digests = file_digests(files)
+        changed = sorted(p for p in set(digests) | set(self.digests) if digests.get(p) != self.digests.get(p))
+        if any(os.path.basename(p) in GLOBAL_FILES or not p.endswith(".py") for p in changed):
+            return None
+        changed_set = set(changed)
+        dependencies = static_dependencies(files)
+        affected = sorted(
+            test for test, deps in dependencies.items()
+            if test in changed_set or deps & changed_set or changed_set & set(self.coverage.get(test, []))
+        )
+        failed = [t for t in self.failed if t.split("::", 1)[0] in dependencies]
+        # Failing test files (collection errors) are listed whole.
+        affected = sorted(set(affected) | {t for t in failed if "::" not in t})
+        failed = [t for t in failed if "::" in t]
+        if not affected and not failed:
+            return None
+        if len(affected) >= len(dependencies):
+            return None
+        return TestSelection(affected, failed, changed)
+
+    def record(self, files: Dict[str, str], failed: List[str], coverage: Optional[Dict[str, List[str]]] = None):
+        self.digests = file_digests(files)
+        self.failed = list(failed)
+        tests = set(p for p in self.digests if is_test_file(p))
+        self.coverage = {t: deps for t, deps in {**self.coverage, **(coverage or {})}.items() if t in tests}
+
+    def state(self) -> Dict:
+        return {"digests": self.digests, "failed": self.failed, "coverage": self.coverage}
+
+    def restore(self, state: Optional[Dict]):
+        state = state or {}
+        self.digests = dict(state.get("digests", {}))
+        self.failed = list(state.get("failed", []))
+        self.coverage = dict(state.get("coverage", {}))
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Set
+from cancellation import CancelToken
+
+# Workflows allowed to run at once; the rest wait in the queue.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "50"))
+# Set to persist jobs and their (non-partial) events in SQLite.
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "")
+# Finished jobs are kept in memory this long for late subscribers / result polling.
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))
+# Seconds a job keeps running after its last WebSocket client disconnected,
+# giving it a chance to re-attach before the job is cancelled (negative: never cancel).
+JOB_DISCONNECT_GRACE = float(os.getenv("JOB_DISCONNECT_GRACE", "10"))
+
+FINISHED = ("succeeded", "failed", "cancelled")
+# Never written to the store.
+PRIVATE_CONFIG_KEYS = ("api_key",)
+
+_END = object()
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobConflictError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, prompt: str, config: Dict, session_id: str, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.prompt = prompt
+        self.config = config
+        self.session_id = session_id
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.message: Optional[str] = None
+        self.files: Dict[str, str] = {}
+        self.events: List[Dict] = []
+        self.seq = 0
+        self.subscribers = set()
+        self.cancel_token = CancelToken()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def public_config(self) -> Dict:
+        return {k: v for k, v in self.config.items() if k not in PRIVATE_CONFIG_KEYS}
+
+    def info(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "session_id": self.session_id,
+            "workflow_id": self.config.get("workflow_id"),
+            "prompt": self.prompt,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": self.seq,
+            "error": self.error,
+        }
+
+    def result(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "message": self.message,
+            "error": self.error,
+            "files": self.files,
+        }
+
+
+class JobStore:
+    """SQLite persistence for jobs and their event history."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, session_id TEXT, prompt TEXT, "
+            "config TEXT, created_at REAL, started_at REAL, finished_at REAL, error TEXT, message TEXT, files TEXT)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS job_events (job_id TEXT, seq INTEGER, data TEXT, PRIMARY KEY (job_id, seq))")
+        self.db.commit()
+
+    def save(self, job: Job):
+        self.db.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job.id, job.status, job.session_id, job.prompt, json.dumps(job.public_config()),
+                job.created_at, job.started_at, job.finished_at, job.error, job.message, json.dumps(job.files),
+            ),
+        )
+        self.db.commit()
+
+    def append_event(self, job: Job, event: Dict):
+        self.db.execute("INSERT OR REPLACE INTO job_events VALUES (?, ?, ?)", (job.id, event["seq"], json.dumps(event)))
+        self.db.commit()
+
+    def load(self, job_id: str) -> Optional[Job]:
+        row = self.db.execute(
+            "SELECT id, status, session_id, prompt, config, created_at, started_at, finished_at, error, message, files FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if not row:
+            return None
+        job = Job(row[3], json.loads(row[4] or "{}"), row[2], job_id=row[0])
+        job.status, job.created_at, job.started_at, job.finished_at = row[1], row[5], row[6], row[7]
+        job.error, job.message, job.files = row[8], row[9], json.loads(row[10] or "{}")
+        job.events = [json.loads(r[0]) for r in self.db.execute("SELECT data FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,))]
+        job.seq = job.events[-1]["seq"] if job.events else 0
+        return job
+
+    def unfinished(self) -> List[str]:
+        return [r[0] for r in self.db.execute("SELECT id FROM jobs WHERE status NOT IN ('succeeded', 'failed', 'cancelled')")]
+
+    def list(self, session_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query = "SELECT id, status, session_id, prompt, created_at, started_at, finished_at, error FROM jobs"
+        params = ()
+        if session_id:
+            query += " WHERE session_id = ?"
+            params = (session_id,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        keys = ("job_id", "status", "session_id", "prompt", "created_at", "started_at", "finished_at", "error")
+        return [dict(zip(keys, row)) for row in self.db.execute(query, params + (limit,))]
+
+    def close(self):
+        self.db.close()
+
+
+class JobQueue:
+    """Bounded worker pool running generation workflows in the background.
+
+    `runner(job)` is an async generator of event dicts. Events are fanned out
+    to subscribers and kept (except partial LLM frames) so late or reconnecting
+    subscribers get the full history; a job keeps running when all of its
+    subscribers go away. Jobs of one session share its workspace, so they run
+    one at a time, in order; other sessions' jobs may overtake them.
+    """
+
+    def __init__(self, runner: Callable, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE, db_path: str = JOB_DB_PATH, disconnect_grace: float = JOB_DISCONNECT_GRACE):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.disconnect_grace = disconnect_grace
+        self.store = JobStore(db_path) if db_path else None
+        self._jobs: Dict[str, Job] = {}
+        self._pending: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._active_sessions = set()
+        self.running = 0
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None and self.store:
+            job = self.store.load(job_id)
+        return job
+
+    def busy_sessions(self) -> Set[str]:
+        # Sessions with a job queued or running; their workspaces must stay.
+        return {job.session_id for job in self._pending} | set(self._active_sessions)
+
+    def position(self, job: Job) -> int:
+        try:
+            return self._pending.index(job) + 1
+        except ValueError:
+            return 0
+
+    def submit(self, prompt: str, config: Dict, session_id: str) -> Job:
+        self._prune()
+        workflow_id = config.get("workflow_id")
+        live = next((j for j in self._jobs.values() if not j.finished and workflow_id and j.config.get("workflow_id") == workflow_id), None)
+        if live:
+            raise JobConflictError(f"Workflow {workflow_id} is still running as job {live.id}")
+        if len(self._pending) >= self.max_queue:
+            raise JobQueueFullError(f"Job queue full ({len(self._pending)} waiting)")
+        job = Job(prompt, config, session_id)
+        self._jobs[job.id] = job
+        self._pending.append(job)
+        if self.store:
+            self.store.save(job)
+        self.publish(job, {"agent_name": "System", "content": self._queued_message(job), "job_id": job.id})
+        self._wakeup.set()
+        return job
+
+    def _queued_message(self, job: Job) -> str:
+        if job.session_id in self._active_sessions or any(j.session_id == job.session_id for j in self._pending if j is not job):
+            return f"Job {job.id[:8]} queued behind the session's earlier jobs (position {self.position(job)})."
+        if self.running < self.workers and self.position(job) == 1:
+            return f"Job {job.id[:8]} accepted."
+        return f"Job {job.id[:8]} queued (position {self.position(job)}, {self.running}/{self.workers} workers busy)."
+
+    def publish(self, job: Job, event: Dict):
+        job.seq += 1
+        event = {**event, "seq": job.seq}
+        # Log chunks are deltas too, but without them a re-attaching client couldn't rebuild the log.
+        if not event.get("is_partial") or event.get("log_chunk"):
+            job.events.append(event)
+            if self.store:
+                self.store.append_event(job, event)
+        if event.get("files"):
+            job.files.update(event["files"])
+        if event.get("agent_name") == "System" and event.get("content"):
+            job.message = event["content"]
+        for queue in list(job.subscribers):
+            queue.put_nowait(event)
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if self.store:
+            self.store.save(job)
+        for queue in list(job.subscribers):
+            queue.put_nowait(_END)
+
+    def cancel(self, job_id: str, reason: str = "Cancelled") -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        print(f"Jobs: cancelling job {job.id} ({reason})")
+        if job in self._pending:
+            self._pending.remove(job)
+            job.cancel_token.cancel(reason)
+            self.publish(job, {"agent_name": "System", "content": f"Workflow cancelled: {reason}.", "is_error": True})
+            self._finish(job, "cancelled", reason)
+        else:
+            # The worker registered a callback cancelling the job task.
+            job.cancel_token.cancel(reason)
+        return True
+
+    def release(self, job_id: str):
+        # Called when a client stops listening; cancel once nobody re-attached in time.
+        job = self._jobs.get(job_id)
+        if job is None or job.finished or job.subscribers or self.disconnect_grace < 0:
+            return
+        if self.disconnect_grace == 0:
+            self.cancel(job_id, "Client disconnected")
+            return
+
+        def cancel_if_abandoned():
+            if not job.finished and not job.subscribers:
+                self.cancel(job_id, "Client disconnected")
+        asyncio.get_running_loop().call_later(self.disconnect_grace, cancel_if_abandoned)
+
+    async def subscribe(self, job_id: str, after: int = 0) -> AsyncGenerator[Dict, None]:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        queue = asyncio.Queue()
+        history = [e for e in job.events if e["seq"] > after]
+        if not job.finished:
+            job.subscribers.add(queue)
+        try:
+            for event in history:
+                yield event
+            if job.finished:
+                return
+            while True:
+                event = await queue.get()
+                if event is _END:
+                    return
+                if event["seq"] > after:
+                    yield event
+        finally:
+            job.subscribers.discard(queue)
+
+    async def _run(self, job: Job):
+        job.status = "running"
+        job.started_at = time.time()
+        if self.store:
+            self.store.save(job)
+        try:
+            async for event in self.runner(job):
+                self.publish(job, event)
+            self._finish(job, "succeeded")
+        except asyncio.CancelledError:
+            reason = job.cancel_token.reason
+            if reason:
+                self.publish(job, {"agent_name": "System", "content": f"Workflow cancelled: {reason}.", "is_error": True})
+            self._finish(job, "cancelled", reason)
+            # Only a cancelled job ends here; a cancelled worker (shutdown) keeps propagating.
+            if not reason:
+                raise
+        except Exception as e:
+            print(f"Jobs: job {job.id} failed: {e}")
+            self.publish(job, {"agent_name": "System", "content": f"Backend Error: {e}", "is_error": True})
+            self._finish(job, "failed", str(e))
+
+    def _next(self) -> Optional[Job]:
+        for job in self._pending:
+            if job.session_id not in self._active_sessions:
+                self._pending.remove(job)
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            job = self._next()
+            while job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                job = self._next()
+            for waiting in self._pending:
+                self.publish(waiting, {"agent_name": "System", "content": f"Waiting in queue (position {self.position(waiting)})..."})
+            self._active_sessions.add(job.session_id)
+            self.running += 1
+            job.task = asyncio.create_task(self._run(job))
+            remove = job.cancel_token.on_cancel(job.task.cancel)
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                if not job.cancel_token.cancelled:
+                    raise
+                # Cancelled before the task got to run at all.
+                if not job.finished:
+                    self._finish(job, "cancelled", job.cancel_token.reason)
+            finally:
+                remove()
+                job.task = None
+                self.running -= 1
+                self._active_sessions.discard(job.session_id)
+                if self._pending:
+                    self._wakeup.set()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff and not j.subscribers]:
+            del self._jobs[job_id]
+
+    def start(self):
+        if self.store:
+            for job_id in self.store.unfinished():
+                job = self.store.load(job_id)
+                job.status = "failed"
+                job.error = "Interrupted by a server restart"
+                if job.config.get("workflow_id"):
+                    job.error += f" (resume with workflow_id {job.config['workflow_id']})"
+                job.finished_at = time.time()
+                self.store.save(job)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.store:
+            self.store.close()
+
+    def list(self, session_id: Optional[str] = None) -> List[Dict]:
+        if self.store:
+            return self.store.list(session_id)
+        jobs = sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return [j.info() for j in jobs if not session_id or j.session_id == session_id]
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": len(self._pending),
+            "max_queue": self.max_queue,
+            "tracked": len(self._jobs),
+            "persistent": bool(self.store),
+        }
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Dict, Optional
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of LLM completions.
+
+    Entries live at <directory>/<key[:2]>/<key>.json. The file mtime doubles
+    as the LRU clock: it is bumped on every hit, and eviction removes expired
+    entries first, then the least recently used ones until the cache fits in
+    `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str, temperature: float) -> str:
+        payload = json.dumps([model, system_prompt, user_prompt, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.max_age:
+                self._remove(path, stat.st_size)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)
+            return entry["text"]
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def _put_sync(self, key: str, text: str, meta: Optional[Dict] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"text": text, "meta": meta or {}, "created": time.time()}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += os.path.getsize(path) - previous
+        self._evict_sync()
+
+    def _remove(self, path: str, size: int):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.evictions += 1
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for root, dirs, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_sync(self):
+        with self._lock:
+            total = self._total_bytes
+        if total is not None and total <= self.max_bytes:
+            return
+
+        entries = self._entries()
+        now = time.time()
+        live = []
+        for mtime, size, path in entries:
+            if now - mtime > self.max_age:
+                self._remove(path, 0)
+            else:
+                live.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in live)
+        live.sort()
+        while live and total > self.max_bytes:
+            mtime, size, path = live.pop(0)
+            self._remove(path, 0)
+            total -= size
+        with self._lock:
+            self._total_bytes = total
+
+    async def get(self, key: str) -> Optional[str]:
+        text = await asyncio.to_thread(self._get_sync, key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    async def put(self, key: str, text: str, meta: Optional[Dict] = None):
+        try:
+            await asyncio.to_thread(self._put_sync, key, text, meta)
+        except Exception as e:
+            print(f"Warning: Failed to write LLM cache entry: {e}")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+response_cache: Optional[ResponseCache] = None
+if LLM_CACHE_DIR:
+    response_cache = ResponseCache(LLM_CACHE_DIR, int(LLM_CACHE_MAX_MB * 1024 * 1024), LLM_CACHE_MAX_AGE)
@@ -0,0 +1,574 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager, aclosing
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple, Optional, AsyncIterator
+import httpx
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_CLIENT_IDLE_TTL = float(os.getenv("LLM_CLIENT_IDLE_TTL", "900"))
+LLM_CLIENT_EVICT_INTERVAL = float(os.getenv("LLM_CLIENT_EVICT_INTERVAL", "60"))
+
+ClientKey = Tuple[str, str, float]
+
+
+class _PooledClient:
+    def __init__(self, client: AsyncOpenAI):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class ClientRegistry:
+    """Process-wide pool of AsyncOpenAI clients keyed by (base_url, api_key, timeout).
+
+    Each client owns a keep-alive httpx connection pool, so consecutive agent
+    calls against the same endpoint reuse TCP/TLS connections. Clients that
+    have not been leased for `idle_ttl` seconds are closed, on the next lease
+    or by the loop `start()` runs, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+        idle_ttl: float = LLM_CLIENT_IDLE_TTL,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.idle_ttl = idle_ttl
+        self._clients: Dict[ClientKey, _PooledClient] = {}
+        self._lock = asyncio.Lock()
+        self._evict_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def make_key(base_url: Optional[str], api_key: Optional[str], timeout: float) -> ClientKey:
+        # Never keep raw API keys around as dict keys.
+        key_digest = hashlib.sha256((api_key or "").encode()).hexdigest()
+        return (base_url or "", key_digest, float(timeout))
+
+    def _build_client(self, base_url: Optional[str], api_key: Optional[str], timeout: float) -> AsyncOpenAI:
+        http_client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+        )
+        # Retries are owned by RetryPolicy, not the SDK.
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, http_client=http_client, max_retries=0)
+
+    @asynccontextmanager
+    async def lease(self, base_url: Optional[str], api_key: Optional[str], timeout: float) -> AsyncIterator[AsyncOpenAI]:
+        key = self.make_key(base_url, api_key, timeout)
+        async with self._lock:
+            await self._evict_idle_locked()
+            pooled = self._clients.get(key)
+            if pooled is None:
+                pooled = _PooledClient(self._build_client(base_url, api_key, timeout))
+                self._clients[key] = pooled
+            pooled.in_use += 1
+        try:
+            yield pooled.client
+        finally:
+            pooled.in_use -= 1
+            pooled.last_used = time.monotonic()
+
+    async def _evict_idle_locked(self):
+        now = time.monotonic()
+        expired = [
+            key for key, pooled in self._clients.items()
+            if pooled.in_use == 0 and now - pooled.last_used > self.idle_ttl
+        ]
+        for key in expired:
+            pooled = self._clients.pop(key)
+            try:
+                await pooled.client.close()
+            except Exception as e:
+                print(f"Warning: Failed to close idle LLM client: {e}")
+
+    async def evict_idle(self):
+        async with self._lock:
+            await self._evict_idle_locked()
+
+    async def _evict_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Warning: Failed to evict idle LLM clients: {e}")
+
+    def start(self, interval: float = LLM_CLIENT_EVICT_INTERVAL):
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop(interval))
+
+    async def stop(self):
+        if self._evict_task:
+            self._evict_task.cancel()
+            try:
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+            self._evict_task = None
+
+    async def aclose(self):
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for pooled in clients:
+            try:
+                await pooled.client.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clients": len(self._clients),
+            "in_use": sum(p.in_use for p in self._clients.values()),
+        }
+
+
+client_registry = ClientRegistry()
+
+
+class LLMEvent(BaseModel):
+    kind: str  # "delta" | "reset" | "notice" | "usage"
+    text: str = ""
+    usage: Optional[Dict] = None
+
+
+class LLMStream:
+    """Async iterator over LLMEvents that also assembles the full completion.
+
+    A "reset" event means the provider failed mid-stream and the request is
+    being retried, so everything received so far must be discarded. "notice"
+    events carry status text for the user and "usage" events carry token
+    accounting; neither is part of the completion.
+    """
+
+    def __init__(self, source: AsyncIterator[LLMEvent]):
+        self._source = source
+        self._chunks: List[str] = []
+        self.usage: Optional[Dict] = None
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        async for event in self._source:
+            if event.kind == "delta":
+                self._chunks.append(event.text)
+            elif event.kind == "reset":
+                self._chunks = []
+            elif event.kind == "usage":
+                self.usage = event.usage
+            yield event
+        self.done = True
+
+    async def read(self) -> str:
+        async for _ in self:
+            pass
+        return self.text
+
+
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30.0"))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30.0"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def get_status_code(exc: Exception) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def get_retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(BaseModel):
+    max_attempts: int = LLM_RETRY_MAX_ATTEMPTS
+    base_delay: float = LLM_RETRY_BASE_DELAY
+    max_delay: float = LLM_RETRY_MAX_DELAY
+    multiplier: float = 2.0
+    # Fraction of the backoff that is randomized (1.0 = "full jitter").
+    jitter: float = 1.0
+    respect_retry_after: bool = True
+    max_retry_after: float = 120.0
+
+    def is_retryable(self, exc: Exception) -> bool:
+        status = get_status_code(exc)
+        return status is None or status in RETRYABLE_STATUS_CODES
+
+    def compute_delay(self, attempt: int, exc: Optional[Exception] = None) -> float:
+        if exc is not None and self.respect_retry_after:
+            retry_after = get_retry_after(exc)
+            if retry_after is not None:
+                # Small jitter keeps sessions throttled together from waking in lockstep.
+                return min(retry_after, self.max_retry_after) + random.uniform(0, self.base_delay)
+        backoff = min(self.max_delay, self.base_delay * (self.multiplier ** max(0, attempt - 1)))
+        jitter = max(0.0, min(1.0, self.jitter))
+        return backoff * (1 - jitter) + random.uniform(0, backoff * jitter)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, base_url: str, retry_in: float):
+        super().__init__(f"LLM endpoint {base_url} is unavailable (circuit open, next probe in {retry_in:.0f}s)")
+        self.base_url = base_url
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, base_url: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD, reset_timeout: float = LLM_BREAKER_RESET_TIMEOUT):
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.base_url, self.reset_timeout - elapsed)
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            # Only one probe request at a time while half-open.
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.base_url, self.reset_timeout)
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        # Call finished without a verdict (e.g. cancelled); let another probe through.
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, base_url: Optional[str]) -> CircuitBreaker:
+        key = base_url or "default"
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key)
+            self._breakers[key] = breaker
+        return breaker
+
+    def stats(self) -> Dict[str, Dict]:
+        return {url: breaker.stats() for url, breaker in self._breakers.items()}
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+# Per-backend overrides, e.g. {"http://gpu-box:1234/v1": {"max_in_flight": 2, "max_queue": 8}}
+LLM_SLOT_LIMITS = json.loads(os.getenv("LLM_SLOT_LIMITS", "{}") or "{}")
+
+
+class QueueFullError(Exception):
+    def __init__(self, key: str, max_queue: int):
+        super().__init__(f"LLM backend {key} is saturated ({max_queue} requests already queued)")
+
+
+class _SlotWaiter:
+    def __init__(self):
+        self.granted = False
+        self.moved = asyncio.Event()
+
+
+class SlotLimiter:
+    """Caps in-flight requests to one backend and queues the rest in FIFO order.
+
+    `acquire()` is an async generator that yields the caller's 1-based queue
+    position every time it changes and finishes once a slot is held. The slot
+    must then be returned with `release()`.
+    """
+
+    def __init__(self, key: str, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queue: int = LLM_MAX_QUEUE):
+        self.key = key
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.in_flight = 0
+        self._waiters: Deque[_SlotWaiter] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _notify(self):
+        for waiter in self._waiters:
+            waiter.moved.set()
+
+    async def acquire(self) -> AsyncIterator[int]:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise QueueFullError(self.key, self.max_queue)
+
+        waiter = _SlotWaiter()
+        self._waiters.append(waiter)
+        acquired = False
+        try:
+            last_position = None
+            while not waiter.granted:
+                position = self._waiters.index(waiter) + 1
+                if position != last_position:
+                    last_position = position
+                    yield position
+                    if waiter.granted:
+                        break
+                waiter.moved.clear()
+                await waiter.moved.wait()
+            acquired = True
+        finally:
+            if not acquired:
+                if waiter.granted:
+                    # Slot was handed over just as the caller went away.
+                    self.release()
+                else:
+                    self._waiters.remove(waiter)
+                    self._notify()
+
+    def release(self):
+        if self._waiters:
+            # Hand the slot straight to the next waiter; in_flight is unchanged.
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.moved.set()
+            self._notify()
+        else:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+class SlotLimiterRegistry:
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None):
+        self.limits = limits or {}
+        self._limiters: Dict[str, SlotLimiter] = {}
+
+    def get(self, base_url: Optional[str]) -> SlotLimiter:
+        key = base_url or "default"
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = SlotLimiter(key, **self.limits.get(key, {}))
+            self._limiters[key] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Dict]:
+        return {key: limiter.stats() for key, limiter in self._limiters.items()}
+
+
+slot_limiters = SlotLimiterRegistry(LLM_SLOT_LIMITS)
+
+
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+
+
+class _Flight:
+    def __init__(self):
+        self.events: List[LLMEvent] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Optional[LLMEvent] = None):
+        if event is not None:
+            self.events.append(event)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """Collapses concurrent identical LLM requests into one upstream call.
+
+    The upstream call runs in its own task, owned by none of the callers.
+    Every subscriber replays the events published so far and then follows
+    the live ones, so late joiners still get the complete completion.
+    A subscriber going away only cancels the upstream call if it was the
+    last one still listening.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        payload = json.dumps([str(p) for p in parts], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _run(self, key: str, flight: _Flight, source: AsyncIterator[LLMEvent]):
+        try:
+            async with aclosing(source) as events:
+                async for event in events:
+                    flight.publish(event)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.publish()
+
+    async def subscribe(self, key: str, factory: Callable[[], AsyncIterator[LLMEvent]]) -> AsyncIterator[LLMEvent]:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory()))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.events):
+                    event = flight.events[index]
+                    index += 1
+                    yield event
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}
+
+
+single_flight = SingleFlight()
+
+
+def usage_to_dict(usage) -> Dict:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details else 0,
+    }
+
+
+class UsageStats:
+    """Running totals of prompt-cache reuse and time-to-first-token per model."""
+
+    def __init__(self):
+        self._models: Dict[str, Dict] = {}
+
+    def record(self, model: str, usage: Dict):
+        totals = self._models.setdefault(model, {
+            "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "ttft_ms_total": 0, "ttft_samples": 0,
+        })
+        totals["calls"] += 1
+        totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        totals["cached_tokens"] += usage.get("cached_tokens", 0)
+        totals["completion_tokens"] += usage.get("completion_tokens", 0)
+        if usage.get("ttft_ms") is not None:
+            totals["ttft_ms_total"] += usage["ttft_ms"]
+            totals["ttft_samples"] += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        result = {}
+        for model, totals in self._models.items():
+            result[model] = {
+                "calls": totals["calls"],
+                "prompt_tokens": totals["prompt_tokens"],
+                "cached_tokens": totals["cached_tokens"],
+                "completion_tokens": totals["completion_tokens"],
+                "cache_ratio": round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0,
+                "avg_ttft_ms": round(totals["ttft_ms_total"] / totals["ttft_samples"]) if totals["ttft_samples"] else None,
+            }
+        return result
+
+
+usage_stats = UsageStats()
@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import httpx
+
+# Comma-separated list of OpenAI-compatible servers (LM Studio / Ollama / llama.cpp).
+LLM_BACKEND_URLS = [u.strip() for u in os.getenv("LLM_BACKEND_URLS", "").split(",") if u.strip()]
+LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", "15"))
+LLM_HEALTH_CHECK_TIMEOUT = float(os.getenv("LLM_HEALTH_CHECK_TIMEOUT", "3"))
+LLM_NODE_MAX_FAILURES = int(os.getenv("LLM_NODE_MAX_FAILURES", "2"))
+LLM_STICKY_ROUTING = os.getenv("LLM_STICKY_ROUTING", "true").lower() == "true"
+MAX_STICKY_SESSIONS = 1024
+
+
+class BackendNode:
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.total_requests = 0
+        self.consecutive_failures = 0
+        self.last_checked = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "total_requests": self.total_requests,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class BackendPool:
+    """Least-outstanding-requests routing over several local LLM servers.
+
+    Nodes that fail `max_failures` times in a row (or fail a health check) are
+    taken out of rotation until a periodic `GET /models` probe succeeds again.
+    With a sticky key (one per workflow) every agent of a run is routed to the
+    same node while it stays healthy, so the server's prompt-prefix KV cache
+    can be reused.
+    """
+
+    def __init__(self, urls: List[str], max_failures: int = LLM_NODE_MAX_FAILURES, health_check_interval: float = LLM_HEALTH_CHECK_INTERVAL):
+        self.nodes = [BackendNode(url) for url in urls]
+        self.max_failures = max_failures
+        self.health_check_interval = health_check_interval
+        self._sticky: "OrderedDict[str, str]" = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.nodes)
+
+    def _node(self, url: str) -> Optional[BackendNode]:
+        for node in self.nodes:
+            if node.url == url:
+                return node
+        return None
+
+    def select(self, sticky_key: Optional[str] = None) -> Optional[BackendNode]:
+        if not self.nodes:
+            return None
+        # If every node looks dead, keep trying all of them rather than refusing outright.
+        candidates = [n for n in self.nodes if n.healthy] or self.nodes
+
+        if sticky_key:
+            url = self._sticky.get(sticky_key)
+            node = self._node(url) if url else None
+            if node and node in candidates:
+                self._sticky.move_to_end(sticky_key)
+                return node
+
+        node = min(candidates, key=lambda n: (n.outstanding, n.total_requests))
+        if sticky_key:
+            self._sticky[sticky_key] = node.url
+            self._sticky.move_to_end(sticky_key)
+            while len(self._sticky) > MAX_STICKY_SESSIONS:
+                self._sticky.popitem(last=False)
+        return node
+
+    def acquire(self, node: BackendNode):
+        node.outstanding += 1
+        node.total_requests += 1
+
+    def release(self, node: BackendNode):
+        node.outstanding = max(0, node.outstanding - 1)
+
+    def release_sticky(self, sticky_key: str):
+        self._sticky.pop(sticky_key, None)
+
+    def mark_success(self, node: BackendNode):
+        node.consecutive_failures = 0
+        node.healthy = True
+
+    def mark_failure(self, node: BackendNode):
+        node.consecutive_failures += 1
+        if node.consecutive_failures >= self.max_failures and node.healthy:
+            node.healthy = False
+            print(f"LLM Router: removing {node.url} from rotation after {node.consecutive_failures} failures")
+
+    async def check_health(self, node: BackendNode, http_client: httpx.AsyncClient):
+        node.last_checked = time.monotonic()
+        try:
+            response = await http_client.get(f"{node.url.rstrip('/')}/models")
+            ok = response.status_code < 500
+        except Exception:
+            ok = False
+        if ok:
+            if not node.healthy:
+                print(f"LLM Router: {node.url} is healthy again")
+            self.mark_success(node)
+        else:
+            node.consecutive_failures = max(node.consecutive_failures, self.max_failures)
+            if node.healthy:
+                print(f"LLM Router: health check failed for {node.url}")
+            node.healthy = False
+
+    async def _health_loop(self):
+        async with httpx.AsyncClient(timeout=LLM_HEALTH_CHECK_TIMEOUT) as http_client:
+            while True:
+                await asyncio.gather(*(self.check_health(node, http_client) for node in self.nodes))
+                await asyncio.sleep(self.health_check_interval)
+
+    def start(self):
+        if self.nodes and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "nodes": {node.url: node.stats() for node in self.nodes},
+            "sticky_sessions": len(self._sticky),
+        }
+
+
+backend_pool = BackendPool(LLM_BACKEND_URLS)
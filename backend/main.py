@@ -1,12 +1,23 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from agents import Orchestrator
+from llm_client import client_registry, circuit_breakers, slot_limiters, single_flight, usage_stats
+from llm_cache import response_cache
+from dep_cache import dependency_cache
+from warm_runner import warm_runner
+from sandboxes import sandbox_pool
+from llm_router import backend_pool
+from jobs import JobQueue, Job, JobQueueFullError, JobConflictError
+from checkpoints import checkpoint_store
+from workspaces import workspace_manager, disk_usage, Workspace, InvalidPathError, QuotaExceededError, DEFAULT_SESSION
 import json
 import subprocess
 import asyncio
 import tempfile
 import os
+import uuid
 from pydantic import BaseModel
+from typing import Dict, Optional
 import pty
 import sys
 import select
@@ -17,6 +28,12 @@ class RunRequest(BaseModel):
 
 app = FastAPI()
 
+def session_workspace(session_id: str = DEFAULT_SESSION) -> Workspace:
+    try:
+        return workspace_manager.get(session_id)
+    except InvalidPathError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/run")
 async def run_script(request: RunRequest):
     try:
@@ -46,18 +63,14 @@ class SaveRequest(BaseModel):
     content: str
 
 @app.post("/save-file")
-async def save_file_endpoint(request: SaveRequest):
+async def save_file_endpoint(request: SaveRequest, workspace: Workspace = Depends(session_workspace)):
     try:
-        if ".." in request.filename or request.filename.startswith("/"):
+        try:
+            workspace.write_files({request.filename: request.content})
+        except InvalidPathError:
              return {"error": "Invalid filename"}
-
-        workspace_dir = "/app/workspace"
-        file_path = os.path.join(workspace_dir, request.filename)
-        
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(request.content)
+        except QuotaExceededError as e:
+             return {"error": str(e)}
             
         return {"status": "ok", "message": f"File {request.filename} saved successfully"}
     except Exception as e:
@@ -67,14 +80,16 @@ class CreateFolderRequest(BaseModel):
     path: str
 
 @app.post("/create-folder")
-async def create_folder_endpoint(request: CreateFolderRequest):
+async def create_folder_endpoint(request: CreateFolderRequest, workspace: Workspace = Depends(session_workspace)):
     try:
         # Prevent directory traversal
-        if ".." in request.path or request.path.startswith("/"):
+        try:
+            folder_path = workspace.path(request.path)
+            workspace.check_quota(added_files=1)
+        except InvalidPathError:
              return {"error": "Invalid folder path"}
-
-        workspace_dir = "/app/workspace"
-        folder_path = os.path.join(workspace_dir, request.path)
+        except QuotaExceededError as e:
+             return {"error": str(e)}
         
         os.makedirs(folder_path, exist_ok=True)
         
@@ -89,15 +104,14 @@ class DeleteItemRequest(BaseModel):
     path: str
 
 @app.post("/delete-item")
-async def delete_item_endpoint(request: DeleteItemRequest):
+async def delete_item_endpoint(request: DeleteItemRequest, workspace: Workspace = Depends(session_workspace)):
     try:
-        if ".." in request.path or request.path.startswith("/"):
+        try:
+            target_path = workspace.path(request.path)
+        except InvalidPathError:
              return {"error": "Invalid path"}
         
-        workspace_dir = "/app/workspace"
-        target_path = os.path.join(workspace_dir, request.path)
-        
-        if not os.path.exists(target_path):
+        if target_path == os.path.realpath(workspace.root) or not os.path.exists(target_path):
              return {"error": "Item not found"}
 
         if os.path.isdir(target_path):
@@ -115,15 +129,14 @@ class RenameItemRequest(BaseModel):
     new_path: str
 
 @app.post("/rename-item")
-async def rename_item_endpoint(request: RenameItemRequest):
+async def rename_item_endpoint(request: RenameItemRequest, workspace: Workspace = Depends(session_workspace)):
     try:
-        if ".." in request.old_path or request.old_path.startswith("/") or ".." in request.new_path or request.new_path.startswith("/"):
+        try:
+            old_target = workspace.path(request.old_path)
+            new_target = workspace.path(request.new_path)
+        except InvalidPathError:
              return {"error": "Invalid path"}
         
-        workspace_dir = "/app/workspace"
-        old_target = os.path.join(workspace_dir, request.old_path)
-        new_target = os.path.join(workspace_dir, request.new_path)
-        
         if not os.path.exists(old_target):
              return {"error": "Item not found"}
         
@@ -137,19 +150,12 @@ async def rename_item_endpoint(request: RenameItemRequest):
         return {"error": f"Failed to rename: {str(e)}"}
 
 @app.post("/delete-all")
-async def delete_all_items():
-    workspace_dir = "/app/workspace"
-    if not os.path.exists(workspace_dir):
+async def delete_all_items(workspace: Workspace = Depends(session_workspace)):
+    if not os.path.exists(workspace.root):
         return {"status": "ok", "message": "Workspace already empty"}
         
     try:
-        import shutil
-        for item in os.listdir(workspace_dir):
-            item_path = os.path.join(workspace_dir, item)
-            if os.path.isfile(item_path) or os.path.islink(item_path):
-                os.unlink(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
+        workspace.clear()
         return {"status": "ok", "message": "Workspace cleared"}
     except Exception as e:
         return {"error": f"Failed to clear workspace: {str(e)}"}
@@ -159,20 +165,28 @@ class DuplicateItemRequest(BaseModel):
     new_path: str
 
 @app.post("/duplicate-item")
-async def duplicate_item_endpoint(request: DuplicateItemRequest):
+async def duplicate_item_endpoint(request: DuplicateItemRequest, workspace: Workspace = Depends(session_workspace)):
     try:
-        if ".." in request.source_path or request.source_path.startswith("/") or ".." in request.new_path or request.new_path.startswith("/"):
+        try:
+            source_target = workspace.path(request.source_path)
+            new_target = workspace.path(request.new_path)
+        except InvalidPathError:
              return {"error": "Invalid path"}
         
-        workspace_dir = "/app/workspace"
-        source_target = os.path.join(workspace_dir, request.source_path)
-        new_target = os.path.join(workspace_dir, request.new_path)
-        
         if not os.path.exists(source_target):
              return {"error": "Item not found"}
         
         if os.path.exists(new_target):
              return {"error": "Destination already exists"}
+
+        if os.path.isdir(source_target):
+            copied = disk_usage(source_target)
+        else:
+            copied = {"bytes": os.path.getsize(source_target), "files": 1}
+        try:
+            workspace.check_quota(copied["bytes"], copied["files"])
+        except QuotaExceededError as e:
+             return {"error": str(e)}
         
         import shutil
         if os.path.isdir(source_target):
@@ -190,36 +204,33 @@ import io
 
 from fastapi.staticfiles import StaticFiles
 
-os.makedirs("/app/workspace", exist_ok=True)
-app.mount("/preview", StaticFiles(directory="/app/workspace", html=True), name="preview")
+default_workspace = workspace_manager.get(DEFAULT_SESSION)
+app.mount("/preview", StaticFiles(directory=default_workspace.root, html=True), name="preview")
+
+@app.get("/sessions/{session_id}/preview/{path:path}")
+async def session_preview(session_id: str, path: str, request: Request):
+    workspace = session_workspace(session_id)
+    return await StaticFiles(directory=workspace.root, html=True).get_response(path or ".", request.scope)
 
 @app.get("/list-files")
-async def list_files():
-    workspace_dir = "/app/workspace"
-    if not os.path.exists(workspace_dir):
+async def list_files(workspace: Workspace = Depends(session_workspace)):
+    if not os.path.exists(workspace.root):
         return {"files": {}}
-        
-    files_map = {}
-    for root, dirs, files in os.walk(workspace_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            rel_path = os.path.relpath(file_path, workspace_dir)
-            rel_path = rel_path.replace("\\", "/")
-            
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                files_map[rel_path] = content
-            except UnicodeDecodeError:
-                files_map[rel_path] = "" 
-            except Exception as e:
-                print(f"Error reading {rel_path}: {e}")
-                
-    return {"files": files_map}
+    return {"files": await asyncio.to_thread(workspace.read_files)}
+
+@app.get("/workspace-usage")
+async def workspace_usage(workspace: Workspace = Depends(session_workspace)):
+    return {
+        "session_id": workspace.session_id,
+        **workspace.stats(),
+        "quota_bytes": workspace.quota_bytes,
+        "max_files": workspace.max_files,
+        "manager": workspace_manager.stats(),
+    }
 
 @app.get("/download-project")
-async def download_project():
-    base_dir = "/app/workspace"
+async def download_project(workspace: Workspace = Depends(session_workspace)):
+    base_dir = workspace.root
     if not os.path.exists(base_dir):
         return {"error": "No project files found."}
         
@@ -260,38 +271,229 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_llm_router():
+    client_registry.start()
+    backend_pool.start()
+    workspace_manager.start(busy=job_queue.busy_sessions)
+    job_queue.start()
+    if warm_runner:
+        warm_runner.start()
+    if sandbox_pool:
+        sandbox_pool.start()
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await backend_pool.stop()
+    await job_queue.stop()
+    await workspace_manager.stop()
+    if warm_runner:
+        await warm_runner.stop()
+    if sandbox_pool:
+        await sandbox_pool.stop()
+    await client_registry.stop()
+    await client_registry.aclose()
+
+@app.get("/llm-health")
+async def llm_health():
+    return {
+        "clients": client_registry.stats(),
+        "circuits": circuit_breakers.stats(),
+        "slots": slot_limiters.stats(),
+        "backends": backend_pool.stats(),
+        "single_flight": single_flight.stats(),
+        "usage": usage_stats.stats(),
+    }
+
+@app.get("/llm-cache/stats")
+async def llm_cache_stats():
+    if not response_cache:
+        return {"enabled": False}
+    return response_cache.stats()
+
+@app.get("/dep-cache/stats")
+async def dep_cache_stats():
+    if not dependency_cache:
+        return {"enabled": False}
+    return dependency_cache.stats()
+
+@app.get("/warm-runner/stats")
+async def warm_runner_stats():
+    if not warm_runner:
+        return {"enabled": False}
+    return warm_runner.stats()
+
+@app.get("/sandboxes/stats")
+async def sandbox_stats():
+    if not sandbox_pool:
+        return {"enabled": False}
+    return sandbox_pool.stats()
+
 @app.get("/")
 def read_root():
     return {"message": "Multi-Agent Backend is Running"}
 
+def build_config(request_data: Dict) -> Dict:
+    use_local_llm = request_data.get("use_local_llm", True) 
+    api_key = request_data.get("api_key")
+    auto_fix = request_data.get("auto_fix", False)
+    language = request_data.get("language", "Python")
+    stream = request_data.get("stream", True)
+    use_cache = not request_data.get("bypass_cache", False)
+    config = {"use_local_llm": use_local_llm, "api_key": api_key, "auto_fix": auto_fix, "language": language, "stream": stream, "use_cache": use_cache}
+    if request_data.get("retry_policy"):
+        config["retry_policy"] = request_data["retry_policy"]
+    if request_data.get("agent_retry_policies"):
+        config["agent_retry_policies"] = request_data["agent_retry_policies"]
+    for key in ("speculative_candidates", "speculative_token_cap", "incremental_fix", "fingerprint_repeat_limit", "checkpoints", "test_timeout", "test_shards", "dep_cache", "warm_runner", "sandbox", "test_impact", "test_coverage"):
+        if request_data.get(key) is not None:
+            config[key] = request_data[key]
+    return config
+
+async def run_generation(job: Job):
+    with workspace_manager.lease(job.session_id) as workspace:
+        orchestrator = Orchestrator(workspace=workspace)
+        config = {**job.config, "cancel_token": job.cancel_token}
+        async for response in orchestrator.run_workflow(job.prompt, config):
+            yield response.dict()
+
+job_queue = JobQueue(run_generation)
+
+def resume_config(request_data: Dict):
+    # {"resume": "<workflow_id>"} or {"resume": true} for the session's latest checkpoint.
+    resume = request_data["resume"]
+    session_id = request_data.get("session_id") or DEFAULT_SESSION
+    if isinstance(resume, str):
+        checkpoint = checkpoint_store.load(resume)
+        # Only the session that ran a workflow may resume it; others get the same answer as for a missing one.
+        if checkpoint is not None and (checkpoint.get("session_id") or DEFAULT_SESSION) != session_id:
+            checkpoint = None
+    else:
+        checkpoint = checkpoint_store.latest(session_id)
+    if checkpoint is None:
+        raise ValueError("No checkpoint to resume")
+    config = checkpoint.get("config", {})
+    # Secrets are never checkpointed, the resuming request has to bring them again.
+    config.update({k: v for k, v in build_config(request_data).items() if k in ("use_local_llm", "api_key", "stream", "use_cache")})
+    config["resume"] = config["workflow_id"] = checkpoint["workflow_id"]
+    return checkpoint["prompt"], config, session_id
+
+def submit_job(request_data: Dict) -> Job:
+    if request_data.get("resume"):
+        prompt, config, session_id = resume_config(request_data)
+    else:
+        prompt = request_data.get("prompt")
+        if not prompt:
+            raise ValueError("No prompt provided")
+        config = build_config(request_data)
+        config["workflow_id"] = uuid.uuid4().hex
+        session_id = request_data.get("session_id") or DEFAULT_SESSION
+    workspace_manager.get(session_id)
+    job = job_queue.submit(prompt, config, session_id)
+    print(f"Queued job {job.id} with prompt: {prompt[:50]}... (session {session_id})")
+    return job
+
+@app.post("/jobs")
+async def create_job(request: Dict):
+    try:
+        job = submit_job(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**job.info(), "position": job_queue.position(job)}
+
+@app.get("/jobs")
+async def list_jobs(session_id: Optional[str] = None):
+    return {"jobs": job_queue.list(session_id), "stats": job_queue.stats()}
+
+@app.get("/checkpoints")
+async def list_checkpoints(session_id: Optional[str] = None):
+    return {"checkpoints": checkpoint_store.list(session_id)}
+
+def find_job(job_id: str) -> Job:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = find_job(job_id)
+    return {**job.info(), "position": job_queue.position(job)}
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, after: int = 0):
+    job = find_job(job_id)
+    return {"job_id": job.id, "status": job.status, "events": [e for e in job.events if e["seq"] > after]}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = find_job(job_id)
+    if not job_queue.cancel(job.id, "Cancelled by user"):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+    return job.info()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    return find_job(job_id).result()
+
 @app.websocket("/generate")
 async def websocket_endpoint(websocket: WebSocket):
     print("WS: Connection request received for /generate")
     await websocket.accept()
     print("WS: Connection accepted")
     try:
-        print("WS: Initializing Orchestrator...")
-        orchestrator = Orchestrator()
-        
         data = await websocket.receive_text()
         request_data = json.loads(data)
-        prompt = request_data.get("prompt")
-        
-        use_local_llm = request_data.get("use_local_llm", True) 
-        api_key = request_data.get("api_key")
-        auto_fix = request_data.get("auto_fix", False)
-        language = request_data.get("language", "Python")
-        config = {"use_local_llm": use_local_llm, "api_key": api_key, "auto_fix": auto_fix, "language": language}
 
-        if not prompt:
-            await websocket.send_json({"error": "No prompt provided"})
+        # Either start a new job or re-attach to a running one ({"job_id": ..., "after": seq}).
+        job_id = request_data.get("job_id")
+        if not job_id:
+            try:
+                job_id = submit_job(request_data).id
+            except (ValueError, JobQueueFullError, JobConflictError) as e:
+                await websocket.send_json({"error": str(e)})
+                return
+        elif job_queue.get(job_id) is None:
+            await websocket.send_json({"error": "Job not found"})
             return
 
-        print(f"Starting generation with prompt: {prompt[:50]}...")
-        async for response in orchestrator.run_workflow(prompt, config):
-            await websocket.send_json(response.dict())
-            
-        await websocket.send_json({"status": "done"})
+        async def forward():
+            async for event in job_queue.subscribe(job_id, int(request_data.get("after", 0))):
+                await websocket.send_json(event)
+
+        async def watch_client():
+            # Notices a closed tab right away instead of on the next send, and handles the stop button.
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get("type") == "cancel":
+                    job_queue.cancel(job_id, "Cancelled by user")
+
+        forwarding = asyncio.create_task(forward())
+        watching = asyncio.create_task(watch_client())
+        try:
+            await asyncio.wait({forwarding, watching}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (forwarding, watching):
+                task.cancel()
+            await asyncio.gather(forwarding, watching, return_exceptions=True)
+            delivered = forwarding.done() and not forwarding.cancelled() and forwarding.exception() is None
+            if not delivered and request_data.get("cancel_on_disconnect", True):
+                job_queue.release(job_id)
+
+        if delivered:
+            await websocket.send_json({"status": "done", "job_id": job_id, "job_status": job_queue.get(job_id).status})
+            return
+        error = forwarding.exception() if not forwarding.cancelled() else watching.exception()
+        if error and not isinstance(error, WebSocketDisconnect):
+            raise error
+        print("Client disconnected")
 
     except WebSocketDisconnect:
         print("Client disconnected")
@@ -305,11 +507,17 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.websocket("/terminal")
 async def terminal_endpoint(websocket: WebSocket):
     await websocket.accept()
+    workspace = None
     
     try:
+        try:
+            workspace = workspace_manager.get(websocket.query_params.get("session_id"))
+        except InvalidPathError as e:
+            await websocket.send_text(f"Error: {e}\r\n")
+            await websocket.close()
+            return
+        workspace.active += 1
         master_fd, slave_fd = pty.openpty()
-        
-        os.makedirs("/app/workspace", exist_ok=True)
 
         process = subprocess.Popen(
             ["/bin/bash"],
@@ -317,8 +525,8 @@ async def terminal_endpoint(websocket: WebSocket):
             stdout=slave_fd,
             stderr=slave_fd,
             preexec_fn=os.setsid,
-            cwd="/app/workspace",
-            env={**os.environ, "TERM": "xterm-256color"}
+            cwd=workspace.root,
+            env={**os.environ, "TERM": "xterm-256color", "WORKSPACE": workspace.root}
         )
         
         os.close(slave_fd)
@@ -360,6 +568,9 @@ async def terminal_endpoint(websocket: WebSocket):
         print(f"Terminal Error: {e}")
         await websocket.close()
     finally:
+        if workspace:
+            workspace.active -= 1
+            workspace.touch()
         try:
             process.terminate()
             process.wait()
@@ -0,0 +1,134 @@
+import re
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+_HUNK_HEADER = re.compile(r"^@@+ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@+")
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk(BaseModel):
+    old_start: int
+    lines: List[str] = []
+
+    @property
+    def old_lines(self) -> List[str]:
+        return [line[1:] for line in self.lines if line[:1] in (" ", "-")]
+
+    @property
+    def new_lines(self) -> List[str]:
+        return [line[1:] for line in self.lines if line[:1] in (" ", "+")]
+
+
+class FilePatch(BaseModel):
+    path: str
+    is_new: bool = False
+    is_deleted: bool = False
+    hunks: List[Hunk] = []
+
+
+def _clean_path(raw: str) -> Optional[str]:
+    path = raw.split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path[:2] in ("a/", "b/"):
+        path = path[2:]
+    return path
+
+
+def parse_unified_diff(text: str) -> List[FilePatch]:
+    patches: List[FilePatch] = []
+    current: Optional[FilePatch] = None
+    hunk: Optional[Hunk] = None
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            old_path = _clean_path(line[4:])
+            new_path = _clean_path(lines[i + 1][4:])
+            current = FilePatch(path=new_path or old_path or "", is_new=old_path is None, is_deleted=new_path is None)
+            patches.append(current)
+            hunk = None
+            i += 2
+            continue
+        match = _HUNK_HEADER.match(line)
+        if match and current is not None:
+            hunk = Hunk(old_start=int(match.group(1)))
+            current.hunks.append(hunk)
+        elif hunk is not None:
+            if line[:1] in (" ", "-", "+"):
+                hunk.lines.append(line)
+            elif line == "":
+                # Models tend to strip the single space of blank context lines.
+                hunk.lines.append(" ")
+            elif line.startswith("\\"):
+                pass
+            else:
+                hunk = None
+        i += 1
+
+    for patch in patches:
+        if not patch.path:
+            raise PatchError("Diff header without a file path")
+        for h in patch.hunks:
+            # Trailing blank "context" lines are usually just the gap before the next block.
+            while h.lines and h.lines[-1] == " ":
+                h.lines.pop()
+    return [p for p in patches if p.hunks or p.is_deleted]
+
+
+def _find(lines: List[str], needle: List[str], expected: int, start: int) -> int:
+    if not needle:
+        return max(start, min(expected, len(lines)))
+    candidates = range(start, len(lines) - len(needle) + 1)
+    # Closest match to where the hunk header says it should be wins.
+    for normalize in (lambda s: s, lambda s: s.rstrip(), lambda s: s.strip()):
+        target = [normalize(n) for n in needle]
+        for pos in sorted(candidates, key=lambda p: abs(p - expected)):
+            if [normalize(l) for l in lines[pos:pos + len(needle)]] == target:
+                return pos
+    return -1
+
+
+def apply_hunks(original: str, hunks: List[Hunk], path: str = "") -> str:
+    lines = original.splitlines()
+    offset = 0
+    start = 0
+    for hunk in hunks:
+        old, new = hunk.old_lines, hunk.new_lines
+        pos = _find(lines, old, hunk.old_start - 1 + offset, start)
+        if pos < 0:
+            preview = old[0].strip() if old else ""
+            raise PatchError(f"Hunk @@ -{hunk.old_start} @@ does not apply to {path or 'file'} (context: '{preview}')")
+        lines[pos:pos + len(old)] = new
+        offset += len(new) - len(old)
+        start = pos + len(new)
+    text = "\n".join(lines)
+    if original.endswith("\n") or not original:
+        text += "\n"
+    return text
+
+
+def apply_patches(files: Dict[str, str], patches: List[FilePatch]) -> Dict[str, str]:
+    """Applies parsed patches to `files` and returns only the changed files.
+
+    Raises PatchError if any hunk fails, so callers can fall back to full
+    regeneration instead of saving a half-patched workspace.
+    """
+    changed = {}
+    for patch in patches:
+        if patch.is_deleted:
+            raise PatchError(f"Deleting files via patch is not supported ({patch.path})")
+        if patch.is_new:
+            if patch.path in files:
+                raise PatchError(f"Patch creates {patch.path}, but it already exists")
+            changed[patch.path] = "\n".join(line for h in patch.hunks for line in h.new_lines) + "\n"
+            continue
+        original = changed.get(patch.path, files.get(patch.path))
+        if original is None:
+            raise PatchError(f"Patch targets unknown file {patch.path}")
+        changed[patch.path] = apply_hunks(original, patch.hunks, patch.path)
+    return changed
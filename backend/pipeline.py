@@ -0,0 +1,129 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+# Outcomes that let dependents start.
+_SATISFIED = ("done", "restored", "skipped")
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[Dict], AsyncIterator],
+        depends_on: Iterable[str] = (),
+        when: Optional[Callable[[Dict], bool]] = None,
+    ):
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on)
+        self.when = when
+
+
+class Pipeline:
+    """Runs a DAG of stages, starting each one as soon as its dependencies finish.
+
+    Independent stages execute concurrently, but their response streams are
+    merged in declaration order: the earliest unfinished stage streams live
+    and later stages are buffered until everything declared before them is
+    done, so clients always see one agent's output at a time.
+
+    `when(state)` is checked once a stage's dependencies are done; a skipped
+    stage still counts as finished for its dependents. Outcomes are recorded
+    in `state["stages"]`. A stage that raises aborts the run once its output
+    is reached, cancelling whatever is still in flight; dependents of a
+    failed or cancelled stage never start.
+
+    Stages listed in `skip` (e.g. restored from a checkpoint) count as done
+    without running; `on_stage_done(name)` is called after each stage that
+    completes. The same Pipeline can be run any number of times.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self._validate()
+
+    def _validate(self):
+        names = [stage.name for stage in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError("Pipeline stage names must be unique")
+        position = {name: i for i, name in enumerate(names)}
+        for stage in self.stages:
+            for dep in stage.depends_on:
+                if dep not in position:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+                # Declaration order is the emit order, so it must be a topological order.
+                if position[dep] >= position[stage.name]:
+                    raise ValueError(f"Stage '{stage.name}' must be declared after its dependency '{dep}'")
+
+    async def run(self, state: Dict, skip: Iterable[str] = (), on_stage_done: Optional[Callable[[str], None]] = None) -> AsyncIterator:
+        outcomes = state["stages"] = {}
+        queues = {stage.name: asyncio.Queue() for stage in self.stages}
+        tasks: Dict[str, asyncio.Task] = {}
+        finished = set()
+        skip = set(skip)
+        closing = False
+
+        async def execute(stage: Stage):
+            queue = queues[stage.name]
+            try:
+                async for item in stage.run(state):
+                    await queue.put(item)
+                outcomes[stage.name] = "done"
+                if on_stage_done:
+                    on_stage_done(stage.name)
+            except asyncio.CancelledError:
+                outcomes[stage.name] = "cancelled"
+                raise
+            except Exception as e:
+                print(f"Pipeline: stage '{stage.name}' failed: {e}")
+                outcomes[stage.name] = "failed"
+                await queue.put(e)
+            finally:
+                queue.put_nowait(_DONE)
+                finished.add(stage.name)
+                # Nothing new may start once run() is tearing down: it
+                # only cancels and awaits the tasks that exist by then.
+                if outcomes[stage.name] == "done" and not closing:
+                    launch_ready()
+
+        def launch_ready():
+            for stage in self.stages:
+                if stage.name in tasks or stage.name in finished:
+                    continue
+                if not all(outcomes.get(dep) in _SATISFIED for dep in stage.depends_on):
+                    continue
+                if stage.name in skip:
+                    outcomes[stage.name] = "restored"
+                    finished.add(stage.name)
+                    queues[stage.name].put_nowait(_DONE)
+                    launch_ready()
+                    return
+                if stage.when is not None and not stage.when(state):
+                    outcomes[stage.name] = "skipped"
+                    finished.add(stage.name)
+                    queues[stage.name].put_nowait(_DONE)
+                    # Skipping may unblock later stages.
+                    launch_ready()
+                    return
+                outcomes[stage.name] = "running"
+                tasks[stage.name] = asyncio.create_task(execute(stage))
+
+        try:
+            launch_ready()
+            for stage in self.stages:
+                queue = queues[stage.name]
+                while True:
+                    item = await queue.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            closing = True
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,199 @@
+import os
+import time
+import codecs
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+from cancellation import CancelToken, kill_process_group
+
+# Bytes kept per stream (stdout / stderr); the rest is drained and dropped.
+PROCESS_OUTPUT_LIMIT = int(os.getenv("PROCESS_OUTPUT_LIMIT", str(2 * 1024 * 1024)))
+# How long to wait for the pipes to close after a kill before giving up on them.
+KILL_DRAIN_TIMEOUT = 2.0
+READ_CHUNK = 64 * 1024
+
+_EOF = object()
+
+
+class ProcessRun:
+    """A subprocess run without blocking the event loop.
+
+    stdout and stderr are read concurrently (so a chatty stderr can't
+    deadlock the pipe), the whole run is bounded by `timeout` and each
+    stream keeps at most `output_limit` bytes. The process gets its own
+    session and the whole group is killed on timeout, on cancellation
+    of the token and when the consumer goes away.
+
+    With `batch_interval` / `batch_bytes` set, output is coalesced per
+    stream and yielded at most every `batch_interval` seconds, or earlier
+    once `batch_bytes` are pending.
+
+        run = ProcessRun(["pytest", "."], cwd=tmp, timeout=300)
+        async for stream, text in run.stream():
+            ...
+        run.returncode, run.stdout, run.stderr, run.timed_out
+    """
+
+    def __init__(self, args: List[str], cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                 timeout: Optional[float] = None, output_limit: int = PROCESS_OUTPUT_LIMIT,
+                 cancel_token: Optional[CancelToken] = None, batch_interval: float = 0, batch_bytes: int = 0):
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.output_limit = output_limit
+        self.cancel_token = cancel_token
+        self.batch_interval = batch_interval
+        self.batch_bytes = batch_bytes
+        self.returncode: Optional[int] = None
+        self.pid: Optional[int] = None
+        self.timed_out = False
+        self.truncated = False
+        self.duration = 0.0
+        self._output = {"stdout": [], "stderr": []}
+        self._sizes = {"stdout": 0, "stderr": 0}
+
+    @property
+    def stdout(self) -> str:
+        return "".join(self._output["stdout"])
+
+    @property
+    def stderr(self) -> str:
+        return "".join(self._output["stderr"])
+
+    async def _read(self, name: str, pipe: asyncio.StreamReader, queue: asyncio.Queue):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                chunk = await pipe.read(READ_CHUNK)
+                if not chunk:
+                    break
+                if self._sizes[name] >= self.output_limit:
+                    continue
+                chunk = chunk[:self.output_limit - self._sizes[name]]
+                self._sizes[name] += len(chunk)
+                text = decoder.decode(chunk)
+                if self._sizes[name] >= self.output_limit:
+                    self.truncated = True
+                    text += decoder.decode(b"", final=True) + f"\n[{name} truncated after {self.output_limit} bytes]\n"
+                if text:
+                    queue.put_nowait((name, text))
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                queue.put_nowait((name, tail))
+        finally:
+            queue.put_nowait(_EOF)
+
+    # How the process is started, awaited and killed; WarmRun swaps these out.
+    async def _start(self) -> Tuple[asyncio.StreamReader, asyncio.StreamReader]:
+        self._process = await asyncio.create_subprocess_exec(
+            *self.args,
+            cwd=self.cwd,
+            env=self.env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        self.pid = self._process.pid
+        return self._process.stdout, self._process.stderr
+
+    async def _wait(self) -> int:
+        return await self._process.wait()
+
+    def _exited(self) -> bool:
+        return self._process.returncode is not None
+
+    def _kill(self):
+        kill_process_group(self.pid)
+
+    async def _cleanup(self):
+        pass
+
+    async def stream(self) -> AsyncGenerator[Tuple[str, str], None]:
+        started = time.monotonic()
+        try:
+            stdout, stderr = await self._start()
+        except BaseException:
+            await self._cleanup()
+            raise
+        remove = self.cancel_token.on_cancel(self._kill) if self.cancel_token else None
+        queue = asyncio.Queue()
+        readers = [
+            asyncio.create_task(self._read("stdout", stdout, queue)),
+            asyncio.create_task(self._read("stderr", stderr, queue)),
+        ]
+        deadline = started + self.timeout if self.timeout else None
+        open_pipes = len(readers)
+        batching = bool(self.batch_interval or self.batch_bytes)
+        pending = {"stdout": [], "stderr": []}
+        pending_size = 0
+        flush_at = None
+
+        def take():
+            nonlocal pending_size, flush_at
+            batches = [(name, "".join(chunks)) for name, chunks in pending.items() if chunks]
+            for chunks in pending.values():
+                chunks.clear()
+            pending_size = 0
+            flush_at = None
+            return batches
+
+        try:
+            while open_pipes:
+                if not queue.empty():
+                    item = queue.get_nowait()
+                else:
+                    now = time.monotonic()
+                    waits = []
+                    if deadline is not None:
+                        waits.append(KILL_DRAIN_TIMEOUT if self.timed_out else deadline - now)
+                    if flush_at is not None:
+                        waits.append(flush_at - now)
+                    try:
+                        item = await asyncio.wait_for(queue.get(), max(min(waits), 0)) if waits else await queue.get()
+                    except asyncio.TimeoutError:
+                        if flush_at is not None and time.monotonic() >= flush_at:
+                            for batch in take():
+                                yield batch
+                            continue
+                        if self.timed_out:
+                            # Something outside the group still holds the pipes.
+                            break
+                        self.timed_out = True
+                        self._kill()
+                        continue
+                if item is _EOF:
+                    open_pipes -= 1
+                    continue
+                name, text = item
+                self._output[name].append(text)
+                if not batching:
+                    yield item
+                    continue
+                pending[name].append(text)
+                pending_size += len(text)
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.batch_interval
+                if self.batch_bytes and pending_size >= self.batch_bytes:
+                    for batch in take():
+                        yield batch
+            for batch in take():
+                yield batch
+            if self.timed_out:
+                self._kill()
+            self.returncode = await self._wait()
+        finally:
+            if remove:
+                remove()
+            if not self._exited():
+                self._kill()
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            await self._cleanup()
+            self.duration = time.monotonic() - started
+
+    async def run(self) -> "ProcessRun":
+        async for _ in self.stream():
+            pass
+        return self
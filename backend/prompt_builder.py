@@ -0,0 +1,30 @@
+from typing import Dict, List, Tuple
+
+# Segment stability, most stable first. Provider prefix caches (OpenAI prompt
+# caching, llama.cpp / LM Studio KV reuse) only hit on an identical prefix,
+# so anything that changes between calls has to come last.
+STATIC = 0
+WORKSPACE = 1
+PLAN = 2
+REQUEST = 3
+
+
+class PromptBuilder:
+    def __init__(self):
+        self._segments: List[Tuple[int, int, str, str]] = []
+
+    def add(self, title: str, text: str, stability: int) -> "PromptBuilder":
+        if text and text.strip():
+            self._segments.append((stability, len(self._segments), title, text.strip("\n")))
+        return self
+
+    def add_files(self, title: str, files: Dict[str, str], stability: int = WORKSPACE) -> "PromptBuilder":
+        # Sorted so the same workspace always renders byte-for-byte identically.
+        body = "\n".join(f"--- {k} ---\n{v}\n" for k, v in sorted(files.items()))
+        return self.add(title, body, stability)
+
+    def build(self) -> str:
+        parts = []
+        for stability, order, title, text in sorted(self._segments):
+            parts.append(f"{title}:\n{text}" if title else text)
+        return "\n\n".join(parts)
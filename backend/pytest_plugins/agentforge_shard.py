@@ -0,0 +1,90 @@
+"""pytest plugin used by the Tester (loaded with `-p agentforge_shard`).
+
+AGENTFORGE_SHARD_IDS: file with the node ids this process should run, one
+per line; everything else is deselected.
+AGENTFORGE_SELECT: JSON file {"files": [...], "tests": [...]} of a focused
+run; only tests in those files or with those node ids run, the listed
+node ids (previous failures) first.
+AGENTFORGE_DURATIONS_FILE: where to write {node id: seconds} at the end.
+AGENTFORGE_COVERAGE_FILE: where to write {test file: [files it executed]}
+(only when coverage.py is importable).
+"""
+import os
+import json
+
+_durations = {}
+_coverage = None
+
+
+def pytest_configure(config):
+    global _coverage
+    if not os.environ.get("AGENTFORGE_COVERAGE_FILE"):
+        return
+    try:
+        import coverage
+    except ImportError:
+        return
+    root = str(config.rootpath)
+    _coverage = coverage.Coverage(data_file=None, include=[os.path.join(root, "*")], config_file=False)
+    _coverage.start()
+
+
+def _deselect(config, items, keep):
+    selected = [item for item in items if keep(item)]
+    deselected = [item for item in items if not keep(item)]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def pytest_collection_modifyitems(config, items):
+    ids_file = os.environ.get("AGENTFORGE_SHARD_IDS")
+    if ids_file:
+        with open(ids_file, encoding="utf-8") as f:
+            wanted = set(line.rstrip("\n") for line in f if line.strip())
+        _deselect(config, items, lambda item: item.nodeid in wanted)
+
+    select_file = os.environ.get("AGENTFORGE_SELECT")
+    if select_file:
+        with open(select_file, encoding="utf-8") as f:
+            selection = json.load(f)
+        files = set(selection.get("files", []))
+        tests = selection.get("tests", [])
+        first = set(tests)
+        _deselect(config, items, lambda item: item.nodeid in first or item.nodeid.split("::", 1)[0] in files)
+        items.sort(key=lambda item: item.nodeid not in first)
+
+
+def pytest_runtest_setup(item):
+    if _coverage:
+        _coverage.switch_context(item.nodeid)
+
+
+def pytest_runtest_logreport(report):
+    _durations[report.nodeid] = _durations.get(report.nodeid, 0.0) + report.duration
+
+
+def _executed_files(root):
+    _coverage.stop()
+    data = _coverage.get_data()
+    executed = {}
+    for path in data.measured_files():
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        if relative.startswith(".."):
+            continue
+        for contexts in data.contexts_by_lineno(path).values():
+            for context in contexts:
+                if context:
+                    executed.setdefault(context.split("::", 1)[0], set()).add(relative)
+    return {test: sorted(paths) for test, paths in executed.items()}
+
+
+def pytest_sessionfinish(session, exitstatus):
+    path = os.environ.get("AGENTFORGE_DURATIONS_FILE")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(_durations, f)
+    path = os.environ.get("AGENTFORGE_COVERAGE_FILE")
+    if path and _coverage:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(_executed_files(str(session.config.rootpath)), f)
@@ -0,0 +1,211 @@
+"""Warm pytest runner (started by warm_runner.WarmRunner, not a plugin).
+
+Imports pytest and whatever is installed in this interpreter's own
+virtualenv once, then forks a fresh child per test run, so a run only
+pays for importing the project and its tests.
+
+Requests are JSON lines on stdin:
+  {"id": n, "cwd": ..., "args": [...], "env": {...}, "stdout": fifo, "stderr": fifo}
+Replies are JSON lines on stdout:
+  {"ready": true, "preloaded": [...]}
+  {"id": n, "pid": pid} or {"id": n, "error": "..."}
+  {"id": n, "exit": code}
+"""
+import os
+import sys
+import json
+import signal
+import importlib
+import importlib.metadata
+import selectors
+import sysconfig
+import traceback
+
+BASE_PATH = sys.path[1:]
+
+
+def _top_level_modules(dist):
+    names = set((dist.read_text("top_level.txt") or "").split())
+    if not names:
+        for path in dist.files or []:
+            head = path.parts[0]
+            if head.endswith((".dist-info", ".egg-info")) or head in ("..", "__pycache__"):
+                continue
+            if len(path.parts) == 1:
+                if head.endswith(".py"):
+                    names.add(head[:-3])
+            else:
+                names.add(head)
+    return sorted(n for n in names if n.isidentifier())
+
+
+def preload():
+    import pytest  # noqa: F401
+    from _pytest.config import default_plugins
+    for name in default_plugins:
+        try:
+            importlib.import_module(f"_pytest.{name}")
+        except Exception:
+            pass
+    # pytest plugins stay cold: pytest can't assertion-rewrite a plugin
+    # that is already imported and warns about it in every run.
+    plugins = set()
+    for entry_point in importlib.metadata.entry_points(group="pytest11"):
+        if entry_point.dist:
+            plugins.add(entry_point.dist.name.lower())
+
+    # The requirements of the generated project (dep_cache envs install them
+    # into the venv, everything else comes from the server's site-packages).
+    loaded = []
+    if sys.prefix != sys.base_prefix:
+        purelib = sysconfig.get_paths()["purelib"]
+        for dist in importlib.metadata.distributions(path=[purelib]):
+            if (dist.metadata["Name"] or "").lower() in plugins:
+                continue
+            for name in _top_level_modules(dist):
+                try:
+                    importlib.import_module(name)
+                    loaded.append(name)
+                except BaseException:
+                    pass
+    return loaded
+
+
+def _forget_shadowed(preloaded, cwd):
+    # A project module with the same name as a preloaded package wins, like
+    # it would in a cold run where the project dir comes first on sys.path.
+    for name in preloaded:
+        if os.path.exists(os.path.join(cwd, name + ".py")) or os.path.isdir(os.path.join(cwd, name)):
+            for module in [m for m in sys.modules if m == name or m.startswith(name + ".")]:
+                del sys.modules[module]
+
+
+def run_child(request, out, err, preloaded, inherited):
+    code = 3
+    try:
+        os.setsid()
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out, 1)
+        os.dup2(err, 2)
+        for fd in inherited + [devnull, out, err]:
+            os.close(fd)
+
+        cwd = request["cwd"]
+        env = request["env"]
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        # What `python -m pytest` with this PYTHONPATH would have started with.
+        extra = [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+        sys.path[:] = [cwd] + extra + BASE_PATH
+        _forget_shadowed(preloaded, cwd)
+        importlib.invalidate_caches()
+        sys.argv = ["pytest"] + request["args"]
+
+        import pytest
+        code = int(pytest.main(request["args"]))
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(code)
+
+
+def main():
+    # The protocol gets its own fd; stray prints (from preloaded packages,
+    # or children before they redirect) land in /dev/null instead.
+    control = os.fdopen(os.dup(1), "w", buffering=1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    def send(message):
+        control.write(json.dumps(message) + "\n")
+
+    preloaded = preload()
+
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    selector = selectors.DefaultSelector()
+    selector.register(0, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    children = {}
+    buffer = b""
+
+    def reap():
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            run_id = children.pop(pid, None)
+            if run_id is not None:
+                send({"id": run_id, "exit": os.waitstatus_to_exitcode(status)})
+
+    def spawn(request):
+        out = err = None
+        try:
+            # The server already holds the read ends, so these don't block.
+            out = os.open(request["stdout"], os.O_WRONLY | os.O_NONBLOCK)
+            err = os.open(request["stderr"], os.O_WRONLY | os.O_NONBLOCK)
+            os.set_blocking(out, True)
+            os.set_blocking(err, True)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+        except Exception as e:
+            for fd in (out, err):
+                if fd is not None:
+                    os.close(fd)
+            send({"id": request.get("id"), "error": f"{type(e).__name__}: {e}"})
+            return
+        if pid == 0:
+            selector.close()
+            run_child(request, out, err, preloaded, [control.fileno(), wakeup_r, wakeup_w])
+        os.close(out)
+        os.close(err)
+        children[pid] = request["id"]
+        send({"id": request["id"], "pid": pid})
+
+    send({"ready": True, "preloaded": preloaded})
+    while True:
+        for key, _ in selector.select():
+            if key.fd == wakeup_r:
+                try:
+                    while os.read(wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                reap()
+                continue
+            data = os.read(0, 65536)
+            if not data:
+                # Server gone; running children are killed by their owners.
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line.strip():
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        continue
+                    spawn(request)
+
+
+if __name__ == "__main__":
+    main()
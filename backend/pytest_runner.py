@@ -0,0 +1,306 @@
+import os
+import re
+import ast
+import json
+import time
+import asyncio
+import tempfile
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+from cancellation import CancelToken
+from processes import ProcessRun
+from warm_runner import WarmRunner
+from impact_analysis import TestSelection
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_plugins")
+PLUGIN_ARGS = ["-p", "agentforge_shard"]
+# pytest processes a suite is split across (0: one per core, up to 4; 1 disables sharding).
+TEST_SHARDS = int(os.getenv("TEST_SHARDS", "0"))
+# Smaller suites run in one process; collecting first would cost more than it saves.
+# The Tester estimates the count from the test sources and only collects above this.
+TEST_SHARD_MIN_TESTS = int(os.getenv("TEST_SHARD_MIN_TESTS", "20"))
+# Assumed duration of tests that never ran before.
+DEFAULT_TEST_DURATION = 0.1
+MAX_RECORDED_DURATIONS = 50000
+
+_SUMMARY_LINE = re.compile(r"^=+ (.+ in [\d.]+s.*?) =+$", re.MULTILINE)
+_SUMMARY_COUNT = re.compile(r"(\d+) (passed|failed|errors?|skipped|xfailed|xpassed|warnings?)")
+
+
+def shard_count(requested: Optional[int] = None) -> int:
+    count = TEST_SHARDS if requested is None else int(requested)
+    if count <= 0:
+        count = min(4, os.cpu_count() or 1)
+    return count
+
+
+class DurationStore:
+    """Last seen duration per test node id, used to balance shards."""
+
+    def __init__(self, max_entries: int = MAX_RECORDED_DURATIONS):
+        self.max_entries = max_entries
+        self._durations: "OrderedDict[str, float]" = OrderedDict()
+
+    def get(self, node_id: str) -> Optional[float]:
+        return self._durations.get(node_id)
+
+    def update(self, durations: Dict[str, float]):
+        for node_id, seconds in durations.items():
+            self._durations[node_id] = seconds
+            self._durations.move_to_end(node_id)
+        while len(self._durations) > self.max_entries:
+            self._durations.popitem(last=False)
+
+
+test_durations = DurationStore()
+
+
+def plan_shards(test_ids: List[str], count: int, durations: DurationStore = test_durations) -> List[List[str]]:
+    # Longest first onto the least loaded shard; each shard keeps collection order.
+    known = [d for d in (durations.get(t) for t in test_ids) if d is not None]
+    default = sum(known) / len(known) if known else DEFAULT_TEST_DURATION
+    weighted = sorted(((durations.get(t) or default, i) for i, t in enumerate(test_ids)), reverse=True)
+    loads = [0.0] * count
+    shards: List[List[int]] = [[] for _ in range(count)]
+    for seconds, index in weighted:
+        target = loads.index(min(loads))
+        loads[target] += seconds
+        shards[target].append(index)
+    return [[test_ids[i] for i in sorted(shard)] for shard in shards if shard]
+
+
+def _parametrize_size(decorator: ast.expr) -> Optional[int]:
+    # Length of a literal `@pytest.mark.parametrize(names, [...])` / `range(n)`.
+    if not (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute) and decorator.func.attr == "parametrize"):
+        return 1
+    values = decorator.args[1] if len(decorator.args) > 1 else next((k.value for k in decorator.keywords if k.arg == "argvalues"), None)
+    if isinstance(values, (ast.List, ast.Tuple, ast.Set)):
+        return len(values.elts)
+    if (isinstance(values, ast.Call) and isinstance(values.func, ast.Name) and values.func.id == "range"
+            and values.args and all(isinstance(a, ast.Constant) and isinstance(a.value, int) for a in values.args)):
+        return len(range(*[a.value for a in values.args]))
+    return None
+
+
+def estimate_test_count(test_files: Dict[str, str]) -> Optional[int]:
+    """Tests in the given files without running pytest; None when it can't tell.
+
+    Counts `test_*` functions, multiplied out by literal parametrize lists;
+    anything dynamic (parametrize over a variable, fixture params,
+    unparsable files) makes the count unknown.
+    """
+    total = 0
+    for content in test_files.values():
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return None
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and any(k.arg == "params" for k in node.keywords):
+                return None
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+                count = 1
+                for decorator in node.decorator_list:
+                    size = _parametrize_size(decorator)
+                    if size is None:
+                        return None
+                    count *= size
+                total += count
+    return total
+
+
+def pytest_env(env: Dict[str, str]) -> Dict[str, str]:
+    env = dict(env)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (env.get("PYTHONPATH"), PLUGIN_DIR) if p)
+    return env
+
+
+async def pytest_process(command: List[str], warm: Optional[WarmRunner] = None, **kwargs) -> ProcessRun:
+    # Forked off a resident interpreter when there is one, cold otherwise.
+    if warm:
+        return await warm.process(command, **kwargs)
+    return ProcessRun(command, **kwargs)
+
+
+async def collect_test_ids(command: List[str], cwd: str, env: Dict[str, str], timeout: float,
+                           cancel_token: Optional[CancelToken] = None, warm: Optional[WarmRunner] = None) -> Optional[List[str]]:
+    run = await pytest_process(command + ["--collect-only", "-q"], warm, cwd=cwd, env=env, timeout=timeout, cancel_token=cancel_token)
+    await run.run()
+    if run.returncode != 0:
+        # Collection errors are reported by the real run.
+        return None
+    test_ids = []
+    for line in run.stdout.splitlines():
+        line = line.strip()
+        if not line:
+            break
+        if "::" in line:
+            test_ids.append(line)
+    return test_ids
+
+
+def _summary_counts(output: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    lines = _SUMMARY_LINE.findall(output)
+    if lines:
+        for number, kind in _SUMMARY_COUNT.findall(lines[-1]):
+            kind = {"error": "errors", "warning": "warnings"}.get(kind, kind)
+            counts[kind] = counts.get(kind, 0) + int(number)
+    return counts
+
+
+class PytestRun:
+    """pytest over one or more shards, with the ProcessRun interface.
+
+    `shards` is a list of node id lists; `[None]` runs the whole suite in a
+    single process. Shards run concurrently, but their output is streamed
+    in shard order (the next shard's buffered output follows as soon as the
+    previous one finishes), so the merged log reads like consecutive pytest
+    runs and stays append-only. Test durations are recorded either way.
+    With `warm` set, `python -m pytest` commands are forked off its
+    resident interpreters instead of starting cold. A `selection` limits
+    every shard to the affected tests; with `coverage` the files each test
+    file executed end up in `self.coverage`.
+    """
+
+    def __init__(self, command: List[str], shards: List[Optional[List[str]]], cwd: str, env: Dict[str, str],
+                 timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None,
+                 batch_interval: float = 0, batch_bytes: int = 0, durations: DurationStore = test_durations,
+                 warm: Optional[WarmRunner] = None, selection: Optional[TestSelection] = None, coverage: bool = False):
+        self.command = command
+        self.shards = shards
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.cancel_token = cancel_token
+        self.batch_interval = batch_interval
+        self.batch_bytes = batch_bytes
+        self.durations = durations
+        self.warm = warm
+        self.selection = selection
+        self.record_coverage = coverage
+        self.coverage: Dict[str, List[str]] = {}
+        self.returncode: Optional[int] = None
+        self.timed_out = False
+        self.duration = 0.0
+        self.runs: List[ProcessRun] = []
+        self._output: List[str] = []
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    @property
+    def stdout(self) -> str:
+        return "".join(self._output)
+
+    @property
+    def stderr(self) -> str:
+        if not self.sharded:
+            return self.runs[0].stderr if self.runs else ""
+        return "".join(f"[shard {i + 1}]\n{run.stderr}" for i, run in enumerate(self.runs) if run.stderr)
+
+    def _emit(self, text: str) -> Tuple[str, str]:
+        self._output.append(text)
+        return ("stdout", text)
+
+    async def _pump(self, run: ProcessRun, queue: asyncio.Queue):
+        try:
+            async for stream, text in run.stream():
+                if stream == "stdout":
+                    queue.put_nowait(text)
+        finally:
+            queue.put_nowait(None)
+
+    async def stream(self) -> AsyncGenerator[Tuple[str, str], None]:
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory(prefix="pytest-shards-") as control_dir:
+            if self.selection:
+                with open(os.path.join(control_dir, "select.json"), "w", encoding="utf-8") as f:
+                    json.dump(self.selection.to_dict(), f)
+            queues = []
+            for index, test_ids in enumerate(self.shards):
+                env = pytest_env(self.env)
+                env["AGENTFORGE_DURATIONS_FILE"] = os.path.join(control_dir, f"durations-{index}.json")
+                if self.selection:
+                    env["AGENTFORGE_SELECT"] = os.path.join(control_dir, "select.json")
+                if self.record_coverage:
+                    env["AGENTFORGE_COVERAGE_FILE"] = os.path.join(control_dir, f"coverage-{index}.json")
+                if test_ids is not None:
+                    env["AGENTFORGE_SHARD_IDS"] = os.path.join(control_dir, f"shard-{index}.txt")
+                    with open(env["AGENTFORGE_SHARD_IDS"], "w", encoding="utf-8") as f:
+                        f.write("\n".join(test_ids) + "\n")
+                self.runs.append(await pytest_process(
+                    self.command + PLUGIN_ARGS, self.warm, cwd=self.cwd, env=env, timeout=self.timeout,
+                    cancel_token=self.cancel_token, batch_interval=self.batch_interval, batch_bytes=self.batch_bytes,
+                ))
+                queues.append(asyncio.Queue())
+            pumps = [asyncio.create_task(self._pump(run, queue)) for run, queue in zip(self.runs, queues)]
+            try:
+                for index, queue in enumerate(queues):
+                    if self.sharded:
+                        separator = "\n" if index else ""
+                        yield self._emit(f"{separator}==================== shard {index + 1}/{len(self.shards)} ({len(self.shards[index])} tests) ====================\n")
+                    done = False
+                    while not done:
+                        chunks = [await queue.get()]
+                        while not queue.empty():
+                            chunks.append(queue.get_nowait())
+                        if chunks[-1] is None:
+                            chunks.pop()
+                            done = True
+                        if chunks:
+                            yield self._emit("".join(chunks))
+                await asyncio.gather(*pumps)
+            finally:
+                for pump in pumps:
+                    pump.cancel()
+                await asyncio.gather(*pumps, return_exceptions=True)
+                self.duration = time.monotonic() - started
+            self._record_durations(control_dir)
+            self._record_coverage(control_dir)
+
+        self.timed_out = any(run.timed_out for run in self.runs)
+        codes = [run.returncode for run in self.runs]
+        failed = [code for code in codes if code not in (0, 5)]
+        if failed:
+            self.returncode = failed[0] if failed[0] is not None else 1
+        else:
+            self.returncode = 5 if all(code == 5 for code in codes) else 0
+        if self.sharded:
+            yield self._emit(self._merged_summary())
+
+    def _record_durations(self, control_dir: str):
+        for index in range(len(self.shards)):
+            try:
+                with open(os.path.join(control_dir, f"durations-{index}.json"), encoding="utf-8") as f:
+                    self.durations.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+
+    def _record_coverage(self, control_dir: str):
+        for index in range(len(self.shards) if self.record_coverage else 0):
+            try:
+                with open(os.path.join(control_dir, f"coverage-{index}.json"), encoding="utf-8") as f:
+                    for test, paths in json.load(f).items():
+                        self.coverage[test] = sorted(set(self.coverage.get(test, [])) | set(paths))
+            except (OSError, ValueError):
+                pass
+
+    def _merged_summary(self) -> str:
+        totals: Dict[str, int] = {}
+        for run in self.runs:
+            for kind, number in _summary_counts(run.stdout).items():
+                totals[kind] = totals.get(kind, 0) + number
+        order = ["failed", "errors", "passed", "skipped", "xfailed", "xpassed", "warnings"]
+        parts = [f"{totals[k]} {k}" for k in order if totals.get(k)] or ["no tests ran"]
+        slowest = max(run.duration for run in self.runs)
+        return (
+            f"\n==================== merged {len(self.runs)} shards: {', '.join(parts)} "
+            f"in {self.duration:.2f}s (slowest shard {slowest:.2f}s) ====================\n"
+        )
+
+    async def run(self) -> "PytestRun":
+        async for _ in self.stream():
+            pass
+        return self
@@ -0,0 +1,360 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import errno
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from context_builder import is_artifact
+from workspaces import DEFAULT_SESSION
+
+try:
+    import fcntl
+except ImportError:  # Windows: sandbox files are always copies
+    fcntl = None
+
+# Persistent per-session test sandboxes, synced by content hash between runs
+# (empty: a fresh temp dir is written out for every test run like before).
+SANDBOX_DIR = os.getenv("SANDBOX_DIR", "/app/.sandboxes")
+# Sandboxes unused for this many seconds are deleted.
+SANDBOX_IDLE_TTL = float(os.getenv("SANDBOX_IDLE_TTL", "3600"))
+SANDBOX_GC_INTERVAL = float(os.getenv("SANDBOX_GC_INTERVAL", "600"))
+
+BLOBS = ".blobs"
+BLOB_MODE = 0o444
+# ioctl(FICLONE) from linux/fs.h; these errnos mean "no reflinks here".
+FICLONE = 0x40049409
+_NO_REFLINK = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EPERM}
+# Left alone by the sync: bytecode is invalidated per changed file instead.
+CACHE_DIRS = {"__pycache__", ".pytest_cache"}
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def _valid_path(relative: str) -> bool:
+    parts = relative.replace("\\", "/").split("/")
+    return bool(relative) and not relative.endswith(("/", "\\")) and not os.path.isabs(relative) and ".." not in parts
+
+
+class SyncStats:
+    def __init__(self):
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    def describe(self) -> str:
+        return (
+            f"{self.written} written, {self.unchanged} unchanged, {self.removed} removed, "
+            f"{self.skipped} skipped in {self.seconds * 1000:.0f} ms"
+        )
+
+
+class BlobStore:
+    """File contents by sha1, cloned into sandboxes copy-on-write.
+
+    Sandbox files never share an inode with a blob: on filesystems with
+    reflinks (btrfs, xfs) they are clones, elsewhere plain copies, so a test
+    writing to a file in place only ever changes its own sandbox. Blobs are
+    read-only and only replaced by unlink + rename, never written in place.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # None until the first clone tells whether this filesystem can reflink.
+        self.reflink: Optional[bool] = None
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _intact(self, path: str, digest: str, size: int) -> bool:
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            with open(path, "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest() == digest
+        except OSError:
+            return False
+
+    def put(self, digest: str, data: bytes) -> str:
+        path = self.path(digest)
+        if os.path.exists(path) and self._intact(path, digest, len(data)):
+            return path
+        self.discard(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, BLOB_MODE)
+        os.replace(tmp, path)
+        return path
+
+    def clone(self, digest: str, data: bytes, target: str) -> bool:
+        """Reflink the blob for `data` to `target`; False if the filesystem can't."""
+        if self.reflink is False or fcntl is None:
+            return False
+        source = self.put(digest, data)
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError as e:
+                if e.errno not in _NO_REFLINK:
+                    raise
+                self.reflink = False
+                return False
+        self.reflink = True
+        return True
+
+    def discard(self, digest: str):
+        try:
+            os.unlink(self.path(digest))
+        except OSError:
+            pass
+
+    def collect_garbage(self, keep: Set[str]) -> int:
+        # Clones don't show up in the link count, so whatever no live
+        # sandbox manifest mentions goes.
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name in keep:
+                    continue
+                try:
+                    os.unlink(os.path.join(dirpath, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def _drop_bytecode(full: str):
+    # Same size and same mtime second as the old version would let a stale
+    # .pyc through, so the cache for a changed file goes with it.
+    directory, name = os.path.split(full)
+    stem = os.path.splitext(name)[0]
+    cache = os.path.join(directory, "__pycache__")
+    try:
+        entries = os.listdir(cache)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.startswith(stem + ".") and entry.endswith(".pyc"):
+            try:
+                os.unlink(os.path.join(cache, entry))
+            except OSError:
+                pass
+
+
+class Sandbox:
+    """A directory the Tester runs in, kept between runs of one session.
+
+    `sync` makes its contents match the workspace files: unchanged files
+    (same hash, same inode and mtime as last time) are left alone, changed
+    ones are cloned from the blob store (or written out when the filesystem
+    has no reflinks), and anything else, including what the tests wrote, is
+    removed. Artifacts such as logs and review notes are never written.
+    """
+
+    def __init__(self, session_id: str, slot: int, root: str, blobs: BlobStore):
+        self.session_id = session_id
+        self.slot = slot
+        self.root = root
+        self.blobs = blobs
+        self.active = False
+        self.last_used = time.time()
+        self.runs = 0
+        # relative path -> (sha1, inode, mtime_ns) as last materialized
+        self._manifest: Dict[str, Tuple[str, int, int]] = {}
+
+    def _materialize(self, relative: str, digest: str, data: bytes):
+        full = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        if os.path.isdir(full) and not os.path.islink(full):
+            shutil.rmtree(full)
+        elif os.path.lexists(full):
+            os.unlink(full)
+        if not self.blobs.clone(digest, data, full):
+            with open(full, "wb") as f:
+                f.write(data)
+        _drop_bytecode(full)
+        st = os.stat(full)
+        self._manifest[relative] = (digest, st.st_ino, st.st_mtime_ns)
+
+    def sync(self, files: Dict[str, str]) -> SyncStats:
+        started = time.monotonic()
+        stats = SyncStats()
+        wanted = {}
+        for name, content in files.items():
+            relative = name.replace("\\", "/")
+            if not _valid_path(relative) or is_artifact(relative):
+                stats.skipped += 1
+                continue
+            wanted[os.path.normpath(relative)] = content
+
+        os.makedirs(self.root, exist_ok=True)
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=True):
+            dirnames[:] = [d for d in dirnames if d not in CACHE_DIRS]
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                relative = os.path.relpath(full, self.root)
+                if relative not in wanted:
+                    try:
+                        os.unlink(full)
+                    except OSError:
+                        continue
+                    _drop_bytecode(full)
+                    self._manifest.pop(relative, None)
+                    stats.removed += 1
+        for relative in [r for r in self._manifest if r not in wanted]:
+            del self._manifest[relative]
+
+        for relative, content in wanted.items():
+            data = content.encode("utf-8")
+            digest = hashlib.sha1(data).hexdigest()
+            known = self._manifest.get(relative)
+            if known and known[0] == digest:
+                try:
+                    st = os.stat(os.path.join(self.root, relative))
+                    if (st.st_ino, st.st_mtime_ns) == known[1:]:
+                        stats.unchanged += 1
+                        continue
+                except OSError:
+                    pass
+            try:
+                self._materialize(relative, digest, data)
+                stats.written += 1
+            except OSError as e:
+                self._manifest.pop(relative, None)
+                print(f"Warning: Failed to write sandbox file {relative}: {e}")
+
+        self._prune_empty_dirs()
+        self.runs += 1
+        self.last_used = time.time()
+        stats.seconds = time.monotonic() - started
+        return stats
+
+    def _prune_empty_dirs(self):
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            if dirpath == self.root or os.path.basename(dirpath) in CACHE_DIRS:
+                continue
+            try:
+                remaining = set(os.listdir(dirpath))
+            except OSError:
+                continue
+            if remaining <= CACHE_DIRS:
+                shutil.rmtree(dirpath, ignore_errors=True)
+
+
+class SandboxPool:
+    """Sandboxes by session, one slot per concurrent test run.
+
+    Speculative candidates of one session test side by side, so a session
+    grows extra slots while they run; idle slots are deleted after
+    `idle_ttl` seconds, together with blobs no sandbox uses any more.
+    """
+
+    def __init__(self, directory: str, idle_ttl: float = SANDBOX_IDLE_TTL):
+        self.directory = directory
+        self.idle_ttl = idle_ttl
+        self.blobs = BlobStore(os.path.join(directory, BLOBS))
+        self._sandboxes: Dict[str, List[Sandbox]] = {}
+        self._gc_task: Optional[asyncio.Task] = None
+        self.collected = 0
+
+    @asynccontextmanager
+    async def lease(self, session_id: Optional[str] = None) -> AsyncIterator[Sandbox]:
+        session_id = session_id if session_id and _SESSION_ID.match(session_id) else DEFAULT_SESSION
+        slots = self._sandboxes.setdefault(session_id, [])
+        sandbox = next((s for s in slots if not s.active), None)
+        if sandbox is None:
+            used = {s.slot for s in slots}
+            slot = next(i for i in range(len(slots) + 1) if i not in used)
+            sandbox = Sandbox(session_id, slot, os.path.join(self.directory, session_id, str(slot)), self.blobs)
+            slots.append(sandbox)
+        sandbox.active = True
+        try:
+            yield sandbox
+        finally:
+            sandbox.active = False
+            sandbox.last_used = time.time()
+
+    def _discover(self):
+        # Sandboxes left on disk by a previous process have no manifest; drop them.
+        if not os.path.isdir(self.directory):
+            return []
+        leftovers = []
+        for session_id in os.listdir(self.directory):
+            if session_id == BLOBS or not _SESSION_ID.match(session_id):
+                continue
+            known = {s.slot for s in self._sandboxes.get(session_id, [])}
+            session_dir = os.path.join(self.directory, session_id)
+            for slot in os.listdir(session_dir) if os.path.isdir(session_dir) else []:
+                if not slot.isdigit() or int(slot) not in known:
+                    leftovers.append(os.path.join(session_dir, slot))
+        return leftovers
+
+    async def collect_garbage(self) -> int:
+        now = time.time()
+        victims = await asyncio.to_thread(self._discover)
+        for session_id, slots in list(self._sandboxes.items()):
+            for sandbox in list(slots):
+                if not sandbox.active and now - sandbox.last_used > self.idle_ttl:
+                    slots.remove(sandbox)
+                    victims.append(sandbox.root)
+            if not slots:
+                del self._sandboxes[session_id]
+        for root in victims:
+            await asyncio.to_thread(shutil.rmtree, root, True)
+            parent = os.path.dirname(root)
+            try:
+                os.rmdir(parent)
+            except OSError:
+                pass
+        keep = set()
+        if self.blobs.reflink:
+            keep = {entry[0] for slots in self._sandboxes.values() for s in slots for entry in s._manifest.values()}
+        await asyncio.to_thread(self.blobs.collect_garbage, keep)
+        self.collected += len(victims)
+        return len(victims)
+
+    async def _gc_loop(self, interval: float):
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                print(f"Sandboxes: GC failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = SANDBOX_GC_INTERVAL):
+        if self._gc_task is None:
+            self._gc_task = asyncio.create_task(self._gc_loop(interval))
+
+    async def stop(self):
+        if self._gc_task:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+
+    def stats(self) -> Dict:
+        sandboxes = [s for slots in self._sandboxes.values() for s in slots]
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "sessions": len(self._sandboxes),
+            "sandboxes": len(sandboxes),
+            "active": sum(1 for s in sandboxes if s.active),
+            "reflink": self.blobs.reflink,
+            "collected": self.collected,
+        }
+
+
+sandbox_pool: Optional[SandboxPool] = SandboxPool(SANDBOX_DIR) if SANDBOX_DIR else None
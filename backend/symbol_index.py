@@ -0,0 +1,194 @@
+import os
+import re
+import ast
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+MAX_INDEXED_FILES = int(os.getenv("SYMBOL_INDEX_MAX_FILES", "4096"))
+
+LANGUAGE_BY_EXT = {
+    ".py": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".go": "go",
+    ".rs": "rust",
+    ".java": "java",
+    ".c": "c", ".h": "c",
+    ".cpp": "cpp", ".cc": "cpp", ".hpp": "cpp", ".cxx": "cpp",
+}
+
+# (imports, definitions) per language, matched line by line with re.MULTILINE.
+_JS_PATTERNS = (
+    r"^\s*import\s.+?from\s+['\"](.+?)['\"]|require\(['\"](.+?)['\"]\)",
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*\w+\s*\([^)]*\)[^{]*"
+    r"|^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+\w+[^{]*"
+    r"|^\s*(?:export\s+)?(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:\([^)]*\)|\w+)\s*=>"
+    r"|^\s*(?:export\s+)?(?:interface|type|enum)\s+\w+[^{=]*",
+)
+SYMBOL_PATTERNS = {
+    "javascript": _JS_PATTERNS,
+    "typescript": _JS_PATTERNS,
+    "go": (
+        r"^\s*import\s+\"(.+?)\"|^\s+\"(.+?)\"$",
+        r"^func\s+(?:\([^)]*\)\s*)?\w+\s*\([^)]*\)[^{]*|^type\s+\w+\s+(?:struct|interface)",
+    ),
+    "rust": (
+        r"^\s*use\s+(.+?);|^\s*(?:pub\s+)?mod\s+(\w+)\s*;",
+        r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:unsafe\s+)?fn\s+\w+[^{;]*"
+        r"|^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait)\s+\w+[^{;]*|^\s*impl\b[^{]*",
+    ),
+    "java": (
+        r"^\s*import\s+(?:static\s+)?([\w.*]+)\s*;",
+        r"^\s*(?:(?:public|protected|private|abstract|final|static)\s+)*(?:class|interface|enum|record)\s+\w+[^{]*"
+        r"|^\s+(?:(?:public|protected|private|static|final|abstract|synchronized)\s+)+[\w<>\[\],\s]+?\s+\w+\s*\([^)]*\)[^{;]*",
+    ),
+    "c": (
+        r"^\s*#\s*include\s*[<\"](.+?)[>\"]",
+        r"^(?!\s*(?:if|for|while|switch|return|else)\b)[A-Za-z_][\w\s\*:<>,]*?\b\w+(?:::\w+)?\s*\([^;{]*\)\s*(?:const\s*)?(?=\{|$)"
+        r"|^\s*(?:typedef\s+)?(?:struct|class|enum|union)\s+\w+[^;{]*",
+    ),
+}
+SYMBOL_PATTERNS["cpp"] = SYMBOL_PATTERNS["c"]
+
+
+class FileSymbols(BaseModel):
+    path: str
+    language: str
+    module: str
+    docstring: Optional[str] = None
+    imports: List[str] = []
+    symbols: List[str] = []
+
+
+def _first_line(doc: Optional[str]) -> Optional[str]:
+    if not doc:
+        return None
+    return doc.strip().splitlines()[0].strip()
+
+
+def _python_signature(node, prefix: str = "") -> str:
+    keyword = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    signature = f"{prefix}{keyword} {node.name}({ast.unparse(node.args)})"
+    if node.returns is not None:
+        signature += f" -> {ast.unparse(node.returns)}"
+    doc = _first_line(ast.get_docstring(node))
+    return f"{signature}  # {doc}" if doc else signature
+
+
+def _index_python(path: str, content: str) -> FileSymbols:
+    module = os.path.splitext(path)[0].replace("/", ".")
+    if module.endswith(".__init__"):
+        module = module[: -len(".__init__")]
+    tree = ast.parse(content)
+    imports, symbols = [], []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = "." * node.level + (node.module or "")
+            imports.extend(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(_python_signature(node))
+        elif isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(b) for b in node.bases)
+            header = f"class {node.name}({bases})" if bases else f"class {node.name}"
+            doc = _first_line(ast.get_docstring(node))
+            symbols.append(f"{header}  # {doc}" if doc else header)
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and (not item.name.startswith("_") or item.name == "__init__"):
+                    symbols.append(_python_signature(item, prefix="    "))
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name) and target.id.isupper():
+                    symbols.append(f"{target.id} = ...")
+        elif isinstance(node, ast.If) and "__main__" in ast.unparse(node.test):
+            symbols.append("if __name__ == '__main__': ...")
+    return FileSymbols(
+        path=path,
+        language="python",
+        module=module,
+        docstring=_first_line(ast.get_docstring(tree)),
+        imports=imports,
+        symbols=symbols,
+    )
+
+
+def _index_with_patterns(path: str, content: str, language: str) -> FileSymbols:
+    import_pattern, symbol_pattern = SYMBOL_PATTERNS[language]
+    imports = []
+    for match in re.finditer(import_pattern, content, re.MULTILINE):
+        imports.extend(g for g in match.groups() if g)
+    symbols = [m.group(0).strip().rstrip("{").strip() for m in re.finditer(symbol_pattern, content, re.MULTILINE)]
+    return FileSymbols(path=path, language=language, module=path, imports=imports, symbols=symbols)
+
+
+def extract_symbols(path: str, content: str) -> Optional[FileSymbols]:
+    language = LANGUAGE_BY_EXT.get(os.path.splitext(path)[1].lower())
+    if language is None:
+        return None
+    if language == "python":
+        try:
+            return _index_python(path, content)
+        except (SyntaxError, ValueError):
+            # Broken code still gets a best-effort view.
+            symbols = [m.group(0).rstrip(":") for m in re.finditer(r"^[ \t]*(?:async\s+)?(?:def|class)\s+\w+[^\n]*", content, re.MULTILINE)]
+            return FileSymbols(path=path, language=language, module=os.path.splitext(path)[0].replace("/", "."), symbols=symbols)
+    return _index_with_patterns(path, content, language)
+
+
+class SymbolIndex:
+    """Per-file symbol summaries cached by content hash.
+
+    Shared by all sessions: entries are only ever evicted least recently
+    used, so an edited file is re-parsed once and unchanged files are never
+    re-parsed, whichever session asks.
+    """
+
+    def __init__(self, max_entries: int = MAX_INDEXED_FILES):
+        self.max_entries = max_entries
+        self._by_hash: "OrderedDict[str, Optional[FileSymbols]]" = OrderedDict()
+
+    @staticmethod
+    def content_hash(path: str, content: str) -> str:
+        return hashlib.sha256(f"{path}\0{content}".encode("utf-8")).hexdigest()
+
+    def get(self, path: str, content: str) -> Optional[FileSymbols]:
+        digest = self.content_hash(path, content)
+        if digest in self._by_hash:
+            self._by_hash.move_to_end(digest)
+            return self._by_hash[digest]
+        symbols = self._by_hash[digest] = extract_symbols(path, content)
+        while len(self._by_hash) > self.max_entries:
+            self._by_hash.popitem(last=False)
+        return symbols
+
+    def sync(self, files: Dict[str, str]) -> Dict[str, FileSymbols]:
+        index = {}
+        for path, content in files.items():
+            symbols = self.get(path, content)
+            if symbols is not None:
+                index[path] = symbols
+        return index
+
+    def render(self, files: Dict[str, str]) -> str:
+        index = self.sync(files)
+        blocks = []
+        for path in sorted(index):
+            entry = index[path]
+            lines = [f"--- {path} (module: {entry.module}) ---"]
+            if entry.docstring:
+                lines.append(f'"""{entry.docstring}"""')
+            if entry.imports:
+                lines.append("imports: " + ", ".join(entry.imports))
+            lines.extend(entry.symbols or ["(no top-level definitions)"])
+            blocks.append("\n".join(lines))
+        others = sorted(p for p in files if p not in index)
+        if others:
+            blocks.append("Other files: " + ", ".join(others))
+        return "\n\n".join(blocks)
+
+
+symbol_index = SymbolIndex()
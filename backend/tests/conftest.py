@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Sample output of a generated project (merge_sort, quicksort_100) that
+# ended up next to the backend tests; the modules they test aren't here.
+collect_ignore = ["test_main.py", "test_merge_sort.py", "test_quicksort_100.py"]
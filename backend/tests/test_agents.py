@@ -0,0 +1,45 @@
+import asyncio
+
+import agents
+from llm_client import LLMEvent, LLMStream
+
+CODE = {"calc.py": "def add(a, b):\n    return a + b\n"}
+TESTS = '''```python
+# filename: tests/test_calc.py
+from calc import add
+
+
+def test_add():
+    assert add(1, 2) == 3
+```'''
+CONFIG = {"language": "Python", "sandbox": False, "warm_runner": False, "test_impact": False, "test_shards": 1, "dep_cache": False}
+
+
+class CannedTester(agents.Tester):
+    def stream_llm(self, system_prompt, user_prompt, config=None):
+        async def source():
+            yield LLMEvent(kind="delta", text=TESTS)
+        return LLMStream(source())
+
+
+def run_tester(config):
+    async def main():
+        context = {"config": config, "files": CODE}
+        return [frame async for frame in CannedTester().process("add numbers", context)]
+    return asyncio.run(main())
+
+
+def test_log_is_streamed_as_append_only_chunks():
+    frames = run_tester(CONFIG)
+    chunks = [f for f in frames if f.log_chunk is not None]
+    assert chunks and all(f.is_partial and f.files is None for f in chunks)
+    assert chunks[0].log_offset == 0
+
+    log = ""
+    for frame in chunks:
+        assert frame.log_file == "TEST_RESULTS.log"
+        assert frame.log_offset == len(log)
+        log += frame.log_chunk
+    final = frames[-1]
+    assert final.files["TEST_RESULTS.log"].startswith(log)
+    assert "1 passed" in log
@@ -0,0 +1,51 @@
+import asyncio
+import subprocess
+
+import pytest
+
+from cancellation import CancelToken, kill_process_group
+
+
+def test_cancel_runs_callbacks_once_and_keeps_the_first_reason():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("a"))
+    token.on_cancel(lambda: 1 / 0)
+    token.on_cancel(lambda: calls.append("b"))
+    token.cancel("Stopped by user")
+    token.cancel("Client disconnected")
+    assert calls == ["a", "b"]
+    assert token.reason == "Stopped by user"
+
+
+def test_removed_callbacks_are_not_called():
+    token = CancelToken()
+    calls = []
+    remove = token.on_cancel(lambda: calls.append("removed"))
+    remove()
+    remove()
+    token.cancel()
+    assert calls == []
+
+
+def test_late_registration_fires_immediately():
+    token = CancelToken()
+    token.cancel()
+    calls = []
+    token.on_cancel(lambda: calls.append("late"))
+    assert calls == ["late"]
+
+
+def test_raise_if_cancelled():
+    token = CancelToken()
+    token.raise_if_cancelled()
+    token.cancel("Stopped by user")
+    with pytest.raises(asyncio.CancelledError, match="Stopped by user"):
+        token.raise_if_cancelled()
+
+
+def test_kill_process_group_kills_the_session_leader():
+    process = subprocess.Popen(["sh", "-c", "sleep 30 & wait"], start_new_session=True)
+    kill_process_group(process.pid)
+    assert process.wait(timeout=5) != 0
+    kill_process_group(process.pid)
@@ -0,0 +1,62 @@
+import os
+import json
+
+import pytest
+
+from checkpoints import CheckpointStore, portable_config
+
+
+def save_at(store, workflow_id, data, updated_at):
+    store.save(workflow_id, data)
+    path = store._path(workflow_id)
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**saved, "updated_at": updated_at}, f)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save("wf-1", {"session_id": "s1", "completed": ["architect"], "files": {"app.py": "X = 1\n"}})
+    data = store.load("wf-1")
+    assert data["workflow_id"] == "wf-1"
+    assert data["completed"] == ["architect"]
+    assert data["files"] == {"app.py": "X = 1\n"}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    store.delete("wf-1")
+    assert store.load("wf-1") is None
+    store.delete("wf-1")
+
+
+def test_workflow_ids_cannot_leave_the_directory(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.save("../escape", {})
+    assert store.load("../escape") is None
+
+
+def test_latest_is_per_session_and_newest_first(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    save_at(store, "old", {"session_id": "s1", "prompt": "first"}, 100)
+    save_at(store, "new", {"session_id": "s1", "prompt": "second", "loop": {"attempt": 2}}, 200)
+    save_at(store, "other", {"session_id": "s2", "prompt": "third"}, 300)
+
+    assert [e["workflow_id"] for e in store.list("s1")] == ["new", "old"]
+    assert store.list("s1")[0]["iteration"] == 2
+    assert store.latest("s1")["prompt"] == "second"
+    assert store.latest("s3") is None
+    assert len(store.list()) == 3
+
+
+def test_expired_checkpoints_are_dropped(tmp_path):
+    store = CheckpointStore(str(tmp_path), max_age=60)
+    store.save("stale", {"session_id": "s1"})
+    os.utime(store._path("stale"), (0, 0))
+    assert store.list() == []
+    assert not os.path.exists(store._path("stale"))
+
+
+def test_portable_config_drops_secrets_and_runtime_values():
+    config = {"api_key": "sk-secret", "model": "gpt-4o-mini", "max_iterations": 3, "cancel": object()}
+    assert portable_config(config) == {"model": "gpt-4o-mini", "max_iterations": 3}
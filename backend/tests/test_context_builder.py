@@ -0,0 +1,46 @@
+from context_builder import bm25_rank, build_workspace_context, estimate_tokens, tokenize
+
+FILES = {
+    "sorting.py": "def merge_sort(items):\n    return sorted(items)\n",
+    "billing/invoice.py": "class Invoice:\n    def total(self):\n        return sum(self.lines)\n",
+    "utils.py": "def slugify(text):\n    return text.lower().replace(' ', '-')\n",
+    "TEST_RESULTS.log": "sorting sorting sorting merge_sort FAILED\n",
+}
+
+
+def test_tokenize_splits_camel_case_and_keeps_the_word():
+    assert tokenize("parseHTTPResponse x") == ["parsehttpresponse", "parse", "http", "response"]
+
+
+def test_bm25_ranks_matching_paths_and_bodies_first():
+    ranked = bm25_rank("fix the merge sort in sorting", {k: v for k, v in FILES.items() if k.endswith(".py")})
+    assert ranked[0][0] == "sorting.py"
+    assert ranked[0][1] > 0
+    assert dict(ranked)["utils.py"] == 0.0
+    # Ties are broken by path so the order never depends on dict order.
+    assert [path for path, _ in ranked[1:]] == ["billing/invoice.py", "utils.py"]
+
+
+def test_everything_fits_in_a_generous_budget():
+    context = build_workspace_context(FILES, "merge sort", "gpt-4o-mini", budget=10_000)
+    assert list(context.full_files) == ["billing/invoice.py", "sorting.py", "utils.py"]
+    # Artifacts are only ever listed by name.
+    assert context.listed_files == ["TEST_RESULTS.log"]
+    assert context.tokens_used <= context.budget
+
+
+def test_tight_budget_keeps_the_most_relevant_file():
+    sorting_cost = estimate_tokens(f"--- sorting.py ---\n{FILES['sorting.py']}\n", "gpt-4o-mini")
+    listing_cost = sum(estimate_tokens(f"- {k}\n", "gpt-4o-mini") for k in FILES)
+    context = build_workspace_context(FILES, "merge sort", "gpt-4o-mini", budget=sorting_cost + listing_cost)
+    assert list(context.full_files) == ["sorting.py"]
+    assert context.listed_files == ["TEST_RESULTS.log", "billing/invoice.py", "utils.py"]
+    assert context.tokens_used <= context.budget
+    assert context.tokens_saved > 0
+
+
+def test_reserved_tokens_come_out_of_the_budget():
+    context = build_workspace_context(FILES, "merge sort", "gpt-4o-mini", budget=100, reserved_tokens=100)
+    assert context.budget == 0
+    assert context.full_files == {}
+    assert "sorting.py" in context.render()
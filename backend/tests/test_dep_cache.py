@@ -0,0 +1,65 @@
+import os
+import asyncio
+
+from dep_cache import READY_MARKER, SIZE_FILE, DependencyCache, normalize_requirements
+
+
+def fake_env(cache, key, size, last_used):
+    path = cache._path(key)
+    os.makedirs(path)
+    with open(os.path.join(path, SIZE_FILE), "w") as f:
+        f.write(str(size))
+    marker = os.path.join(path, READY_MARKER)
+    open(marker, "w").close()
+    os.utime(marker, (last_used, last_used))
+
+
+def test_normalize_ignores_order_comments_and_name_spelling():
+    a = "Flask_Login >= 0.6  # auth\nrequests\n\n# tools\nrequests\n"
+    b = "requests\nflask-login>=0.6\n"
+    assert normalize_requirements(a) == normalize_requirements(b) == "flask-login>=0.6\nrequests\n"
+
+
+def test_normalize_keeps_options_and_versions_distinct():
+    assert normalize_requirements("-e ./lib\n") == "-e ./lib\n"
+    assert normalize_requirements("requests==2.31\n") != normalize_requirements("requests==2.32\n")
+
+
+def test_key_follows_the_normalized_requirements():
+    assert DependencyCache.make_key("b\na\n") == DependencyCache.make_key("A\n# c\nB")
+    assert DependencyCache.make_key("a\n") != DependencyCache.make_key("a\nb\n")
+
+
+def test_concurrent_gets_share_one_build(tmp_path):
+    cache = DependencyCache(str(tmp_path), max_bytes=1 << 30)
+    builds = []
+
+    async def build(key, requirements):
+        builds.append(key)
+        await asyncio.sleep(0.01)
+        fake_env(cache, key, 1, 0)
+        cache._builds.pop(key, None)
+
+    cache._build = build
+
+    async def main():
+        first, second = await asyncio.gather(cache.get("requests\n"), cache.get("Requests"))
+        return first, second, await cache.get("requests")
+
+    first, second, third = asyncio.run(main())
+    assert len(builds) == 1
+    assert first.path == second.path == third.path
+    assert (first.reused, third.reused) == (False, True)
+    assert cache.hits == 1
+
+
+def test_eviction_removes_least_recently_used_idle_envs(tmp_path):
+    cache = DependencyCache(str(tmp_path), max_bytes=250)
+    fake_env(cache, "oldest", 100, 100)
+    fake_env(cache, "leased", 100, 200)
+    fake_env(cache, "newest", 100, 300)
+    cache._in_use["leased"] = 1
+
+    asyncio.run(cache.evict())
+    assert sorted(os.listdir(tmp_path)) == ["leased", "newest"]
+    assert cache.evictions == 1
@@ -0,0 +1,66 @@
+from failures import FailureFingerprint, FailureTracker, fingerprint_failure
+
+LOG = """
+tests/test_calc.py::test_add FAILED
+tests/test_calc.py::test_sub PASSED
+
+    def test_add():
+>       assert add(1, 2) == 3
+E       assert -1 == 3
+E        +  where -1 = add(1, 2)
+
+tests/test_calc.py:5: AssertionError
+FAILED tests/test_calc.py::test_add - assert -1 == 3
+1 failed, 1 passed in 0.03s
+"""
+
+
+def fingerprint(digest):
+    return FailureFingerprint(digest=digest, exception_types=[], failing_tests=[], traceback=[])
+
+
+def test_fingerprint_ignores_timings_and_addresses():
+    other_run = LOG.replace("0.03s", "1.20s") + "\n<Foo object at 0x7f3a2b1c>\n"
+    assert fingerprint_failure(LOG).digest == fingerprint_failure(other_run.replace("0x7f3a2b1c", "0x55aa")).digest
+    assert "tests/test_calc.py::test_add" in fingerprint_failure(LOG).failing_tests
+
+
+def test_fingerprint_changes_with_the_failure():
+    assert fingerprint_failure(LOG).digest != fingerprint_failure(LOG.replace("test_add", "test_mul")).digest
+
+
+def test_repeat_escalates_then_stops():
+    tracker = FailureTracker(repeat_limit=2)
+    a = fingerprint("a")
+    verdicts = [tracker.record(a) for _ in range(3)]
+    assert [v.kind for v in verdicts] == ["new", "repeat", "repeat"]
+    assert [v.action for v in verdicts] == ["continue", "escalate", "stop"]
+    assert verdicts[-1].occurrences == 3
+
+
+def test_oscillation_counts_towards_the_limit():
+    tracker = FailureTracker(repeat_limit=2)
+    a, b = fingerprint("a"), fingerprint("b")
+    assert tracker.record(a).kind == "new"
+    assert tracker.record(b).kind == "new"
+    verdict = tracker.record(a)
+    assert (verdict.kind, verdict.action) == ("oscillation", "escalate")
+
+
+def test_each_fingerprint_gets_its_own_escalation():
+    tracker = FailureTracker(repeat_limit=2)
+    a, b = fingerprint("a"), fingerprint("b")
+    actions = [tracker.record(f).action for f in (a, a, b, b, b, a)]
+    assert actions == ["continue", "escalate", "continue", "escalate", "stop", "stop"]
+
+
+def test_state_round_trip():
+    tracker = FailureTracker(repeat_limit=2)
+    for f in (fingerprint("a"), fingerprint("a")):
+        tracker.record(f)
+    restored = FailureTracker(repeat_limit=2)
+    restored.restore(tracker.state())
+    assert [f.digest for f in restored.history] == ["a", "a"]
+    assert restored.record(fingerprint("a")).action == "stop"
+    assert restored.record(fingerprint("b")).action == "continue"
+
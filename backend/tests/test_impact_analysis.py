@@ -0,0 +1,75 @@
+import impact_analysis
+from impact_analysis import is_test_file, static_dependencies
+
+FILES = {
+    "shapes/__init__.py": "",
+    "shapes/circle.py": "from .base import Shape\n\nclass Circle(Shape):\n    pass\n",
+    "shapes/base.py": "class Shape:\n    pass\n",
+    "calc.py": "def add(a, b):\n    return a + b\n",
+    "main.py": "print('hi')\n",
+    "tests/test_shapes.py": "from shapes.circle import Circle\n\ndef test_circle():\n    assert Circle()\n",
+    "tests/test_calc.py": "def test_add():\n    from calc import add\n    assert add(1, 2) == 3\n",
+    "tests/test_main.py": "import subprocess\n\ndef test_main():\n    subprocess.run(['python', 'main.py'])\n",
+    "TEST_RESULTS.log": "old log",
+}
+
+
+def impact_after_run(failed=(), coverage=None):
+    impact = impact_analysis.TestImpact()
+    impact.record(FILES, list(failed), coverage)
+    return impact
+
+
+def test_is_test_file():
+    assert is_test_file("tests/test_calc.py") and is_test_file("calc_test.py")
+    assert not is_test_file("calc.py") and not is_test_file("tests/test_data.json")
+
+
+def test_static_dependencies_follow_imports_transitively_and_mentions():
+    deps = static_dependencies(FILES)
+    assert deps["tests/test_shapes.py"] == {"shapes/__init__.py", "shapes/circle.py", "shapes/base.py"}
+    assert deps["tests/test_calc.py"] == {"calc.py"}
+    assert deps["tests/test_main.py"] == {"main.py"}
+
+
+def test_first_run_and_unchanged_workspace_run_everything():
+    assert impact_analysis.TestImpact().select(FILES) is None
+    assert impact_after_run().select(FILES) is None
+
+
+def test_change_selects_only_dependent_tests():
+    selection = impact_after_run().select({**FILES, "shapes/base.py": "class Shape:\n    sides = 0\n"})
+    assert selection.files == ["tests/test_shapes.py"]
+    assert selection.changed == ["shapes/base.py"]
+    assert selection.matches("tests/test_shapes.py::test_circle")
+    assert not selection.matches("tests/test_calc.py::test_add")
+
+
+def test_previous_failures_run_first():
+    impact = impact_after_run(failed=["tests/test_calc.py::test_add"])
+    selection = impact.select({**FILES, "main.py": "print('bye')\n"})
+    assert selection.files == ["tests/test_main.py"]
+    assert selection.tests == ["tests/test_calc.py::test_add"]
+    ids = ["tests/test_calc.py::test_add", "tests/test_main.py::test_main", "tests/test_shapes.py::test_circle"]
+    assert selection.order(ids[::-1]) == ["tests/test_calc.py::test_add", "tests/test_main.py::test_main"]
+
+
+def test_global_and_non_python_changes_run_the_full_suite():
+    assert impact_after_run().select({**FILES, "conftest.py": "import pytest\n"}) is None
+    assert impact_after_run().select({**FILES, "data.json": "{}"}) is None
+    # Artifacts never count as a change.
+    assert impact_after_run().select({**FILES, "TEST_RESULTS.log": "new log"}) is None
+
+
+def test_recorded_coverage_adds_dynamic_dependencies():
+    impact = impact_after_run(coverage={"tests/test_main.py": ["calc.py"]})
+    selection = impact.select({**FILES, "calc.py": "def add(a, b):\n    return b + a\n"})
+    assert selection.files == ["tests/test_calc.py", "tests/test_main.py"]
+
+
+def test_state_round_trip():
+    impact = impact_after_run(failed=["tests/test_calc.py::test_add"])
+    restored = impact_analysis.TestImpact()
+    restored.restore(impact.state())
+    changed = {**FILES, "main.py": "print('bye')\n"}
+    assert restored.select(changed).to_dict() == impact.select(changed).to_dict()
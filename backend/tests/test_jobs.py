@@ -0,0 +1,160 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from jobs import JobConflictError, JobQueue
+
+
+def slow_runner(log, seconds=0.05):
+    async def runner(job):
+        log.append(("start", job.prompt))
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            log.append(("end", job.prompt))
+        yield {"agent_name": "Code Generator", "content": "done", "files": {"app.py": "x = 1\n"}}
+    return runner
+
+
+async def until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition never became true"
+        await asyncio.sleep(0.005)
+
+
+async def listen(queue, job, stop_after=None):
+    seen = []
+    async with aclosing(queue.subscribe(job.id)) as events:
+        async for event in events:
+            seen.append(event)
+            if stop_after and len(seen) >= stop_after:
+                break
+    return seen
+
+
+def test_disconnected_job_is_cancelled_after_grace():
+    async def main():
+        queue = JobQueue(slow_runner([], seconds=5), workers=1, disconnect_grace=0.05)
+        queue.start()
+        job = queue.submit("build", {"workflow_id": "w1"}, "s1")
+        await until(lambda: job.status == "running")
+        await listen(queue, job, stop_after=1)
+        queue.release(job.id)
+        await until(lambda: job.finished)
+        assert job.status == "cancelled"
+        assert job.error == "Client disconnected"
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_reattaching_within_grace_keeps_the_job_running():
+    async def main():
+        queue = JobQueue(slow_runner([], seconds=0.2), workers=1, disconnect_grace=0.05)
+        queue.start()
+        job = queue.submit("build", {"workflow_id": "w1"}, "s1")
+        await until(lambda: job.status == "running")
+        queue.release(job.id)
+        events = await listen(queue, job)
+        assert job.status == "succeeded"
+        assert events[0]["seq"] == 1 and events[-1]["content"] == "done"
+        assert job.files == {"app.py": "x = 1\n"}
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_negative_grace_never_cancels():
+    async def main():
+        queue = JobQueue(slow_runner([], seconds=0.05), workers=1, disconnect_grace=-1)
+        queue.start()
+        job = queue.submit("build", {"workflow_id": "w1"}, "s1")
+        queue.release(job.id)
+        await until(lambda: job.finished)
+        assert job.status == "succeeded"
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_cancel_while_queued_never_runs():
+    async def main():
+        log = []
+        queue = JobQueue(slow_runner(log), workers=1)
+        queue.start()
+        first = queue.submit("first", {"workflow_id": "w1"}, "s1")
+        second = queue.submit("second", {"workflow_id": "w2"}, "s2")
+        assert queue.cancel(second.id, "Cancelled by user")
+        await until(lambda: first.finished)
+        assert second.status == "cancelled"
+        assert ("start", "second") not in log
+        assert not queue.cancel(second.id)
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_jobs_of_one_session_run_one_at_a_time():
+    async def main():
+        log = []
+        queue = JobQueue(slow_runner(log), workers=3)
+        queue.start()
+        a1 = queue.submit("a1", {"workflow_id": "w1"}, "a")
+        a2 = queue.submit("a2", {"workflow_id": "w2"}, "a")
+        b1 = queue.submit("b1", {"workflow_id": "w3"}, "b")
+        await until(lambda: a1.finished and a2.finished and b1.finished)
+        assert log.index(("end", "a1")) < log.index(("start", "a2"))
+        # Another session's job doesn't wait for them.
+        assert log.index(("start", "b1")) < log.index(("end", "a1"))
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_live_workflow_cannot_be_submitted_twice():
+    async def main():
+        queue = JobQueue(slow_runner([]), workers=1)
+        queue.start()
+        job = queue.submit("build", {"workflow_id": "w1"}, "s1")
+        with pytest.raises(JobConflictError):
+            queue.submit("build", {"workflow_id": "w1", "resume": "w1"}, "s1")
+        await until(lambda: job.finished)
+        queue.submit("build", {"workflow_id": "w1", "resume": "w1"}, "s1")
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_busy_sessions_cover_queued_and_running_jobs():
+    async def main():
+        queue = JobQueue(slow_runner([]), workers=1)
+        queue.start()
+        running = queue.submit("a", {"workflow_id": "w1"}, "a")
+        queue.submit("b", {"workflow_id": "w2"}, "b")
+        await until(lambda: running.status == "running")
+        assert queue.busy_sessions() == {"a", "b"}
+        await until(lambda: not queue.busy_sessions())
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_history_keeps_log_chunks_but_not_llm_partials():
+    async def runner(job):
+        yield {"agent_name": "Tester", "content": "Generating...", "is_partial": True, "partial_output": "def test"}
+        yield {"agent_name": "Tester", "content": "Running pytest...", "is_partial": True, "log_chunk": "a", "log_offset": 0}
+        yield {"agent_name": "Tester", "content": "Running pytest...", "is_partial": True, "log_chunk": "b", "log_offset": 1}
+
+    async def main():
+        queue = JobQueue(runner, workers=1)
+        queue.start()
+        job = queue.submit("build", {"workflow_id": "w1"}, "s1")
+        await until(lambda: job.finished)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert [e.get("log_chunk") for e in job.events if e.get("is_partial")] == ["a", "b"]
+    assert not any(e.get("partial_output") for e in job.events)
@@ -0,0 +1,63 @@
+import os
+import time
+import asyncio
+
+from llm_cache import ResponseCache
+
+
+def age(cache, key, seconds):
+    path = cache._path(key)
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_key_covers_every_request_field():
+    key = ResponseCache.make_key("m", "sys", "user", 0.2)
+    assert key == ResponseCache.make_key("m", "sys", "user", 0.2)
+    assert key != ResponseCache.make_key("other", "sys", "user", 0.2)
+    assert key != ResponseCache.make_key("m", "sys", "user prompt", 0.2)
+    assert key != ResponseCache.make_key("m", "sys", "user", 0.7)
+
+
+def test_round_trip_counts_hits_and_misses(tmp_path):
+    async def main():
+        cache = ResponseCache(str(tmp_path), max_bytes=1 << 20, max_age=60)
+        key = ResponseCache.make_key("m", "sys", "user", 0.2)
+        assert await cache.get(key) is None
+        await cache.put(key, "answer", {"model": "m"})
+        assert await cache.get(key) == "answer"
+        return cache.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_expired_entries_are_misses(tmp_path):
+    async def main():
+        cache = ResponseCache(str(tmp_path), max_bytes=1 << 20, max_age=60)
+        await cache.put("ab" * 32, "stale")
+        age(cache, "ab" * 32, 120)
+        assert await cache.get("ab" * 32) is None
+        assert not os.path.exists(cache._path("ab" * 32))
+
+    asyncio.run(main())
+
+
+def test_eviction_drops_least_recently_used_first(tmp_path):
+    async def main():
+        cache = ResponseCache(str(tmp_path), max_bytes=1 << 20, max_age=3600)
+        keys = [ResponseCache.make_key("m", "sys", str(i), 0.0) for i in range(3)]
+        for seconds, key in zip((30, 20), keys):
+            await cache.put(key, "x" * 100)
+            age(cache, key, seconds)
+        # A hit makes the oldest entry the most recently used.
+        assert await cache.get(keys[0]) == "x" * 100
+        cache.max_bytes = 2 * os.path.getsize(cache._path(keys[0])) + 16
+        await cache.put(keys[2], "x" * 100)
+        return cache, keys
+
+    cache, keys = asyncio.run(main())
+    assert os.path.exists(cache._path(keys[0]))
+    assert not os.path.exists(cache._path(keys[1]))
+    assert os.path.exists(cache._path(keys[2]))
+    assert cache.stats()["evictions"] == 1
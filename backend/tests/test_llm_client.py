@@ -0,0 +1,291 @@
+import time
+import asyncio
+
+import pytest
+
+from llm_client import CircuitBreaker, CircuitOpenError, ClientRegistry, LLMEvent, QueueFullError, RetryPolicy, SingleFlight, SlotLimiter
+
+
+def test_client_registry_reuses_clients_per_endpoint():
+    async def main():
+        registry = ClientRegistry(idle_ttl=60)
+        async with registry.lease("http://a/v1", "key", 30) as first:
+            async with registry.lease("http://a/v1", "key", 30) as again:
+                assert again is first
+                assert registry.stats() == {"clients": 1, "in_use": 2}
+        async with registry.lease("http://b/v1", "key", 30) as other:
+            assert other is not first
+        assert registry.stats() == {"clients": 2, "in_use": 0}
+        await registry.aclose()
+
+    asyncio.run(main())
+
+
+def test_client_registry_keys_never_hold_raw_api_keys():
+    key = ClientRegistry.make_key("http://a/v1", "sk-secret", 30)
+    assert "sk-secret" not in repr(key)
+    assert key != ClientRegistry.make_key("http://a/v1", "sk-other", 30)
+
+
+def test_client_registry_evicts_only_idle_clients():
+    async def main():
+        registry = ClientRegistry(idle_ttl=0.01)
+        async with registry.lease("http://idle/v1", "key", 30):
+            pass
+        async with registry.lease("http://busy/v1", "key", 30):
+            await asyncio.sleep(0.02)
+            await registry.evict_idle()
+            assert registry.stats() == {"clients": 1, "in_use": 1}
+        await registry.aclose()
+
+    asyncio.run(main())
+
+
+def test_client_registry_loop_evicts_without_new_leases():
+    async def main():
+        registry = ClientRegistry(idle_ttl=0.01)
+        async with registry.lease("http://a/v1", "key", 30):
+            pass
+        registry.start(interval=0.01)
+        await asyncio.sleep(0.05)
+        assert registry.stats()["clients"] == 0
+        await registry.stop()
+        await registry.aclose()
+
+    asyncio.run(main())
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+def test_retry_policy_retries_transient_errors_only():
+    policy = RetryPolicy()
+    assert policy.is_retryable(StatusError(429))
+    assert policy.is_retryable(StatusError(503))
+    assert policy.is_retryable(ConnectionError("reset"))
+    assert not policy.is_retryable(StatusError(400))
+    assert not policy.is_retryable(StatusError(401))
+
+
+def test_retry_policy_backoff_is_exponential_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.0)
+    assert [policy.compute_delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_retry_policy_jitter_stays_within_backoff():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0, jitter=1.0)
+    delays = [policy.compute_delay(3) for _ in range(200)]
+    assert all(0 <= d <= 4.0 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_retry_policy_honours_retry_after():
+    policy = RetryPolicy(base_delay=0.5, max_retry_after=10)
+    assert 3.0 <= policy.compute_delay(1, StatusError(429, {"retry-after": "3"})) <= 3.5
+    assert 0.25 <= policy.compute_delay(1, StatusError(429, {"retry-after-ms": "250"})) <= 0.75
+    assert policy.compute_delay(1, StatusError(429, {"retry-after": "600"})) <= 10.5
+    assert RetryPolicy(base_delay=1.0, jitter=0.0, respect_retry_after=False).compute_delay(1, StatusError(429, {"retry-after": "30"})) == 1.0
+
+
+def test_circuit_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker("http://a/v1", failure_threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time.
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_circuit_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker("http://a/v1", failure_threshold=1, reset_timeout=0.01)
+    breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+async def acquire(limiter, positions=None):
+    async for position in limiter.acquire():
+        if positions is not None:
+            positions.append(position)
+
+
+def test_slot_limiter_grants_free_slots_immediately():
+    async def main():
+        limiter = SlotLimiter("backend", max_in_flight=2, max_queue=1)
+        await acquire(limiter)
+        await acquire(limiter)
+        assert limiter.stats()["in_flight"] == 2
+        limiter.release()
+        limiter.release()
+        assert limiter.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_slot_limiter_hands_slots_over_in_fifo_order():
+    async def main():
+        limiter = SlotLimiter("backend", max_in_flight=1, max_queue=5)
+        await acquire(limiter)
+        order, positions = [], {}
+
+        async def waiter(name):
+            positions[name] = []
+            await acquire(limiter, positions[name])
+            order.append(name)
+
+        tasks = [asyncio.create_task(waiter(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        assert limiter.queued == 3
+        for _ in range(3):
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        assert positions["c"] == [3, 2, 1]
+        # The slot went from waiter to waiter without ever being free.
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_slot_limiter_rejects_when_queue_full():
+    async def main():
+        limiter = SlotLimiter("backend", max_in_flight=1, max_queue=1)
+        await acquire(limiter)
+        queued = asyncio.create_task(acquire(limiter))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await acquire(limiter)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_slot_limiter_cancelled_waiter_leaves_the_queue():
+    async def main():
+        limiter = SlotLimiter("backend", max_in_flight=1, max_queue=5)
+        await acquire(limiter)
+        gone = asyncio.create_task(acquire(limiter))
+        stays = asyncio.create_task(acquire(limiter))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.gather(gone, return_exceptions=True)
+        assert limiter.queued == 1
+        limiter.release()
+        await stays
+        assert limiter.in_flight == 1 and limiter.queued == 0
+
+    asyncio.run(main())
+
+
+async def source(texts, gate=None, started=None):
+    if started is not None:
+        started.append(True)
+    for text in texts:
+        if gate is not None:
+            await gate.wait()
+        yield LLMEvent(kind="delta", text=text)
+
+
+async def collect(flight, key, factory):
+    return [event.text async for event in flight.subscribe(key, factory)]
+
+
+def test_single_flight_coalesces_identical_requests():
+    async def main():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+        started = []
+        factory = lambda: source(["a", "b", "c"], gate, started)
+        first = asyncio.create_task(collect(flight, "k", factory))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(collect(flight, "k", factory))
+        await asyncio.sleep(0)
+        gate.set()
+        assert await first == ["a", "b", "c"]
+        assert await second == ["a", "b", "c"]
+        assert len(started) == 1
+        assert flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 1}
+
+    asyncio.run(main())
+
+
+def test_single_flight_late_joiner_replays_history():
+    async def main():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+
+        async def upstream():
+            yield LLMEvent(kind="delta", text="a")
+            await gate.wait()
+            yield LLMEvent(kind="delta", text="b")
+
+        early = asyncio.create_task(collect(flight, "k", upstream))
+        while not flight._flights.get("k") or not flight._flights["k"].events:
+            await asyncio.sleep(0)
+        late = asyncio.create_task(collect(flight, "k", lambda: source(["never"])))
+        await asyncio.sleep(0)
+        gate.set()
+        assert await early == ["a", "b"]
+        assert await late == ["a", "b"]
+
+    asyncio.run(main())
+
+
+def test_single_flight_propagates_errors_to_every_subscriber():
+    async def main():
+        flight = SingleFlight()
+
+        async def failing():
+            yield LLMEvent(kind="delta", text="a")
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(
+            collect(flight, "k", failing), collect(flight, "k", failing), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
+
+
+def test_single_flight_cancels_upstream_only_with_last_subscriber():
+    async def main():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+        first = asyncio.create_task(collect(flight, "k", lambda: source(["a"], gate)))
+        second = asyncio.create_task(collect(flight, "k", lambda: source(["a"], gate)))
+        await asyncio.sleep(0)
+        upstream = flight._flights["k"].task
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert not upstream.cancelled()
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert upstream.done()
+        assert "k" not in flight._flights
+
+    asyncio.run(main())
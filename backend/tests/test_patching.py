@@ -0,0 +1,88 @@
+import pytest
+
+from patching import PatchError, apply_patches, parse_unified_diff
+
+UTILS = """def add(a, b):
+    return a - b
+
+
+def mul(a, b):
+    return a * b
+"""
+
+
+def patch(files, diff):
+    return apply_patches(files, parse_unified_diff(diff))
+
+
+def test_applies_hunk_and_returns_only_changed_files():
+    diff = """--- a/utils.py
++++ b/utils.py
+@@ -1,2 +1,2 @@
+ def add(a, b):
+-    return a - b
++    return a + b
+"""
+    changed = patch({"utils.py": UTILS, "main.py": "print(1)\n"}, diff)
+    assert changed == {"utils.py": UTILS.replace("a - b", "a + b")}
+
+
+def test_wrong_line_numbers_and_stripped_blank_context_still_apply():
+    diff = """--- a/utils.py
++++ b/utils.py
+@@ -40,4 +40,5 @@
+
+ def mul(a, b):
+-    return a * b
++    # product
++    return b * a
+"""
+    changed = patch({"utils.py": UTILS}, diff)
+    assert changed["utils.py"].endswith("def mul(a, b):\n    # product\n    return b * a\n")
+
+
+def test_multiple_hunks_and_new_file():
+    diff = """--- a/utils.py
++++ b/utils.py
+@@ -1,2 +1,2 @@
+ def add(a, b):
+-    return a - b
++    return a + b
+@@ -5,2 +5,3 @@
+ def mul(a, b):
+     return a * b
++# end
+--- /dev/null
++++ b/helpers.py
+@@ -0,0 +1,2 @@
++X = 1
++Y = 2
+"""
+    changed = patch({"utils.py": UTILS}, diff)
+    assert changed["utils.py"] == UTILS.replace("a - b", "a + b") + "# end\n"
+    assert changed["helpers.py"] == "X = 1\nY = 2\n"
+
+
+def test_mismatched_context_raises():
+    diff = """--- a/utils.py
++++ b/utils.py
+@@ -1,1 +1,1 @@
+-def subtract(a, b):
++def minus(a, b):
+"""
+    with pytest.raises(PatchError, match="does not apply"):
+        patch({"utils.py": UTILS}, diff)
+
+
+@pytest.mark.parametrize("diff, message", [
+    ("--- a/missing.py\n+++ b/missing.py\n@@ -1 +1 @@\n-x\n+y\n", "unknown file"),
+    ("--- /dev/null\n+++ b/utils.py\n@@ -0,0 +1 @@\n+x\n", "already exists"),
+    ("--- a/utils.py\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n", "not supported"),
+])
+def test_unsupported_patches_raise(diff, message):
+    with pytest.raises(PatchError, match=message):
+        patch({"utils.py": UTILS}, diff)
+
+
+def test_text_without_diff_parses_to_nothing():
+    assert parse_unified_diff("Here is the fixed code, hope it helps!") == []
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def emit(name, log, delay=0.0, items=2):
+    async def run(state):
+        log.append(f"start {name}")
+        for i in range(items):
+            await asyncio.sleep(delay)
+            yield f"{name}{i}"
+        log.append(f"end {name}")
+    return run
+
+
+def run_pipeline(pipeline, state=None, **kwargs):
+    state = {} if state is None else state
+
+    async def main():
+        return [item async for item in pipeline.run(state, **kwargs)]
+    return asyncio.run(main()), state
+
+
+async def consume(pipeline, state):
+    return [item async for item in pipeline.run(state)]
+
+
+def test_validation_rejects_unknown_and_out_of_order_dependencies():
+    log = []
+    with pytest.raises(ValueError, match="unknown stage"):
+        Pipeline([Stage("a", emit("a", log), depends_on=["missing"])])
+    with pytest.raises(ValueError, match="declared after"):
+        Pipeline([Stage("a", emit("a", log), depends_on=["b"]), Stage("b", emit("b", log))])
+    with pytest.raises(ValueError, match="unique"):
+        Pipeline([Stage("a", emit("a", log)), Stage("a", emit("a", log))])
+
+
+def test_independent_stages_overlap_but_stream_in_declaration_order():
+    log = []
+    pipeline = Pipeline([
+        Stage("slow", emit("slow", log, delay=0.02)),
+        Stage("fast", emit("fast", log)),
+        Stage("last", emit("last", log), depends_on=["slow", "fast"]),
+    ])
+    items, state = run_pipeline(pipeline)
+    assert items == ["slow0", "slow1", "fast0", "fast1", "last0", "last1"]
+    # "fast" ran while "slow" was still going; its output was buffered.
+    assert log.index("end fast") < log.index("end slow")
+    assert log.index("start last") > log.index("end slow")
+    assert state["stages"] == {"slow": "done", "fast": "done", "last": "done"}
+
+
+def test_failure_aborts_run_and_cancels_stages_in_flight():
+    log = []
+
+    async def broken(state):
+        yield "broken0"
+        raise RuntimeError("stage crashed")
+
+    pipeline = Pipeline([
+        Stage("broken", broken),
+        Stage("slow", emit("slow", log, delay=1.0)),
+        Stage("after", emit("after", log), depends_on=["broken"]),
+    ])
+    state = {}
+    seen = []
+
+    async def main():
+        async for item in pipeline.run(state):
+            seen.append(item)
+
+    with pytest.raises(RuntimeError, match="stage crashed"):
+        asyncio.run(main())
+    assert seen == ["broken0"]
+    assert state["stages"]["broken"] == "failed"
+    assert state["stages"]["slow"] == "cancelled"
+    assert "end slow" not in log
+
+
+def test_when_and_skip_count_as_finished_for_dependents():
+    log = []
+    done = []
+    pipeline = Pipeline([
+        Stage("restored", emit("restored", log)),
+        Stage("optional", emit("optional", log), when=lambda state: state.get("enabled", False)),
+        Stage("final", emit("final", log), depends_on=["restored", "optional"]),
+    ])
+    items, state = run_pipeline(pipeline, skip=["restored"], on_stage_done=done.append)
+    assert items == ["final0", "final1"]
+    assert state["stages"] == {"restored": "restored", "optional": "skipped", "final": "done"}
+    assert done == ["final"]
+    assert log == ["start final", "end final"]
+
+
+def test_pipeline_can_run_again():
+    log = []
+    pipeline = Pipeline([Stage("only", emit("only", log, items=1))])
+    assert run_pipeline(pipeline)[0] == ["only0"]
+    assert run_pipeline(pipeline)[0] == ["only0"]
+
+
+def test_cancelled_run_starts_no_dependents():
+    log = []
+    pipeline = Pipeline([
+        Stage("a", emit("a", log, delay=0.05)),
+        Stage("b", emit("b", log), depends_on=["a"]),
+    ])
+    state = {}
+
+    async def main():
+        consumer = asyncio.create_task(consume(pipeline, state))
+        while "start a" not in log:
+            await asyncio.sleep(0)
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert state["stages"]["a"] == "cancelled"
+    assert "start b" not in log
+
+
+def test_dependents_of_a_failed_stage_never_start():
+    log = []
+
+    async def broken(state):
+        raise RuntimeError("stage crashed")
+        yield
+
+    pipeline = Pipeline([
+        Stage("slow", emit("slow", log, delay=0.05)),
+        Stage("broken", broken),
+        Stage("after", emit("after", log), depends_on=["broken"]),
+    ])
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await consume(pipeline, {})
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert "start after" not in log
@@ -0,0 +1,63 @@
+import sys
+import asyncio
+
+from cancellation import CancelToken
+from processes import ProcessRun
+
+
+def python(code, **kwargs):
+    return ProcessRun([sys.executable, "-c", code], **kwargs)
+
+
+def test_collects_both_streams_and_the_exit_code():
+    run = asyncio.run(python("import sys; print('out'); print('err', file=sys.stderr); sys.exit(3)").run())
+    assert (run.returncode, run.stdout, run.stderr) == (3, "out\n", "err\n")
+    assert not run.timed_out and not run.truncated
+
+
+def test_timeout_kills_the_process():
+    run = asyncio.run(python("import time; print('started', flush=True); time.sleep(30)", timeout=0.5).run())
+    assert run.timed_out
+    assert run.returncode != 0
+    assert run.stdout == "started\n"
+    assert run.duration < 10
+
+
+def test_output_is_capped_per_stream_and_the_rest_drained():
+    run = asyncio.run(python("import sys; sys.stdout.write('x' * 100000); sys.stderr.write('ok')", output_limit=1000).run())
+    assert run.returncode == 0
+    assert run.truncated
+    assert run.stdout.startswith("x" * 1000 + "\n[stdout truncated after 1000 bytes]")
+    assert run.stdout.count("x") == 1000
+    assert run.stderr == "ok"
+
+
+def test_split_utf8_sequences_are_not_mangled():
+    run = asyncio.run(python("import sys; sys.stdout.buffer.write('é'.encode() * 50000)").run())
+    assert run.stdout == "é" * 50000
+
+
+def test_cancel_token_kills_the_process():
+    async def main():
+        token = CancelToken()
+        run = python("import time; print('started', flush=True); time.sleep(30)", cancel_token=token)
+        async for stream, text in run.stream():
+            token.cancel()
+        return run
+
+    run = asyncio.run(main())
+    assert run.returncode != 0
+    assert not run.timed_out
+    assert run.duration < 10
+
+
+def test_batching_coalesces_output():
+    code = "import sys, time\nfor i in range(50):\n    print(i, flush=True)\n    time.sleep(0.002)"
+
+    async def main():
+        run = python(code, batch_interval=10, batch_bytes=1 << 20)
+        return [item async for item in run.stream()], run
+
+    chunks, run = asyncio.run(main())
+    assert chunks == [("stdout", run.stdout)]
+    assert run.stdout.split() == [str(i) for i in range(50)]
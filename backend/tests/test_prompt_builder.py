@@ -0,0 +1,45 @@
+from prompt_builder import PLAN, REQUEST, STATIC, WORKSPACE, PromptBuilder
+
+
+def test_segments_are_ordered_by_stability_then_insertion():
+    prompt = (
+        PromptBuilder()
+        .add("Request", "add a subtract function", REQUEST)
+        .add("Plan", "1. write calc.py", PLAN)
+        .add("", "You are a code generator.", STATIC)
+        .add("Notes", "keep it short", REQUEST)
+        .build()
+    )
+    assert prompt == (
+        "You are a code generator.\n\n"
+        "Plan:\n1. write calc.py\n\n"
+        "Request:\nadd a subtract function\n\n"
+        "Notes:\nkeep it short"
+    )
+
+
+def test_empty_segments_are_dropped():
+    prompt = PromptBuilder().add("Plan", "  \n", PLAN).add("Request", "go", REQUEST).build()
+    assert prompt == "Request:\ngo"
+
+
+def test_files_render_identically_regardless_of_dict_order():
+    a = PromptBuilder().add_files("Files", {"b.py": "B = 1", "a.py": "A = 1"}).build()
+    b = PromptBuilder().add_files("Files", {"a.py": "A = 1", "b.py": "B = 1"}).build()
+    assert a == b
+    assert a.index("--- a.py ---") < a.index("--- b.py ---")
+
+
+def test_request_change_keeps_the_prefix_identical():
+    def build(request):
+        return (
+            PromptBuilder()
+            .add("Request", request, REQUEST)
+            .add_files("Files", {"app.py": "X = 1"}, WORKSPACE)
+            .add("", "system rules", STATIC)
+            .build()
+        )
+
+    first, second = build("add tests"), build("fix the bug")
+    prefix = first[: first.index("Request:")]
+    assert second.startswith(prefix)
@@ -0,0 +1,86 @@
+import os
+import sys
+import asyncio
+
+from pytest_runner import DurationStore, PytestRun, collect_test_ids, estimate_test_count, plan_shards
+
+
+def durations(**seconds):
+    store = DurationStore()
+    store.update({f"t.py::{name}": value for name, value in seconds.items()})
+    return store
+
+
+def test_plan_shards_balances_by_known_durations():
+    ids = [f"t.py::{name}" for name in ("slow", "a", "b", "c")]
+    shards = plan_shards(ids, 2, durations(slow=3.0, a=1.0, b=1.0, c=1.0))
+    assert shards == [["t.py::slow"], ["t.py::a", "t.py::b", "t.py::c"]]
+
+
+def test_plan_shards_keeps_collection_order_and_drops_empty_shards():
+    ids = [f"t.py::test_{i}" for i in range(5)]
+    shards = plan_shards(ids, 2, DurationStore())
+    assert sorted(sum(shards, [])) == sorted(ids)
+    assert all(shard == sorted(shard, key=ids.index) for shard in shards)
+    assert plan_shards(ids[:1], 4, DurationStore()) == [ids[:1]]
+
+
+def test_unknown_tests_are_weighted_by_the_known_average():
+    ids = ["t.py::known", "t.py::new1", "t.py::new2"]
+    # new1 and new2 count as 2s each, so they can't share a shard with known.
+    assert plan_shards(ids, 2, durations(known=2.0)) == [["t.py::known", "t.py::new2"], ["t.py::new1"]]
+
+
+def test_duration_store_forgets_the_oldest_entries():
+    store = DurationStore(max_entries=2)
+    store.update({"a": 1.0, "b": 1.0})
+    store.update({"a": 2.0, "c": 1.0})
+    assert (store.get("a"), store.get("b"), store.get("c")) == (2.0, None, 1.0)
+
+
+def test_estimate_test_count_multiplies_literal_parametrize():
+    source = '''
+import pytest
+
+def helper():
+    pass
+
+def test_one():
+    pass
+
+@pytest.mark.parametrize("x", [1, 2, 3])
+@pytest.mark.parametrize("y", range(2))
+def test_grid(x, y):
+    pass
+
+class TestThing:
+    async def test_async(self):
+        pass
+'''
+    assert estimate_test_count({"tests/test_a.py": source, "tests/test_b.py": "def test_b():\n    pass\n"}) == 9
+
+
+def test_estimate_test_count_gives_up_on_dynamic_suites():
+    assert estimate_test_count({"t.py": "CASES = [1]\n@pytest.mark.parametrize('x', CASES)\ndef test_x(x):\n    pass\n"}) is None
+    assert estimate_test_count({"t.py": "@pytest.fixture(params=[1, 2])\ndef value(request):\n    pass\n"}) is None
+    assert estimate_test_count({"t.py": "def test_broken(:\n"}) is None
+
+
+def test_sharded_run_merges_the_summary(tmp_path):
+    with open(tmp_path / "test_suite.py", "w") as f:
+        f.write("import pytest\n\n@pytest.mark.parametrize('i', range(6))\ndef test_pass(i):\n    assert i >= 0\n\ndef test_fail():\n    assert False\n")
+    command = [sys.executable, "-m", "pytest", "-p", "no:cacheprovider"]
+    env = {**os.environ, "PYTHONPATH": str(tmp_path)}
+
+    async def main():
+        test_ids = await collect_test_ids(command, str(tmp_path), env, timeout=60)
+        store = DurationStore()
+        run = await PytestRun(command, plan_shards(test_ids, 2, store), cwd=str(tmp_path), env=env, timeout=60, durations=store).run()
+        return test_ids, store, run
+
+    test_ids, store, run = asyncio.run(main())
+    assert len(test_ids) == 7
+    assert run.sharded and len(run.runs) == 2
+    assert run.returncode == 1
+    assert "merged 2 shards: 1 failed, 6 passed" in run.stdout
+    assert all(store.get(test_id) is not None for test_id in test_ids)
@@ -0,0 +1,103 @@
+import os
+import asyncio
+import hashlib
+
+from sandboxes import SandboxPool
+
+
+def read(sandbox, relative):
+    with open(os.path.join(sandbox.root, relative), encoding="utf-8") as f:
+        return f.read()
+
+
+def lease_two(pool, first, second):
+    async def main():
+        async with pool.lease(first) as a, pool.lease(second) as b:
+            return a, b
+    return asyncio.run(main())
+
+
+def lease(pool, session_id="s1"):
+    async def main():
+        async with pool.lease(session_id) as sandbox:
+            return sandbox
+    return asyncio.run(main())
+
+
+def test_sync_writes_only_what_changed(tmp_path):
+    sandbox = lease(SandboxPool(str(tmp_path)))
+    files = {"app.py": "X = 1\n", "pkg/util.py": "Y = 2\n", "tests/test_app.py": "def test(): pass\n"}
+    first = sandbox.sync(files)
+    assert (first.written, first.unchanged) == (3, 0)
+
+    second = sandbox.sync({**files, "app.py": "X = 2\n"})
+    assert (second.written, second.unchanged, second.removed) == (1, 2, 0)
+    assert read(sandbox, "app.py") == "X = 2\n"
+
+
+def test_sync_removes_stale_and_test_written_files(tmp_path):
+    sandbox = lease(SandboxPool(str(tmp_path)))
+    sandbox.sync({"app.py": "X = 1\n", "old/gone.py": "Z = 0\n"})
+    with open(os.path.join(sandbox.root, "output.txt"), "w") as f:
+        f.write("written by a test")
+
+    stats = sandbox.sync({"app.py": "X = 1\n"})
+    assert stats.removed == 2
+    assert sorted(os.listdir(sandbox.root)) == ["app.py"]
+
+
+def test_sync_skips_artifacts_and_unsafe_paths(tmp_path):
+    sandbox = lease(SandboxPool(str(tmp_path)))
+    stats = sandbox.sync({"app.py": "X = 1\n", "TEST_RESULTS.log": "old log", "../escape.py": "bad", "/abs.py": "bad"})
+    assert (stats.written, stats.skipped) == (1, 3)
+    assert os.listdir(sandbox.root) == ["app.py"]
+    assert not os.path.exists(os.path.join(str(tmp_path), "s1", "escape.py"))
+
+
+def test_file_modified_in_place_is_restored(tmp_path):
+    sandbox = lease(SandboxPool(str(tmp_path)))
+    sandbox.sync({"app.py": "X = 1\n"})
+    with open(os.path.join(sandbox.root, "app.py"), "r+") as f:
+        f.write("X = 9")
+
+    stats = sandbox.sync({"app.py": "X = 1\n"})
+    assert stats.written == 1
+    assert read(sandbox, "app.py") == "X = 1\n"
+
+
+def test_in_place_write_stays_inside_its_sandbox(tmp_path):
+    pool = SandboxPool(str(tmp_path))
+    a, b = lease_two(pool, "a", "b")
+    a.sync({"app.py": "X = 1\n"})
+    b.sync({"app.py": "X = 1\n"})
+    with open(os.path.join(a.root, "app.py"), "r+") as f:
+        f.write("X = 9")
+
+    assert read(b, "app.py") == "X = 1\n"
+    assert b.sync({"app.py": "X = 1\n"}).unchanged == 1
+    assert os.stat(os.path.join(a.root, "app.py")).st_ino != os.stat(os.path.join(b.root, "app.py")).st_ino
+
+
+def test_corrupted_blob_is_replaced(tmp_path):
+    pool = SandboxPool(str(tmp_path))
+    data = b"X = 1\n"
+    digest = hashlib.sha1(data).hexdigest()
+    path = pool.blobs.put(digest, data)
+    os.chmod(path, 0o644)
+    with open(path, "wb") as f:
+        f.write(b"X = 2\n")
+
+    assert pool.blobs.put(digest, data) == path
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_concurrent_leases_get_separate_slots_and_idle_ones_are_collected(tmp_path):
+    pool = SandboxPool(str(tmp_path), idle_ttl=0)
+    a, b = lease_two(pool, "s1", "s1")
+    assert (a.slot, b.slot) == (0, 1)
+    a.sync({"app.py": "X = 1\n"})
+
+    assert asyncio.run(pool.collect_garbage()) == 2
+    assert not os.path.exists(a.root)
+    assert pool.stats()["sandboxes"] == 0
@@ -0,0 +1,73 @@
+from symbol_index import SymbolIndex, extract_symbols
+
+SOURCE = '''"""Shape helpers."""
+import math
+from .units import Metre
+
+SCALE = 2
+
+
+def area(radius: float) -> float:
+    """Area of a circle."""
+    return math.pi * radius ** 2
+
+
+class Square(Shape):
+    def __init__(self, side):
+        self.side = side
+
+    def _cached(self):
+        pass
+
+    async def draw(self, canvas):
+        pass
+'''
+
+
+def test_python_signatures_without_bodies():
+    entry = extract_symbols("geometry/shapes.py", SOURCE)
+    assert entry.module == "geometry.shapes"
+    assert entry.docstring == "Shape helpers."
+    assert entry.imports == ["math", ".units.Metre"]
+    assert entry.symbols == [
+        "SCALE = ...",
+        "def area(radius: float) -> float  # Area of a circle.",
+        "class Square(Shape)",
+        "    def __init__(self, side)",
+        "    async def draw(self, canvas)",
+    ]
+
+
+def test_broken_python_falls_back_to_regex():
+    entry = extract_symbols("app.py", "def ok(x):\n    pass\n\ndef broken(:\n")
+    assert entry.symbols == ["def ok(x)", "def broken("]
+
+
+def test_other_languages_use_patterns_and_unknown_files_are_skipped():
+    entry = extract_symbols("app.ts", "import { x } from './lib';\nexport function run(a: number): void {\n}\n")
+    assert entry.imports == ["./lib"]
+    assert entry.symbols == ["export function run(a: number): void"]
+    assert extract_symbols("README.md", "# Title") is None
+
+
+def test_unchanged_files_are_parsed_once():
+    index = SymbolIndex()
+    first = index.get("app.py", SOURCE)
+    assert index.get("app.py", SOURCE) is first
+    assert index.get("app.py", SOURCE + "\nX = 1\n") is not first
+
+
+def test_least_recently_used_entries_are_evicted():
+    index = SymbolIndex(max_entries=2)
+    a = index.get("a.py", "A = 1\n")
+    index.get("b.py", "B = 1\n")
+    index.get("a.py", "A = 1\n")
+    index.get("c.py", "C = 1\n")
+    assert index.get("a.py", "A = 1\n") is a
+    assert SymbolIndex.content_hash("b.py", "B = 1\n") not in index._by_hash
+
+
+def test_render_lists_files_without_symbols():
+    text = SymbolIndex().render({"app.py": "def main():\n    pass\n", "notes.txt": "hello"})
+    assert "--- app.py (module: app) ---\ndef main()" in text
+    assert text.endswith("Other files: notes.txt")
@@ -0,0 +1,64 @@
+import os
+import sys
+import asyncio
+
+from warm_runner import WarmRun, WarmRunner
+
+SUITE = "def test_ok():\n    print('hello from the test')\n\ndef test_bad():\n    assert 1 == 2\n"
+
+
+def suite(tmp_path):
+    with open(tmp_path / "test_suite.py", "w") as f:
+        f.write(SUITE)
+    return {**os.environ, "PYTHONPATH": str(tmp_path)}
+
+
+def run_with(runner, command, tmp_path, **kwargs):
+    async def main():
+        try:
+            run = await runner.process(command, cwd=str(tmp_path), env=suite(tmp_path), **kwargs)
+            return await run.run()
+        finally:
+            await runner.stop()
+    return asyncio.run(main())
+
+
+def test_pytest_runs_are_forked_warm_with_the_cold_result(tmp_path):
+    runner = WarmRunner()
+    run = run_with(runner, [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "-s"], tmp_path)
+    assert isinstance(run, WarmRun) and run.warm
+    assert run.returncode == 1
+    assert "hello from the test" in run.stdout
+    assert "1 failed, 1 passed" in run.stdout
+    assert (runner.starts, runner.warm_runs) == (1, 1)
+
+
+def test_other_commands_run_cold(tmp_path):
+    runner = WarmRunner()
+    run = run_with(runner, [sys.executable, "-c", "print('cold')"], tmp_path)
+    assert not isinstance(run, WarmRun)
+    assert run.stdout == "cold\n"
+    assert (runner.starts, runner.cold_runs) == (0, 1)
+
+
+def test_broken_interpreter_falls_back_to_cold_and_is_not_retried(tmp_path):
+    runner = WarmRunner()
+    missing = str(tmp_path / "no-such-python")
+
+    async def main():
+        first = await runner.get(missing)
+        second = await runner.get(missing)
+        return first, second
+
+    assert asyncio.run(main()) == (None, None)
+    assert runner.failures == 1
+
+
+def test_warm_run_timeout_kills_the_fork(tmp_path):
+    with open(tmp_path / "test_slow.py", "w") as f:
+        f.write("import time\n\ndef test_slow():\n    time.sleep(30)\n")
+    runner = WarmRunner()
+    run = run_with(runner, [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "test_slow.py"], tmp_path, timeout=3)
+    assert run.warm and run.timed_out
+    assert run.returncode != 0
+    assert run.duration < 15
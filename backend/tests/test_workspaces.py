@@ -0,0 +1,70 @@
+import os
+import asyncio
+
+import pytest
+
+from workspaces import InvalidPathError, QuotaExceededError, WorkspaceManager
+
+
+def manager(tmp_path, **kwargs):
+    return WorkspaceManager(default_root=str(tmp_path / "default"), sessions_dir=str(tmp_path / "sessions"), **kwargs)
+
+
+def test_gc_keeps_sessions_with_queued_jobs(tmp_path):
+    workspaces = manager(tmp_path, idle_ttl=0)
+    queued = workspaces.get("queued")
+    idle = workspaces.get("idle")
+    workspaces.busy = lambda: {"queued"}
+
+    assert asyncio.run(workspaces.collect_garbage()) == 1
+    assert os.path.isdir(queued.root)
+    assert not os.path.exists(idle.root)
+
+
+def test_paths_stay_inside_the_workspace(tmp_path):
+    workspace = manager(tmp_path).get("s1")
+    assert workspace.path("pkg/app.py") == os.path.join(os.path.realpath(workspace.root), "pkg", "app.py")
+    for bad in ("../s2/app.py", "/etc/passwd", "pkg/../../escape.py", "..\\escape.py"):
+        with pytest.raises(InvalidPathError):
+            workspace.path(bad)
+    with pytest.raises(InvalidPathError):
+        manager(tmp_path).get("../default")
+
+
+def test_sessions_are_isolated(tmp_path):
+    workspaces = manager(tmp_path)
+    workspaces.get("a").write_files({"app.py": "A = 1\n"})
+    workspaces.get("b").write_files({"app.py": "B = 1\n"})
+    assert workspaces.get("a").read_files() == {"app.py": "A = 1\n"}
+    assert workspaces.get("b").read_files() == {"app.py": "B = 1\n"}
+    assert workspaces.get().root == str(tmp_path / "default")
+
+
+def test_quota_rejects_the_whole_write(tmp_path):
+    workspace = manager(tmp_path, quota_mb=100 / (1024 * 1024), max_files=2).get("s1")
+    workspace.write_files({"a.py": "x" * 60})
+    with pytest.raises(QuotaExceededError, match="quota"):
+        workspace.write_files({"b.py": "x" * 30, "c.py": "x" * 30})
+    assert os.listdir(workspace.root) == ["a.py"]
+    # Overwriting only counts the growth.
+    workspace.write_files({"a.py": "x" * 90})
+    with pytest.raises(QuotaExceededError, match="file limit"):
+        workspace.write_files({"b.py": "", "c.py": ""})
+
+
+def test_gc_skips_leased_sessions_and_trims_the_oldest(tmp_path):
+    workspaces = manager(tmp_path, max_sessions=2)
+    for name, age in (("old", 30), ("new", 10), ("leased", 60)):
+        workspaces.get(name).last_used -= age
+    with workspaces.lease("leased"):
+        workspaces.get("leased").last_used -= 60
+        assert asyncio.run(workspaces.collect_garbage()) == 1
+    assert not os.path.exists(str(tmp_path / "sessions" / "old"))
+    assert sorted(os.listdir(tmp_path / "sessions")) == ["leased", "new"]
+
+
+def test_sessions_left_on_disk_are_collected(tmp_path):
+    os.makedirs(tmp_path / "sessions" / "stale")
+    os.utime(tmp_path / "sessions" / "stale", (0, 0))
+    assert asyncio.run(manager(tmp_path, idle_ttl=60).collect_garbage()) == 1
+    assert os.listdir(tmp_path / "sessions") == []
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+from typing import Dict, List, Optional, Tuple
+from cancellation import CancelToken, kill_process_group
+from processes import ProcessRun, PROCESS_OUTPUT_LIMIT
+
+# Keep resident interpreters with pytest pre-imported and fork test runs off
+# them (false: every run starts a cold `python -m pytest`).
+TEST_WARM_RUNNER = os.getenv("TEST_WARM_RUNNER", "true").lower() == "true"
+# Resident interpreters kept at most (one per dependency env in use).
+TEST_WARM_RUNNER_MAX = int(os.getenv("TEST_WARM_RUNNER_MAX", "4"))
+# Seconds an unused interpreter stays resident.
+TEST_WARM_RUNNER_IDLE = float(os.getenv("TEST_WARM_RUNNER_IDLE", "900"))
+
+WARM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_plugins", "agentforge_warm.py")
+# Preloading the dependency set can take a while on a fresh env.
+START_TIMEOUT = 60.0
+SPAWN_TIMEOUT = 10.0
+# After a failed start the interpreter is left cold for this long.
+RETRY_AFTER = 60.0
+SWEEP_INTERVAL = 60.0
+
+
+class WarmRunnerError(Exception):
+    pass
+
+
+class WarmInterpreter:
+    """One resident `agentforge_warm.py` process for a given python."""
+
+    def __init__(self, python: str):
+        self.python = python
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.preloaded: List[str] = []
+        self.active = 0
+        self.runs = 0
+        self.last_used = time.monotonic()
+        self._next_id = 0
+        self._spawned: Dict[int, asyncio.Future] = {}
+        self._exits: Dict[int, asyncio.Future] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        # A dependency env evicted from under us takes the interpreter with it.
+        return (
+            self.process is not None and self.process.returncode is None
+            and self._reader is not None and not self._reader.done()
+            and os.path.exists(self.python)
+        )
+
+    async def start(self, timeout: float = START_TIMEOUT):
+        env = os.environ.copy()
+        env.pop("PYTHONPATH", None)
+        self.process = await asyncio.create_subprocess_exec(
+            self.python, WARM_SCRIPT,
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+            hello = json.loads(line) if line else {}
+            if not hello.get("ready"):
+                raise WarmRunnerError(f"{self.python} did not start a warm runner")
+        except BaseException:
+            await self.stop()
+            raise
+        self.preloaded = hello.get("preloaded", [])
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for line in self.process.stdout:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                run_id = message.get("id")
+                if "pid" in message or "error" in message:
+                    future = self._spawned.pop(run_id, None)
+                    if future and not future.done():
+                        if "error" in message:
+                            future.set_exception(WarmRunnerError(message["error"]))
+                            self._exits.pop(run_id, None)
+                        else:
+                            future.set_result(message["pid"])
+                elif "exit" in message:
+                    future = self._exits.pop(run_id, None)
+                    if future and not future.done():
+                        future.set_result(message["exit"])
+        finally:
+            for future in list(self._spawned.values()) + list(self._exits.values()):
+                if not future.done():
+                    future.set_exception(WarmRunnerError("warm runner exited"))
+            self._spawned.clear()
+            self._exits.clear()
+
+    async def spawn(self, cwd: str, args: List[str], env: Dict[str, str], stdout: str, stderr: str) -> Tuple[int, asyncio.Future]:
+        """Forks a pytest run; returns its pid and a future for the exit code."""
+        if not self.alive:
+            raise WarmRunnerError("warm runner is not running")
+        self._next_id += 1
+        run_id = self._next_id
+        loop = asyncio.get_running_loop()
+        spawned = self._spawned[run_id] = loop.create_future()
+        exited = self._exits[run_id] = loop.create_future()
+        # Nobody may be waiting on it if the run gets cancelled.
+        exited.add_done_callback(lambda f: f.cancelled() or f.exception())
+        request = {"id": run_id, "cwd": cwd, "args": args, "env": env, "stdout": stdout, "stderr": stderr}
+        try:
+            self.process.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+            await self.process.stdin.drain()
+            pid = await asyncio.wait_for(asyncio.shield(spawned), SPAWN_TIMEOUT)
+        except BaseException:
+            self._spawned.pop(run_id, None)
+            self._exits.pop(run_id, None)
+            raise
+        self.runs += 1
+        self.last_used = time.monotonic()
+        return pid, exited
+
+    async def stop(self):
+        if self.process and self.process.returncode is None:
+            kill_process_group(self.process.pid)
+            await self.process.wait()
+        if self._reader:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+
+class WarmRun(ProcessRun):
+    """A ProcessRun whose process is forked off a WarmInterpreter.
+
+    `args` is the cold command (`python -m pytest ...`); if the fork fails
+    the run quietly falls back to starting it cold. The child's stdout and
+    stderr come back through two FIFOs; the server holds a read/write end
+    until the child has its copies, then swaps it for a read-only one so
+    the child closing them is seen as EOF.
+    """
+
+    def __init__(self, interpreter: WarmInterpreter, args: List[str], cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                 output_limit: int = PROCESS_OUTPUT_LIMIT, cancel_token: Optional[CancelToken] = None,
+                 batch_interval: float = 0, batch_bytes: int = 0):
+        super().__init__(args, cwd=cwd, env=env, timeout=timeout, output_limit=output_limit, cancel_token=cancel_token,
+                         batch_interval=batch_interval, batch_bytes=batch_bytes)
+        self.interpreter = interpreter
+        self.warm = False
+        self._exit: Optional[asyncio.Future] = None
+        self._fifo_dir: Optional[str] = None
+        self._transports = []
+
+    async def _start(self) -> Tuple[asyncio.StreamReader, asyncio.StreamReader]:
+        self.interpreter.active += 1
+        self._fifo_dir = tempfile.mkdtemp(prefix="warm-run-")
+        paths = [os.path.join(self._fifo_dir, name) for name in ("stdout", "stderr")]
+        holders = []
+        try:
+            for path in paths:
+                os.mkfifo(path)
+                holders.append(os.open(path, os.O_RDWR | os.O_NONBLOCK))
+            self.pid, self._exit = await self.interpreter.spawn(
+                os.path.abspath(self.cwd or "."), self.args[3:], dict(self.env or os.environ), *paths
+            )
+            readers = []
+            for path in paths:
+                readers.append(await self._connect(os.open(path, os.O_RDONLY | os.O_NONBLOCK)))
+        except (WarmRunnerError, asyncio.TimeoutError, OSError) as e:
+            self._kill()
+            self.pid = None
+            print(f"WarmRunner: {e!r}; running cold.")
+            return await super()._start()
+        except BaseException:
+            self._kill()
+            raise
+        finally:
+            for fd in holders:
+                os.close(fd)
+        self.warm = True
+        return readers[0], readers[1]
+
+    async def _connect(self, fd: int) -> asyncio.StreamReader:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0))
+        self._transports.append(transport)
+        return reader
+
+    async def _wait(self) -> int:
+        if not self.warm:
+            return await super()._wait()
+        try:
+            return await self._exit
+        except WarmRunnerError:
+            # Exit status lost with the interpreter; the output is all we have.
+            return 1
+
+    def _exited(self) -> bool:
+        if not self.warm:
+            return self.pid is None or super()._exited()
+        return self._exit.done()
+
+    def _kill(self):
+        if self.pid is not None:
+            kill_process_group(self.pid)
+
+    async def _cleanup(self):
+        self.interpreter.active -= 1
+        self.interpreter.last_used = time.monotonic()
+        for transport in self._transports:
+            transport.close()
+        if self._fifo_dir:
+            shutil.rmtree(self._fifo_dir, ignore_errors=True)
+
+
+class WarmRunner:
+    """Resident pytest interpreters, one per python (server or dependency env).
+
+    Started on first use, kept for `idle_timeout` seconds after the last
+    run and capped at `max_interpreters` (least recently used go first).
+    Any trouble starting one means cold runs for that python for a while.
+    """
+
+    def __init__(self, max_interpreters: int = TEST_WARM_RUNNER_MAX, idle_timeout: float = TEST_WARM_RUNNER_IDLE):
+        self.max_interpreters = max(1, max_interpreters)
+        self.idle_timeout = idle_timeout
+        self._interpreters: Dict[str, WarmInterpreter] = {}
+        self._starting: Dict[str, asyncio.Task] = {}
+        self._failed: Dict[str, float] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._prewarm_task: Optional[asyncio.Task] = None
+        self.starts = 0
+        self.failures = 0
+        self.warm_runs = 0
+        self.cold_runs = 0
+
+    async def _start(self, python: str) -> Optional[WarmInterpreter]:
+        interpreter = WarmInterpreter(python)
+        started = time.monotonic()
+        try:
+            await interpreter.start()
+        except Exception as e:
+            print(f"WarmRunner: failed to start for {python}: {e!r}")
+            self._failed[python] = time.monotonic()
+            self.failures += 1
+            return None
+        finally:
+            self._starting.pop(python, None)
+        print(f"WarmRunner: started for {python} in {time.monotonic() - started:.2f}s ({len(interpreter.preloaded)} packages preloaded)")
+        self.starts += 1
+        self._interpreters[python] = interpreter
+        await self.sweep(keep=python)
+        return interpreter
+
+    async def get(self, python: str) -> Optional[WarmInterpreter]:
+        interpreter = self._interpreters.get(python)
+        if interpreter and interpreter.alive:
+            interpreter.last_used = time.monotonic()
+            return interpreter
+        if interpreter:
+            del self._interpreters[python]
+            await interpreter.stop()
+        if time.monotonic() - self._failed.get(python, float("-inf")) < RETRY_AFTER:
+            return None
+        task = self._starting.get(python)
+        if task is None:
+            task = self._starting[python] = asyncio.create_task(self._start(python))
+        return await asyncio.shield(task)
+
+    async def process(self, command: List[str], **kwargs) -> ProcessRun:
+        """A run of `command`, forked warm when it is `python -m pytest ...`."""
+        if command[1:3] == ["-m", "pytest"]:
+            interpreter = await self.get(command[0])
+            if interpreter:
+                self.warm_runs += 1
+                return WarmRun(interpreter, command, **kwargs)
+        self.cold_runs += 1
+        return ProcessRun(command, **kwargs)
+
+    async def sweep(self, keep: Optional[str] = None):
+        now = time.monotonic()
+        idle = sorted((i.last_used, python) for python, i in self._interpreters.items() if python != keep)
+        excess = len(self._interpreters) - self.max_interpreters
+        for last_used, python in idle:
+            interpreter = self._interpreters[python]
+            if interpreter.alive and (interpreter.active or (excess <= 0 and now - last_used < self.idle_timeout)):
+                continue
+            del self._interpreters[python]
+            excess -= 1
+            await interpreter.stop()
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"WarmRunner: sweep failed: {e}")
+
+    def start(self, interval: float = SWEEP_INTERVAL):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop(interval))
+            # The server's own interpreter is what runs without a dependency env.
+            self._prewarm_task = asyncio.create_task(self.get(sys.executable))
+
+    async def stop(self):
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+            self._sweep_task = None
+        for task in list(self._starting.values()) + [self._prewarm_task]:
+            if task:
+                task.cancel()
+        await asyncio.gather(*self._starting.values(), return_exceptions=True)
+        interpreters, self._interpreters = list(self._interpreters.values()), {}
+        await asyncio.gather(*(i.stop() for i in interpreters), return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": True,
+            "interpreters": [
+                {"python": i.python, "alive": i.alive, "active": i.active, "runs": i.runs,
+                 "preloaded": len(i.preloaded), "idle_seconds": round(time.monotonic() - i.last_used, 1)}
+                for i in self._interpreters.values()
+            ],
+            "starts": self.starts,
+            "failures": self.failures,
+            "warm_runs": self.warm_runs,
+            "cold_runs": self.cold_runs,
+        }
+
+
+warm_runner: Optional[WarmRunner] = WarmRunner() if TEST_WARM_RUNNER else None
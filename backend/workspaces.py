@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import shutil
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Set
+
+# The "default" session keeps using the original workspace dir (and its docker volume).
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "/app/workspace")
+WORKSPACE_SESSIONS_DIR = os.getenv("WORKSPACE_SESSIONS_DIR", "/app/sessions")
+WORKSPACE_QUOTA_MB = float(os.getenv("WORKSPACE_QUOTA_MB", "200"))
+WORKSPACE_MAX_FILES = int(os.getenv("WORKSPACE_MAX_FILES", "2000"))
+WORKSPACE_MAX_SESSIONS = int(os.getenv("WORKSPACE_MAX_SESSIONS", "100"))
+# Sessions untouched for this many seconds are deleted by the GC loop.
+WORKSPACE_IDLE_TTL = float(os.getenv("WORKSPACE_IDLE_TTL", str(24 * 3600)))
+WORKSPACE_GC_INTERVAL = float(os.getenv("WORKSPACE_GC_INTERVAL", "600"))
+
+DEFAULT_SESSION = "default"
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def disk_usage(root: str) -> Dict[str, int]:
+    size, count = 0, 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+                count += 1
+            except OSError:
+                pass
+    return {"bytes": size, "files": count}
+
+
+class InvalidPathError(ValueError):
+    pass
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class Workspace:
+    def __init__(self, session_id: str, root: str, quota_bytes: int, max_files: int):
+        self.session_id = session_id
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_files = max_files
+        self.last_used = time.time()
+        self.active = 0
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def path(self, relative: str) -> str:
+        relative = (relative or "").replace("\\", "/")
+        if ".." in relative.split("/") or relative.startswith("/") or os.path.isabs(relative):
+            raise InvalidPathError(f"Invalid path: {relative}")
+        full = os.path.realpath(os.path.join(self.root, relative))
+        root = os.path.realpath(self.root)
+        if full != root and not full.startswith(root + os.sep):
+            raise InvalidPathError(f"Invalid path: {relative}")
+        return full
+
+    def usage(self) -> Dict[str, int]:
+        return disk_usage(self.root)
+
+    def check_quota(self, added_bytes: int = 0, added_files: int = 0):
+        usage = self.usage()
+        if self.quota_bytes and usage["bytes"] + added_bytes > self.quota_bytes:
+            mb = 1024 * 1024
+            raise QuotaExceededError(
+                f"Workspace quota exceeded ({(usage['bytes'] + added_bytes) / mb:.1f}MB > {self.quota_bytes / mb:.1f}MB)"
+            )
+        if self.max_files and usage["files"] + added_files > self.max_files:
+            raise QuotaExceededError(f"Workspace file limit exceeded ({usage['files'] + added_files} > {self.max_files})")
+
+    def write_files(self, files: Dict[str, str]):
+        targets = {self.path(name): content for name, content in files.items()}
+        added_bytes, added_files = 0, 0
+        for target, content in targets.items():
+            new_size = len(content.encode("utf-8"))
+            if os.path.exists(target):
+                added_bytes += new_size - os.path.getsize(target)
+            else:
+                added_bytes += new_size
+                added_files += 1
+        self.check_quota(added_bytes, added_files)
+        for target, content in targets.items():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(content)
+        self.touch()
+
+    def read_files(self, include_binary: bool = True) -> Dict[str, str]:
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(full, self.root).replace("\\", "/")
+                try:
+                    with open(full, "r", encoding="utf-8") as f:
+                        files[rel_path] = f.read()
+                except UnicodeDecodeError:
+                    if include_binary:
+                        files[rel_path] = ""
+                except Exception as e:
+                    print(f"Error reading {rel_path}: {e}")
+        self.touch()
+        return files
+
+    def clear(self):
+        for item in os.listdir(self.root):
+            item_path = os.path.join(self.root, item)
+            if os.path.isfile(item_path) or os.path.islink(item_path):
+                os.unlink(item_path)
+            elif os.path.isdir(item_path):
+                shutil.rmtree(item_path)
+        self.touch()
+
+    def stats(self) -> Dict:
+        return {"root": self.root, "active": self.active, "idle_seconds": round(time.time() - self.last_used), **self.usage()}
+
+
+class WorkspaceManager:
+    """Maps session ids to isolated workspace roots.
+
+    Sessions in use (a generation or terminal holding a `lease`, or a job
+    still queued for them, as reported by `busy`) are never collected; the
+    rest are removed once idle for `idle_ttl` seconds, or oldest first when
+    there are more than `max_sessions`.
+    """
+
+    def __init__(
+        self,
+        default_root: str = WORKSPACE_ROOT,
+        sessions_dir: str = WORKSPACE_SESSIONS_DIR,
+        quota_mb: float = WORKSPACE_QUOTA_MB,
+        max_files: int = WORKSPACE_MAX_FILES,
+        max_sessions: int = WORKSPACE_MAX_SESSIONS,
+        idle_ttl: float = WORKSPACE_IDLE_TTL,
+    ):
+        self.default_root = default_root
+        self.sessions_dir = sessions_dir
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.max_files = max_files
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._workspaces: Dict[str, Workspace] = {}
+        self._gc_task: Optional[asyncio.Task] = None
+        # Returns the sessions with work pending elsewhere (queued jobs).
+        self.busy: Callable[[], Set[str]] = set
+        self.collected = 0
+
+    def get(self, session_id: Optional[str] = None) -> Workspace:
+        session_id = session_id or DEFAULT_SESSION
+        if not _SESSION_ID.match(session_id):
+            raise InvalidPathError(f"Invalid session id: {session_id}")
+        workspace = self._workspaces.get(session_id)
+        if workspace is None:
+            root = self.default_root if session_id == DEFAULT_SESSION else os.path.join(self.sessions_dir, session_id)
+            os.makedirs(root, exist_ok=True)
+            workspace = Workspace(session_id, root, self.quota_bytes, self.max_files)
+            self._workspaces[session_id] = workspace
+        workspace.touch()
+        return workspace
+
+    @contextmanager
+    def lease(self, session_id: Optional[str] = None):
+        workspace = self.get(session_id)
+        workspace.active += 1
+        try:
+            yield workspace
+        finally:
+            workspace.active -= 1
+            workspace.touch()
+
+    def _discover(self):
+        # Pick up sessions left on disk by a previous process so they get collected too.
+        if not os.path.isdir(self.sessions_dir):
+            return
+        for name in os.listdir(self.sessions_dir):
+            if name not in self._workspaces and _SESSION_ID.match(name):
+                root = os.path.join(self.sessions_dir, name)
+                workspace = Workspace(name, root, self.quota_bytes, self.max_files)
+                workspace.last_used = os.path.getmtime(root)
+                self._workspaces[name] = workspace
+
+    def _idle_victims(self) -> list:
+        self._discover()
+        now = time.time()
+        busy = self.busy()
+        idle = sorted(
+            (w for w in self._workspaces.values() if w.session_id != DEFAULT_SESSION and w.active == 0 and w.session_id not in busy),
+            key=lambda w: w.last_used,
+        )
+        victims = [w for w in idle if now - w.last_used > self.idle_ttl]
+        sessions = sum(1 for name in self._workspaces if name != DEFAULT_SESSION)
+        overflow = sessions - len(victims) - self.max_sessions
+        victims.extend([w for w in idle if w not in victims][:max(0, overflow)])
+        return victims
+
+    async def collect_garbage(self) -> int:
+        victims = self._idle_victims()
+        # Unregister first so a new request for the id starts from a fresh dir.
+        for workspace in victims:
+            self._workspaces.pop(workspace.session_id, None)
+        for workspace in victims:
+            await asyncio.to_thread(shutil.rmtree, workspace.root, True)
+            print(f"Workspaces: removed idle session {workspace.session_id}")
+        self.collected += len(victims)
+        return len(victims)
+
+    async def _gc_loop(self, interval: float):
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                print(f"Workspaces: GC failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = WORKSPACE_GC_INTERVAL, busy: Optional[Callable[[], Set[str]]] = None):
+        if busy is not None:
+            self.busy = busy
+        if self._gc_task is None:
+            self._gc_task = asyncio.create_task(self._gc_loop(interval))
+
+    async def stop(self):
+        if self._gc_task:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self._workspaces),
+            "active": sum(1 for w in self._workspaces.values() if w.active),
+            "collected": self.collected,
+            "quota_mb": self.quota_bytes / (1024 * 1024),
+            "max_files": self.max_files,
+        }
+
+
+workspace_manager = WorkspaceManager()
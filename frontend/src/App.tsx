@@ -7,6 +7,7 @@ import { AgentStatus } from './components/AgentStatus'
 import { FileCode, MonitorPlay, ArrowRight, Bot, FolderOpen, X, Copy, Download, Check, Play, ChevronDown, ChevronUp, RefreshCw, Mic, MicOff, Hammer, Plus, FolderPlus, Trash2, Terminal } from 'lucide-react'
 import { Terminal as XTerminal } from './components/Terminal';
 import type { TerminalRef } from './components/Terminal';
+import { SESSION_ID, withSession } from './lib/session';
 import { cn } from './lib/utils'
 import { FileExplorer } from './components/FileExplorer';
 import CodeEditor from './components/CodeEditor';
@@ -148,7 +149,7 @@ function App() {
   useEffect(() => {
     const fetchFiles = async () => {
       try {
-        const res = await fetch('http://localhost:8000/list-files');
+        const res = await fetch(withSession('http://localhost:8000/list-files'));
         if (res.ok) {
           const data = await res.json();
           if (data.files) {
@@ -263,7 +264,7 @@ function App() {
 
   const handleDelete = async () => {
     try {
-      const response = await fetch('http://localhost:8000/delete-item', {
+      const response = await fetch(withSession('http://localhost:8000/delete-item'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ path: deleteModal.path })
@@ -300,7 +301,7 @@ function App() {
     const newPath = parent ? `${parent}/${newName}` : newName;
 
     try {
-      const response = await fetch('http://localhost:8000/rename-item', {
+      const response = await fetch(withSession('http://localhost:8000/rename-item'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ old_path: oldPath, new_path: newPath })
@@ -351,7 +352,7 @@ function App() {
     if (newPath === sourcePath) return;
 
     try {
-      const response = await fetch('http://localhost:8000/rename-item', {
+      const response = await fetch(withSession('http://localhost:8000/rename-item'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ old_path: sourcePath, new_path: newPath })
@@ -426,7 +427,7 @@ function App() {
     const newPath = parent ? `${parent}/${newName}` : newName;
 
     try {
-      const response = await fetch('http://localhost:8000/duplicate-item', {
+      const response = await fetch(withSession('http://localhost:8000/duplicate-item'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ source_path: sourcePath, new_path: newPath })
@@ -457,7 +458,7 @@ function App() {
 
   const handleDeleteAll = async () => {
     try {
-      const response = await fetch('http://localhost:8000/delete-all', { method: 'POST' });
+      const response = await fetch(withSession('http://localhost:8000/delete-all'), { method: 'POST' });
       if (!response.ok) throw new Error('Failed to delete all');
       setGeneratedFiles({});
       setOpenFiles([]);
@@ -520,13 +521,21 @@ function App() {
     }
   };
 
+  const cancelGeneration = () => {
+    const ws = wsRef.current;
+    if (!ws) return;
+    // Tell the backend to stop the job now instead of waiting out the disconnect grace period
+    if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'cancel' }));
+    ws.close();
+  };
+
   const startGeneration = () => {
     if (!prompt.trim()) return;
     setIsProcessing(true);
     setTimeline([]);
     // Do not clear files to prevent flicker and loss of context
 
-    if (wsRef.current) wsRef.current.close();
+    cancelGeneration();
 
     const ws = new WebSocket(socketUrl);
     wsRef.current = ws;
@@ -537,7 +546,8 @@ function App() {
         use_local_llm: useLocalLLM,
         api_key: !useLocalLLM ? openAiKey : undefined,
         auto_fix: autoFix,
-        language: language
+        language: language,
+        session_id: SESSION_ID
       }));
     };
 
@@ -569,6 +579,24 @@ function App() {
         return;
       }
 
+      if (data.is_partial) {
+        if (data.log_chunk) {
+          // Append-only log streaming; offset 0 starts a new run of the log
+          const { log_file: logFile, log_chunk: chunk, log_offset: offset } = data;
+          if (offset === 0) lastTestLogLenRef.current = 0;
+          if (offset === lastTestLogLenRef.current) {
+            terminalRef.current?.writeToTerminal(chunk.replace(/\n/g, '\r\n'));
+            lastTestLogLenRef.current = offset + chunk.length;
+          }
+          setGeneratedFiles(prev => ({ ...prev, [logFile]: (offset === 0 ? '' : (prev[logFile] ?? '').slice(0, offset)) + chunk }));
+        } else if (data.stream_reset) {
+          terminalRef.current?.writeToTerminal('\r\n[retrying LLM request]\r\n');
+        } else if (data.partial_output) {
+          terminalRef.current?.writeToTerminal(data.partial_output.replace(/\n/g, '\r\n'));
+        }
+        return;
+      }
+
       if (data.agent_name === 'Tester' && data.files && data.files["TEST_RESULTS.log"]) {
         const fullLog = data.files["TEST_RESULTS.log"];
         const newContent = fullLog.slice(lastTestLogLenRef.current);
@@ -676,7 +704,7 @@ function App() {
         const fileBase = filename.split('/').pop() || filename;
         const name = fileBase.split('.')[0];
 
-        const WORKSPACE_BASE = '/app/workspace';
+        const WORKSPACE_BASE = '$WORKSPACE'; // exported by the backend terminal for this session
         const absDir = dir === '.' ? WORKSPACE_BASE : `${WORKSPACE_BASE}/${dir}`;
 
         let cmd = '';
@@ -729,7 +757,7 @@ function App() {
       const fileBase = filename.split('/').pop() || filename;
       const name = fileBase.split('.')[0];
 
-      const WORKSPACE_BASE = '/app/workspace';
+      const WORKSPACE_BASE = '$WORKSPACE'; // exported by the backend terminal for this session
       const absDir = dir === '.' ? WORKSPACE_BASE : `${WORKSPACE_BASE}/${dir}`;
 
       let cmd = '';
@@ -765,7 +793,7 @@ function App() {
 
   const handleSave = async (filename: string, content: string) => {
     try {
-      const response = await fetch('http://localhost:8000/save-file', {
+      const response = await fetch(withSession('http://localhost:8000/save-file'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ filename, content }),
@@ -802,7 +830,7 @@ function App() {
 
   const handleCreateFolder = async (folderName: string) => {
     try {
-      const response = await fetch('http://localhost:8000/create-folder', {
+      const response = await fetch(withSession('http://localhost:8000/create-folder'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ path: folderName }),
@@ -1084,7 +1112,7 @@ function App() {
                 </Button>
 
                 {isProcessing && (
-                  <Button variant="destructive" size="icon" className="aspect-square rounded-xl shadow-sm" onClick={() => { if (wsRef.current) wsRef.current.close(); setIsProcessing(false); }} title="Stop Generation">
+                  <Button variant="destructive" size="icon" className="aspect-square rounded-xl shadow-sm" onClick={() => { cancelGeneration(); setIsProcessing(false); }} title="Stop Generation">
                     <X className="w-4 h-4" />
                   </Button>
                 )}
@@ -1190,7 +1218,7 @@ function App() {
                     className="flex-1 gap-2 border-primary/20 hover:bg-primary/10 hover:text-primary transition-colors h-8 text-xs"
                     onClick={() => {
                       const link = document.createElement('a');
-                      link.href = 'http://localhost:8000/download-project';
+                      link.href = withSession('http://localhost:8000/download-project');
                       link.download = 'project_files.zip';
                       document.body.appendChild(link);
                       link.click();
@@ -1,6 +1,7 @@
 import { useState } from 'react';
 import { ChevronRight, ChevronDown, File, Folder, Code, FileText, Image, Layout, Globe, ExternalLink, MoreHorizontal } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
+import { previewUrl } from '../lib/session';
 
 interface FileNode {
     [key: string]: string | FileNode;
@@ -51,7 +52,7 @@ const FileItem = ({ name, content, path, onSelect, onContextMenu, onAction }: {
             <div className="flex items-center">
                 {name.endsWith('.html') && (
                     <a
-                        href={`http://localhost:8000/preview/${path}`}
+                        href={previewUrl(path)}
                         target="_blank"
                         rel="noopener noreferrer"
                         className="opacity-0 group-hover:opacity-100 p-1 hover:bg-white/10 rounded"
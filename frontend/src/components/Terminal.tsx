@@ -2,6 +2,7 @@ import { useEffect, useRef, useImperativeHandle, forwardRef } from 'react';
 import { Terminal as XTerm } from 'xterm';
 import { FitAddon } from 'xterm-addon-fit';
 import 'xterm/css/xterm.css';
+import { withSession } from '../lib/session';
 
 export interface TerminalRef {
     writeToTerminal: (data: string) => void;
@@ -13,7 +14,7 @@ interface TerminalProps {
     height?: number; // Optional height prop
 }
 
-export const Terminal = forwardRef<TerminalRef, TerminalProps>(({ wsUrl = 'ws://localhost:8000/terminal', height }, ref) => {
+export const Terminal = forwardRef<TerminalRef, TerminalProps>(({ wsUrl = withSession('ws://localhost:8000/terminal'), height }, ref) => {
     const terminalRef = useRef<HTMLDivElement>(null);
     const xtermRef = useRef<XTerm | null>(null);
     const wsRef = useRef<WebSocket | null>(null);
@@ -0,0 +1,27 @@
+const STORAGE_KEY = 'agentforge-session-id';
+
+const createSessionId = () => {
+    const id = typeof crypto !== 'undefined' && 'randomUUID' in crypto
+        ? crypto.randomUUID()
+        : `${Date.now().toString(36)}${Math.random().toString(36).slice(2)}`;
+    return id.replace(/-/g, '').slice(0, 24);
+};
+
+// One isolated backend workspace per browser, kept across reloads.
+export const SESSION_ID = (() => {
+    try {
+        const existing = localStorage.getItem(STORAGE_KEY);
+        if (existing) return existing;
+        const id = createSessionId();
+        localStorage.setItem(STORAGE_KEY, id);
+        return id;
+    } catch {
+        return createSessionId();
+    }
+})();
+
+export const withSession = (url: string) =>
+    `${url}${url.includes('?') ? '&' : '?'}session_id=${encodeURIComponent(SESSION_ID)}`;
+
+export const previewUrl = (path: string) =>
+    `http://localhost:8000/sessions/${SESSION_ID}/preview/${path}`;